@@ -1,6 +1,9 @@
 import unittest
 import os
-from jsonl2text import JSONL2Text
+import json
+import shutil
+import tempfile
+from libraries.converters.jsonl2text import JSONL2Text, get_shards
 
 class TestJSONL2Text(unittest.TestCase):
     def setUp(self):
@@ -29,7 +32,49 @@ class TestJSONL2Text(unittest.TestCase):
         self.assertTrue(os.path.exists(output_file_name))
 
 
-    
+    def test_sharded_conversion_matches_sequential_conversion(self):
+        test_dir = tempfile.mkdtemp()
+        try:
+            input_file_name = os.path.join(test_dir, "sample.jsonl")
+            with open(input_file_name, "w", encoding="utf-8") as f:
+                for i in range(500):
+                    record = {"title": f"title {i}", "news_article": {"text": "é texte " * (i % 17)}}
+                    if i % 5 == 0:
+                        record["title"] = ""
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+            fields = ["title", "news_article.text"]
+            size = os.path.getsize(input_file_name)
+            shard_count = 3
+            # the raw split offsets fall in the middle of a line, the shards end after the next newline
+            with open(input_file_name, "rb") as f:
+                data = f.read()
+            self.assertTrue(any(data[size * i // shard_count - 1:size * i // shard_count] != b"\n" for i in range(1, shard_count)))
+            shards = get_shards(input_file_name, shard_count)
+            self.assertEqual(len(shards), shard_count)
+            self.assertEqual(shards[0][0], 0)
+            self.assertEqual(shards[-1][1], size)
+            for (_, end), (start, _) in zip(shards, shards[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(data[end - 1:end], b"\n")
+
+            sequential_file_name = os.path.join(test_dir, "sequential.txt")
+            sequential_converter = JSONL2Text()
+            sequential_converter.configure(input_file_name, sequential_file_name, fields=fields)
+            self.assertTrue(sequential_converter.convert())
+
+            sharded_file_name = os.path.join(test_dir, "sharded.txt")
+            sharded_converter = JSONL2Text()
+            sharded_converter.configure(input_file_name, sharded_file_name, fields=fields, workers=shard_count, shard_size=1)
+            self.assertTrue(sharded_converter.is_sharded())
+            self.assertTrue(sharded_converter.convert())
+
+            with open(sequential_file_name, "rb") as sequential_file, open(sharded_file_name, "rb") as sharded_file:
+                self.assertEqual(sharded_file.read(), sequential_file.read())
+            self.assertEqual([name for name in os.listdir(test_dir) if name.endswith(".part")], [])
+        finally:
+            shutil.rmtree(test_dir)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,22 +1,147 @@
 import logging
 from . converter import Converter
 
+import io
 import json
 import os
+import gzip
+import mmap
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def get_field(data, path):
+    """Returns the value at a dotted field path, e.g. news_article.text, None when it is missing"""
+    value = data
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def extract_text(data, fields):
+    """Returns the text of a JSONL record: one line per non-empty string field, in the order of fields"""
+    return "".join(
+        value + "\n" for value in (get_field(data, path) for path in fields)
+        if isinstance(value, str) and value
+    )
+
+
+def get_shards(file_name, count):
+    """Splits a JSONL file in at most count (start, end) byte ranges, every range ends after a newline"""
+    size = os.path.getsize(file_name)
+    if size == 0:
+        return []
+    with open(file_name, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        shards = []
+        start = 0
+        for i in range(1, count):
+            newline = data.find(b"\n", max(start, size * i // count))
+            if newline == -1:
+                break
+            if newline + 1 > start:
+                shards.append((start, newline + 1))
+                start = newline + 1
+        if start < size:
+            shards.append((start, size))
+    return shards
+
+
+def convert_shard(file_name, start, end, fields, shard_file_name):
+    """Writes the text of the records of the [start, end) byte range of a JSONL file to shard_file_name.
+    The input is memory mapped, so the worker only reads the pages of its range."""
+    with open(file_name, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+            open(shard_file_name, "wb") as text_file:
+        position = start
+        while position < end:
+            newline = data.find(b"\n", position, end)
+            line_end = end if newline == -1 else newline
+            line = data[position:line_end]
+            position = line_end + 1
+            if line.strip():
+                text = extract_text(json.loads(line), fields)
+                if text:
+                    text_file.write(text.encode("utf-8"))
+    return shard_file_name
+
+
+class JSONLTextTee:
+    """Extracts the text of the items written to a JSONL output while they are written, to a binary output
+    (a file or a streaming upload), so the output does not have to be read again to convert it"""
+
+    def __init__(self, output, fields=None):
+        self.output = output
+        self.fields = list(fields or JSONL2Text.DEFAULT_FIELDS)
+        self.items = 0
+
+    def write_item(self, item) -> None:
+        text = extract_text(item, self.fields)
+        if text:
+            self.output.write(text.encode("utf-8"))
+        self.items += 1
+
+    def write_file(self, file_name) -> None:
+        """Extracts the text of the records a JSONL file already holds, e.g. an output restored from a checkpoint"""
+        with JSONL2Text.open_input(file_name) as jsonl_file:
+            for line in jsonl_file:
+                if line.strip():
+                    self.write_item(json.loads(line))
+
 
 class JSONL2Text(Converter):
+    # records written before TalkWalker used text, fields can be configured per converter
+    DEFAULT_FIELDS = ["text"]
+    # smaller inputs are not worth starting worker processes
+    MIN_SHARD_SIZE = 64 * 1024 * 1024
+
     def __init__(self):
         Converter.__init__(self)
         self.input_file_name = None
         self.output_file_name = None
+        self.output_stream = None
+        self.fields = list(self.DEFAULT_FIELDS)
+        self.workers = 1
+        self.shard_size = self.MIN_SHARD_SIZE
         logging.basicConfig(
             format="%(asctime)s %(levelname)s: %(message)s", level=logging.DEBUG
         )
         self.logger = logging.getLogger()
 
-    def configure(self, input_file_name, output_file_name):
+    def configure(self, input_file_name, output_file_name, output_stream=None, fields=None, workers=1,
+                  shard_size=MIN_SHARD_SIZE):
+        """output_stream is an optional binary stream (e.g. a streaming upload) written instead of output_file_name,
+        fields are the dotted paths of the text fields of a record, e.g. ["title", "body", "news_article.text"].
+        With workers > 1 an uncompressed input of at least shard_size bytes is converted in shards by a process pool."""
         self.input_file_name = input_file_name
         self.output_file_name = output_file_name
+        self.output_stream = output_stream
+        if fields:
+            self.fields = list(fields)
+        self.workers = max(1, workers)
+        self.shard_size = max(1, shard_size)
+
+    def is_sharded(self):
+        return (
+            self.workers > 1
+            and not self.input_file_name.endswith((".gz", ".zst"))
+            and os.path.getsize(self.input_file_name) >= self.shard_size
+        )
+
+    @staticmethod
+    def open_input(file_name):
+        """Opens a .jsonl file for reading, .jsonl.gz and .jsonl.zst files are decompressed on the fly"""
+        if file_name.endswith(".gz"):
+            return gzip.open(file_name, "rt", encoding="utf-8")
+        if file_name.endswith(".zst"):
+            reader = zstandard.ZstdDecompressor().stream_reader(open(file_name, "rb"), read_across_frames=True)
+            return io.TextIOWrapper(reader, encoding="utf-8")
+        return open(file_name, "r", encoding="utf-8")
 
     def convert(self):
         if not self.input_file_name or not self.output_file_name:
@@ -26,17 +151,14 @@ class JSONL2Text(Converter):
         try:
             self.logger.info(f"converting JSONL from {self.input_file_name}.")
 
-            with open(self.input_file_name, "r", encoding="utf-8") as jsonl_file:
-                lines = jsonl_file.readlines()
-                extracted_text = ""
-
-                for line in lines:
-                    data = json.loads(line)
-                    if "text" in data:
-                        extracted_text += data["text"] + "\n"
-
-            with open(self.output_file_name, "w", encoding="utf-8") as text_file:
-                text_file.write(extracted_text)
+            if self.is_sharded():
+                self.convert_sharded()
+            # records are read and written one line at a time
+            elif self.output_stream is not None:
+                JSONLTextTee(self.output_stream, self.fields).write_file(self.input_file_name)
+            else:
+                with open(self.output_file_name, "wb") as text_file:
+                    JSONLTextTee(text_file, self.fields).write_file(self.input_file_name)
 
             self.logger.info(f"{self.output_file_name} is written completely.")
             return True
@@ -45,6 +167,40 @@ class JSONL2Text(Converter):
             print(e)
             return False
 
+    def convert_sharded(self):
+        """Converts newline aligned shards of the input in worker processes, then appends the shard texts in order"""
+        size = os.path.getsize(self.input_file_name)
+        count = min(self.workers * 4, max(1, size // self.shard_size))
+        shards = get_shards(self.input_file_name, max(count, self.workers))
+        self.logger.info(f"converting {len(shards)} shards with {self.workers} workers.")
+
+        shard_file_names = [f"{self.output_file_name}.{i}.part" for i in range(len(shards))]
+        try:
+            # workers are spawned, the calling process may run threads
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [
+                    pool.submit(convert_shard, self.input_file_name, start, end, self.fields, shard_file_name)
+                    for (start, end), shard_file_name in zip(shards, shard_file_names)
+                ]
+                for future in futures:
+                    future.result()
+
+            if self.output_stream is not None:
+                self.append_shards(shard_file_names, self.output_stream)
+            else:
+                with open(self.output_file_name, "wb") as text_file:
+                    self.append_shards(shard_file_names, text_file)
+        finally:
+            for shard_file_name in shard_file_names:
+                if os.path.isfile(shard_file_name):
+                    os.remove(shard_file_name)
+
+    @staticmethod
+    def append_shards(shard_file_names, output):
+        for shard_file_name in shard_file_names:
+            with open(shard_file_name, "rb") as shard_file:
+                shutil.copyfileobj(shard_file, output, 1024 * 1024)
+
 def main():
     input_file = "data/sample.jsonl"  # Replace with your input JSONL file path
     output_file = "data/samplejson_output.txt"  # Replace with your desired output text file path
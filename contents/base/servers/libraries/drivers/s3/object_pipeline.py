@@ -0,0 +1,224 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from libraries.converters import pdf2text
+from libraries.converters import doc2text
+from libraries.converters import pptx2text
+from libraries.converters import html2text
+from libraries.converters import list2text
+from libraries.converters import speech2list
+
+SPEECH_EXTENSIONS = [".wav", ".mp3", ".mp4", ".mpeg", ".mpga", ".m4a", ".webm"]
+# a crashed worker fails every conversion of its pool, which are converted again in a new pool
+CONVERT_ATTEMPTS = 3
+
+
+def get_text_file_path(file_path: str):
+    """Returns the extension of a file and the path of its text file"""
+
+    split_tup = os.path.splitext(file_path)
+    return split_tup[1].lower(), split_tup[0] + ".txt"
+
+
+def is_speech_file(file_path: str) -> bool:
+    return get_text_file_path(file_path)[0] in SPEECH_EXTENSIONS
+
+
+def convert_file(file_path: str, text_file_path: str, model_size: str) -> bool:
+    """Converts one file to text_file_path according to its extension.
+    It only takes and returns plain values so that it can run in a worker process."""
+
+    success = False
+    file_extension, _ = get_text_file_path(file_path)
+
+    if file_extension == ".pdf":
+        pdf_converter = pdf2text.PDF2Text()
+        pdf_converter.configure(file_path, text_file_path)
+        success = pdf_converter.convert()
+
+    elif file_extension == ".doc" or file_extension == ".docx":
+        doc_converter = doc2text.Doc2Text()
+        doc_converter.configure(file_path, text_file_path)
+        success = doc_converter.convert()
+
+    elif file_extension == ".ppt" or file_extension == ".pptx":
+        ppt_converter = pptx2text.Pptx2Text()
+        ppt_converter.configure(file_path, text_file_path)
+        success = ppt_converter.convert()
+
+    elif file_extension == ".htm" or file_extension == ".html":
+        html_converter = html2text.Html2Text()
+        html_converter.configure(file_path, text_file_path)
+        success = html_converter.convert()
+
+    elif file_extension in SPEECH_EXTENSIONS:
+        transcriber = speech2list.Speech2List()
+        transcriber.configure(file_path, model_size)
+        lines = transcriber.convert()
+        if lines is None:
+            success = False
+        else:
+            sink = list2text.List2Text()
+            sink.configure(text_file_path)
+            success = sink.convert(lines)
+
+    return success
+
+
+class ObjectPipeline:
+    """Staged processing of the objects of the S3 driver.
+
+    Every object goes through three stages, each with its own bounded pool:
+        download   download_workers threads
+        convert    convert_workers processes for documents, one process for the whisper transcriptions
+        finish     upload_workers threads uploading the text, moving the object and writing its metadata
+    submit() blocks while max_in_flight objects are in the pipeline, which bounds the downloaded files
+    waiting for a conversion slot and lets the stages overlap on different objects.
+    A worker process crashing (a converter segfault, an OOM killed transcription) breaks its pool: the pool
+    is replaced and its conversions are submitted again, up to CONVERT_ATTEMPTS times.
+    """
+
+    def __init__(self, driver, task_id: str, download_workers: int = 4, convert_workers: int = None,
+                 upload_workers: int = 4, max_in_flight: int = None):
+        self.logger = logging.getLogger()
+        self.driver = driver
+        self.task_id = task_id
+
+        self.convert_workers = max(1, convert_workers or os.cpu_count() or 1)
+        self.max_in_flight = max_in_flight or download_workers + self.convert_workers * 2 + upload_workers
+        self.in_flight = threading.Semaphore(self.max_in_flight)
+
+        # converters run in spawned processes, the driver process runs threads
+        self.context = multiprocessing.get_context("spawn")
+        self.pool_lock = threading.Lock()
+        self.downloads = ThreadPoolExecutor(max_workers=max(1, download_workers), thread_name_prefix="s3_download")
+        self.conversions = self.create_pool(self.convert_workers)
+        self.transcriptions = self.create_pool(1)
+        self.uploads = ThreadPoolExecutor(max_workers=max(1, upload_workers), thread_name_prefix="s3_upload")
+
+        self.processed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def submit(self, original_key: str, file_path: str) -> None:
+        self.in_flight.acquire()
+        self.downloads.submit(self.download, original_key, file_path)
+
+    def download(self, original_key: str, file_path: str) -> None:
+        try:
+            self.logger.info(f"processing key :{original_key}")
+            if not self.driver.download_object(original_key, file_path):
+                self.complete(False)
+                return
+
+            self.logger.info(f"extracting text:{original_key}")
+            self.convert(original_key, file_path, 1)
+        except Exception:
+            self.logger.exception(f"File format conversion failed: {original_key}")
+            self.remove_file(file_path)
+            self.complete(False)
+
+    def create_pool(self, workers: int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=workers, mp_context=self.context)
+
+    def get_pool(self, file_path: str) -> ProcessPoolExecutor:
+        with self.pool_lock:
+            return self.transcriptions if is_speech_file(file_path) else self.conversions
+
+    def restart_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Replaces a pool broken by a crashed worker, once for all the conversions it failed"""
+
+        with self.pool_lock:
+            if pool is self.conversions:
+                self.conversions = self.create_pool(self.convert_workers)
+            elif pool is self.transcriptions:
+                self.transcriptions = self.create_pool(1)
+            else:
+                return
+        self.logger.warning("A conversion worker crashed, its process pool is restarted")
+        pool.shutdown(wait=False)
+
+    def convert(self, original_key: str, file_path: str, attempt: int) -> None:
+        _, text_file_path = get_text_file_path(file_path)
+        pool = self.get_pool(file_path)
+        try:
+            conversion = pool.submit(convert_file, file_path, text_file_path, self.driver.model_size)
+        except BrokenProcessPool:
+            self.restart_pool(pool)
+            pool = self.get_pool(file_path)
+            conversion = pool.submit(convert_file, file_path, text_file_path, self.driver.model_size)
+        conversion.add_done_callback(
+            lambda done: self.uploads.submit(
+                self.finish, original_key, file_path, text_file_path, pool, done, attempt
+            )
+        )
+
+    def convert_again(self, original_key: str, file_path: str, pool, attempt: int) -> None:
+        """Submits a conversion failed by the crash of a worker to a new pool, the object itself may be fine"""
+
+        self.logger.warning(f"Conversion of {original_key} was lost with its worker, attempt {attempt}")
+        self.restart_pool(pool)
+        try:
+            self.convert(original_key, file_path, attempt + 1)
+        except Exception:
+            self.logger.exception(f"Conversion of {original_key} could not be submitted again")
+            self.remove_file(file_path)
+            self.complete(False)
+
+    def finish(self, original_key: str, file_path: str, text_file_path: str, pool, conversion,
+               attempt: int) -> None:
+        if attempt < CONVERT_ATTEMPTS and isinstance(conversion.exception(), BrokenProcessPool):
+            self.convert_again(original_key, file_path, pool, attempt)
+            return
+
+        status = False
+        try:
+            try:
+                success = conversion.result()
+            except Exception:
+                self.logger.exception(f"Conversion of {original_key} failed")
+                success = False
+
+            text_key_name = original_key + ".txt"
+            status = self.driver.store_text(original_key, file_path, text_file_path, text_key_name, success)
+            self.driver.put_object_metadata(self.task_id, original_key, text_key_name)
+        except Exception:
+            self.logger.exception("File format conversion failed")
+        finally:
+            self.complete(status)
+
+    def remove_file(self, file_path: str) -> None:
+        """Removes a downloaded file that will not go through the finish stage"""
+
+        try:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+        except OSError:
+            self.logger.exception(f"Could not remove {file_path}")
+
+    def complete(self, status: bool) -> None:
+        with self.lock:
+            self.processed += 1
+            if not status:
+                self.failed += 1
+        self.in_flight.release()
+
+    def join(self) -> None:
+        """Waits until every submitted object went through the pipeline"""
+
+        for _ in range(self.max_in_flight):
+            self.in_flight.acquire()
+        for _ in range(self.max_in_flight):
+            self.in_flight.release()
+
+    def close(self) -> None:
+        self.join()
+        self.downloads.shutdown(wait=True)
+        self.conversions.shutdown(wait=True)
+        self.transcriptions.shutdown(wait=True)
+        self.uploads.shutdown(wait=True)
+        self.logger.info(f"Object pipeline closed: {self.processed} objects processed, {self.failed} failed")
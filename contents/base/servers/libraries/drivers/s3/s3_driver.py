@@ -5,15 +5,10 @@ import nltk
 import logging
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from libraries.converters import pdf2text
-from libraries.converters import doc2text
-from libraries.converters import pptx2text
-from libraries.converters import html2text
-from libraries.converters import list2text
-from libraries.converters import speech2list
 from libraries.ingestors.s3 import s3storage
+from libraries.ingestors.s3.s3_bulk_move import S3BulkMover
+from libraries.drivers.s3.object_pipeline import ObjectPipeline
 from libraries.drivers.driver import Driver
-from urllib.parse import unquote_plus
 from vectordb.pinecone_index.index import Indexer
 from langchain.embeddings import HuggingFaceEmbeddings
 from vectordb.pinecone_index.pinecone import PineConeIndex
@@ -39,6 +34,8 @@ class S3Driver(Driver):
         self.error_bucket_name = None
 
         self.object_storage = None
+        # moves of the objects processed by the pipeline
+        self.mover = None
         self.download_path = DOWNLOAD_PATH
         self.model_size = SPEECH_MODEL_SIZE
         self.key_prefix = KEY_PREFIX
@@ -139,90 +136,44 @@ class S3Driver(Driver):
     def move_upon_success(self, key_name: str) -> bool:
         """move_upon_success() method moves objects from an input bucket to an output bucket after succesful convrsion"""
 
-        self.logger.info(
-            f"Moving object {key_name} from bucket {self.input_bucket_name} to bucket {self.output_bucket_name}."
-        )
-        if not self.object_storage.move_file(
-                self.input_bucket_name, key_name, self.output_bucket_name
-        ):
-            self.logger.error(
-                f"Object move from bucket {self.input_bucket_name} to bucket {self.output_bucket_name} with key {key_name} failed."
-            )
-            return False
-        else:
-            self.logger.info(
-                f"Object {key_name} from bucket {self.input_bucket_name} to bucket {self.output_bucket_name} was moved."
-            )
-            return True
+        return self.move_object(key_name, self.output_bucket_name)
 
     def move_upon_failure(self, key_name: str) -> bool:
         """move_upon_failure() method moves objects from an input bucket to an error bucket after failure to convert"""
 
+        return self.move_object(key_name, self.error_bucket_name)
+
+    def move_object(self, key_name: str, target_bucket_name: str) -> bool:
+        """Moves an object out of the input bucket, queued to the bulk mover while objects are processed by the pipeline.
+        A queued move returns True, process_objects() fails the task when a queued move failed."""
+
         self.logger.info(
-            f"Moving object {key_name} from bucket {self.input_bucket_name} to bucket {self.error_bucket_name}."
+            f"Moving object {key_name} from bucket {self.input_bucket_name} to bucket {target_bucket_name}."
         )
-        if not self.object_storage.move_file(
-                self.input_bucket_name, key_name, self.error_bucket_name
-        ):
+        if self.mover is not None:
+            future = self.mover.move(self.input_bucket_name, key_name, target_bucket_name)
+            future.add_done_callback(lambda done: self.log_move(key_name, target_bucket_name, done.result()))
+            return True
+
+        return self.log_move(
+            key_name, target_bucket_name,
+            self.object_storage.move_file(self.input_bucket_name, key_name, target_bucket_name),
+        )
+
+    def log_move(self, key_name: str, target_bucket_name: str, is_moved: bool) -> bool:
+        if not is_moved:
             self.logger.error(
-                f"Object move from bucket {self.input_bucket_name} to bucket {self.error_bucket_name} with key {key_name} failed."
+                f"Object move from bucket {self.input_bucket_name} to bucket {target_bucket_name} with key {key_name} failed."
             )
             return False
         else:
             self.logger.info(
-                f"Object {key_name} from bucket {self.input_bucket_name} to bucket {self.error_bucket_name} was moved."
+                f"Object {key_name} from bucket {self.input_bucket_name} to bucket {target_bucket_name} was moved."
             )
             return True
 
-    def extract_text(self, key_name: str, file_path: str, text_key_name: str) -> bool:
-        """Converts file format of one file"""
-
-        success = False
-
-        self.logger.info(f"extracting text:{key_name}")
-
-        split_tup = os.path.splitext(file_path)
-        file_extension = split_tup[1].lower()
-        text_file_path = split_tup[0] + ".txt"
-
-        if file_extension == ".pdf":
-            pdf_converter = pdf2text.PDF2Text()
-            pdf_converter.configure(file_path, text_file_path)
-            success = pdf_converter.convert()
-
-        elif file_extension == ".doc" or file_extension == ".docx":
-            doc_converter = doc2text.Doc2Text()
-            doc_converter.configure(file_path, text_file_path)
-            success = doc_converter.convert()
-
-        elif file_extension == ".ppt" or file_extension == ".pptx":
-            ppt_converter = pptx2text.Pptx2Text()
-            ppt_converter.configure(file_path, text_file_path)
-            success = ppt_converter.convert()
-
-        elif file_extension == ".htm" or file_extension == ".html":
-            html_converter = html2text.Html2Text()
-            html_converter.configure(file_path, text_file_path)
-            success = html_converter.convert()
-
-        elif (
-                file_extension == ".wav"
-                or file_extension == ".mp3"
-                or file_extension == ".mp4"
-                or file_extension == ".mpeg"
-                or file_extension == ".mpga"
-                or file_extension == ".m4a"
-                or file_extension == ".webm"
-        ):
-            transcriber = speech2list.Speech2List()
-            transcriber.configure(file_path, self.model_size)
-            lines = transcriber.convert()
-            if lines is None:
-                success = False
-            else:
-                sink = list2text.List2Text()
-                sink.configure(text_file_path)
-                success = sink.convert(lines)
+    def store_text(self, key_name: str, file_path: str, text_file_path: str, text_key_name: str, success: bool) -> bool:
+        """Uploads the text of a converted object and moves the object to the output or the error bucket"""
 
         if not success:
             self.logger.error(f"Failed to convert file {file_path}")
@@ -242,42 +193,88 @@ class S3Driver(Driver):
 
         return True
 
-    def process_object(self, task_id: str, original_key: str, file_path: str) -> bool:
-        """download an object from object store and process file for format conversion"""
+    def iter_input_objects(self):
+        """
+        Yields the keys of the input bucket below INPUT_PREFIX, after INPUT_START_AFTER when it is set.
+        INPUT_PREFIXES is a comma separated list of prefixes listed in parallel by LIST_WORKERS threads.
+        """
+
+        start_after = os.getenv("INPUT_START_AFTER") or None
+        prefixes = [prefix.strip() for prefix in os.getenv("INPUT_PREFIXES", "").split(",") if prefix.strip()]
+        if len(prefixes) > 1:
+            return self.object_storage.iter_objects_parallel(
+                self.input_bucket_name,
+                prefixes,
+                workers=int(os.getenv("LIST_WORKERS", "4")),
+                start_after=start_after,
+            )
+        prefix = prefixes[0] if prefixes else os.getenv("INPUT_PREFIX", "")
+        return self.object_storage.iter_objects(self.input_bucket_name, prefix=prefix, start_after=start_after)
+
+    def put_object_metadata(self, task_id: str, original_key: str, text_key_name: str) -> None:
+        """Writes the metadata of an object and of its text to the metadata api"""
+
+        original_document_metadata = self.put_original_document_metadata(
+            task_queue_id=task_id,
+            task_type=TASK_TYPE,
+            task_agent=AGENT_NAME,
+            original_document_uri=original_key,
+            metadata={},
+        )
+        self.logger.info(
+            f"original_document_metadata was uploaded to metadata api : {original_document_metadata}"
+        )
 
-        status = False
-        self.logger.info(f"processing key :{original_key}")
+        put_text_document_metadata = self.put_text_document_metadata(
+            task_queue_id=task_id,
+            task_type=TASK_TYPE,
+            task_agent=AGENT_NAME,
+            original_document_uri=original_key,
+            text_document_uri=text_key_name,
+            file_metadata={},
+            page_metadata={},
+        )
+        self.logger.info(f"text_document_metadata was uploaded to metadata api : {put_text_document_metadata}")
+
+    def process_objects(self, task_id: str, objects) -> list:
+        """
+        Processes the objects through the staged pipeline: DOWNLOAD_WORKERS download threads,
+        CONVERT_WORKERS conversion processes (the number of cores by default) and TEXT_UPLOAD_WORKERS upload threads,
+        with at most PIPELINE_MAX_IN_FLIGHT objects between the stages.
+        The processed objects are moved by MOVE_WORKERS concurrent copies, their sources deleted in batches.
+        Returns the (source, key, target) of the objects that could not be moved, each of them logged by log_move.
+        """
+
+        self.mover = S3BulkMover(
+            self.object_storage,
+            workers=int(os.getenv("MOVE_WORKERS", "8")),
+            flush_interval=float(os.getenv("MOVE_FLUSH_INTERVAL", "5")),
+        )
 
+        pipeline = ObjectPipeline(
+            self,
+            task_id,
+            download_workers=int(os.getenv("DOWNLOAD_WORKERS", "4")),
+            convert_workers=int(os.getenv("CONVERT_WORKERS", "0")) or None,
+            upload_workers=int(os.getenv("TEXT_UPLOAD_WORKERS", "4")),
+            max_in_flight=int(os.getenv("PIPELINE_MAX_IN_FLIGHT", "0")) or None,
+        )
         try:
-            if self.download_object(original_key, file_path):
-                text_key_name = original_key + ".txt"
-                status = self.extract_text(original_key, file_path, text_key_name)
-
-                original_document_metadata = self.put_original_document_metadata(
-                    task_queue_id=task_id,
-                    task_type=TASK_TYPE,
-                    task_agent=AGENT_NAME,
-                    original_document_uri=original_key,
-                    metadata={},
-                )
-                self.logger.info(
-                    f"original_document_metadata was uploaded to metadata api : {original_document_metadata}"
-                )
+            for original_key in objects:
+                """
+                reference https://docs.aws.amazon.com/lambda/latest/dg/with-s3-tutorial.html#with-s3-tutorial-test-image
+                """
 
-                put_text_document_metadata = self.put_text_document_metadata(
-                    task_queue_id=task_id,
-                    task_type=TASK_TYPE,
-                    task_agent=AGENT_NAME,
-                    original_document_uri=original_key,
-                    text_document_uri=text_key_name,
-                    file_metadata={},
-                    page_metadata={},
-                )
-                self.logger.info(f"text_document_metadata was uploaded to metadata api : {put_text_document_metadata}")
-        except:
-            self.logger.exception("File format conversion failed")
+                modified_key = original_key.replace("/", "")
+                file_path = self.download_path + "/" + modified_key
 
-        return status
+                pipeline.submit(original_key, file_path)
+        finally:
+            pipeline.close()
+            failed_moves = self.mover.close()
+            self.mover = None
+
+        return failed_moves
 
     def run(self):
         """Main worker function"""
@@ -325,27 +322,30 @@ class S3Driver(Driver):
                 self.logger.info(f"task id {task_id} started.")
                 self.logger.info("Input pipeline:")
 
-                objects = self.object_storage.list_objects(self.input_bucket_name)
+                # keys are listed page by page while the first objects are processed
+                objects = self.iter_input_objects()
 
                 # process every object in the bucket
-                for original_key in objects:
-                    """
-                    reference https://docs.aws.amazon.com/lambda/latest/dg/with-s3-tutorial.html#with-s3-tutorial-test-image
-                    """
-
-                    unquoted_key = unquote_plus(original_key)
-                    modified_key = original_key.replace("/", "")
-                    file_path = self.download_path + "/" + modified_key
-
-                    # source_key = f"{self.key_prefix}/{task_id}/key"
-
-                    self.process_object(task_id, original_key, file_path)
+                failed_moves = self.process_objects(task_id, objects)
 
                 self.logger.info("============")
+                if failed_moves:
+                    self.logger.error(f"Task id {task_id} failed, {len(failed_moves)} objects could not be moved.")
+                    self.task_completed(
+                        object_storage_key_for_results=None,
+                        task_id=task_id,
+                        success=False,
+                        message=f"Task id {task_id} failed, {len(failed_moves)} objects could not be moved.",
+                    )
+                    continue
+
                 self.logger.info(f"Task id {task_id} completed.")
 
                 self.task_completed(
-                    task_id, True, f"Task id {task_id} completed successfully."
+                    object_storage_key_for_results=None,
+                    task_id=task_id,
+                    success=True,
+                    message=f"Task id {task_id} completed successfully.",
                 )
 
             except:
@@ -0,0 +1,150 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from unittest.mock import Mock
+from concurrent.futures.process import BrokenProcessPool
+
+from .object_pipeline import ObjectPipeline
+from .s3_driver import S3Driver
+from libraries.ingestors.s3.s3storage import S3Storage
+
+
+class StubS3Client:
+    """In memory buckets of objects, with the calls S3Storage makes to download, upload, copy and delete them"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def download_file(self, bucket_name, object_name, file_name):
+        with open(file_name, "wb") as f:
+            f.write(self.buckets[bucket_name][object_name])
+
+    def upload_file(self, file_name, bucket_name, object_name):
+        with open(file_name, "rb") as f:
+            self.buckets.setdefault(bucket_name, {})[object_name] = f.read()
+
+    def copy(self, copy_source, bucket_name, object_name, Config=None):
+        data = self.buckets[copy_source["Bucket"]][copy_source["Key"]]
+        self.buckets.setdefault(bucket_name, {})[object_name] = data
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.buckets[Bucket][Key])}
+
+    def delete_object(self, Bucket, Key):
+        del self.buckets[Bucket][Key]
+
+    def delete_objects(self, Bucket, Delete):
+        for key in Delete["Objects"]:
+            del self.buckets[Bucket][key["Key"]]
+        return {}
+
+
+class TestObjectPipeline(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.s3client = StubS3Client({
+            "input": {
+                "page.html": b"<html><body>page</body></html>",
+                "notes.xyz": b"unknown format",
+            },
+        })
+
+        self.driver = S3Driver()
+        self.driver.logger = logging.getLogger()
+        self.driver.input_bucket_name = "input"
+        self.driver.output_bucket_name = "output"
+        self.driver.text_bucket_name = "text"
+        self.driver.error_bucket_name = "errors"
+        self.driver.download_path = self.test_dir
+        self.driver.object_storage = S3Storage()
+        self.driver.object_storage.s3client = self.s3client
+        self.driver.put_object_metadata = Mock()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def process(self, keys):
+        pipeline = ObjectPipeline(self.driver, "task", download_workers=2, convert_workers=2, upload_workers=2)
+        try:
+            for key in keys:
+                pipeline.submit(key, os.path.join(self.test_dir, key))
+        finally:
+            pipeline.close()
+        return pipeline
+
+    def test_converted_and_failed_objects(self):
+        pipeline = self.process(["page.html", "notes.xyz"])
+
+        self.assertEqual(pipeline.processed, 2)
+        self.assertEqual(pipeline.failed, 0)
+        # the converted object is moved to the output bucket with its text, the other one to the error bucket
+        self.assertEqual(self.s3client.buckets["input"], {})
+        self.assertEqual(list(self.s3client.buckets["output"]), ["page.html"])
+        self.assertEqual(list(self.s3client.buckets["text"]), ["page.html.txt"])
+        self.assertEqual(list(self.s3client.buckets["errors"]), ["notes.xyz"])
+        self.assertEqual(self.driver.put_object_metadata.call_count, 2)
+        # the local files are removed
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+    def test_failed_download_is_counted(self):
+        pipeline = self.process(["missing.html"])
+
+        self.assertEqual(pipeline.processed, 1)
+        self.assertEqual(pipeline.failed, 1)
+        self.driver.put_object_metadata.assert_not_called()
+
+    def test_close_stops_every_stage(self):
+        pipeline = self.process([])
+
+        self.assertEqual(pipeline.processed, 0)
+        with self.assertRaises(RuntimeError):
+            pipeline.downloads.submit(print)
+        with self.assertRaises(RuntimeError):
+            pipeline.conversions.submit(print)
+
+    def test_crashed_worker_does_not_fail_the_other_objects(self):
+        pipeline = ObjectPipeline(self.driver, "task", download_workers=2, convert_workers=1, upload_workers=2)
+        try:
+            # the worker exits like a segfaulting converter, which breaks the pool
+            crash = pipeline.conversions.submit(os._exit, 1)
+            pipeline.submit("page.html", os.path.join(self.test_dir, "page.html"))
+            with self.assertRaises(BrokenProcessPool):
+                crash.result(timeout=30)
+        finally:
+            pipeline.close()
+
+        self.assertEqual(pipeline.failed, 0)
+        self.assertEqual(list(self.s3client.buckets["output"]), ["page.html"])
+        self.assertNotIn("errors", self.s3client.buckets)
+
+    def test_failed_submission_removes_the_downloaded_file(self):
+        pipeline = ObjectPipeline(self.driver, "task", download_workers=1, convert_workers=1, upload_workers=1)
+        pipeline.convert = Mock(side_effect=RuntimeError("cannot schedule new futures after shutdown"))
+        try:
+            pipeline.submit("page.html", os.path.join(self.test_dir, "page.html"))
+        finally:
+            pipeline.close()
+
+        self.assertEqual(pipeline.failed, 1)
+        self.assertEqual(os.listdir(self.test_dir), [])
+        self.assertIn("page.html", self.s3client.buckets["input"])
+
+    def test_process_objects_moves_through_the_bulk_mover(self):
+        self.assertEqual(self.driver.process_objects("task", iter(["page.html", "notes.xyz"])), [])
+
+        self.assertIsNone(self.driver.mover)
+        self.assertEqual(self.s3client.buckets["input"], {})
+        self.assertEqual(list(self.s3client.buckets["output"]), ["page.html"])
+        self.assertEqual(list(self.s3client.buckets["errors"]), ["notes.xyz"])
+
+    def test_process_objects_returns_the_failed_moves(self):
+        self.s3client.head_object = lambda Bucket, Key: {"ContentLength": 0 if Bucket == "output" else 1}
+
+        self.assertEqual(self.driver.process_objects("task", iter(["page.html"])), [("input", "page.html", "output")])
+        self.assertIn("page.html", self.s3client.buckets["input"])
+
+
+if __name__ == "__main__":
+    unittest.main()
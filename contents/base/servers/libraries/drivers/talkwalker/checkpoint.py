@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import logging
+
+
+class Checkpoint:
+    """Progress of one topic ingestion run, saved so a failed job can resume where it stopped.
+
+    A checkpoint is keyed by project_id/topic_id/date range and records:
+
+        windows        the time windows of the run, so a resumed run fetches the same windows
+        completed      the windows whose items are all written to the output file
+        current        the window in progress and the offset of its next page
+        output_size    the size of the output file once the items of the completed pages were written
+        pending_items  the twitter items still waiting for hydration at that point
+        counters       the job counters
+
+    The driver records every processed page and saves the checkpoint with the synced output size once
+    CHECKPOINT_INTERVAL elapsed. The checkpoint is a local json file, and with an object storage it is also
+    uploaded to S3 together with the output bytes written since the previous save (as numbered segments),
+    so a new pod can rebuild the output file.
+    """
+
+    def __init__(self, key: str, path: str = './checkpoints', object_storage=None, bucket_name: str = None,
+                 save_interval: int = 60):
+        self.logger = logging.getLogger()
+        self.key = key
+        self.file_path = os.path.join(path, key.replace('/', '_') + '.json')
+        self.object_storage = object_storage
+        self.bucket_name = bucket_name
+        self.object_key = f'checkpoints/talkwalker/{key}/checkpoint.json'
+        self.save_interval = save_interval
+        self.last_saved_at = 0
+        self.state = {}
+        self.completed = set()
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def get_key(project_id: str, topic_id: str, from_date: str, to_date: str) -> str:
+        return f'{project_id}/{topic_id}/{from_date or "today"}_{to_date or "default"}'
+
+    def is_remote(self) -> bool:
+        return self.object_storage is not None and self.bucket_name is not None
+
+    def load(self) -> bool:
+        """Loads a previous checkpoint, returns False when there is none"""
+
+        if self.is_remote():
+            if not self.object_storage.download_file(self.bucket_name, self.object_key, self.file_path):
+                return False
+
+        if not os.path.isfile(self.file_path):
+            return False
+
+        try:
+            with open(self.file_path, 'r') as f:
+                self.state = json.load(f)
+        except Exception as e:
+            self.logger.error(f'Checkpoint {self.file_path} could not be read: {e}')
+            self.state = {}
+            return False
+
+        self.completed = set(tuple(window) for window in self.state.get('completed', []))
+        return True
+
+    def start(self, timestamp: int, output_file: str) -> None:
+        """Starts a new checkpoint for a fresh run"""
+
+        self.state = {
+            'key': self.key,
+            'timestamp': timestamp,
+            'output_file': output_file,
+            'output_size': 0,
+            'segments': [],
+            'windows': None,
+            'completed': [],
+            'current': None,
+            'pending_items': [],
+            'counters': {},
+        }
+        self.completed = set()
+
+    def restore_output(self) -> bool:
+        """Brings the output file back to its size at the last save, returns False when it cannot be restored"""
+
+        output_file = self.state['output_file']
+        output_size = self.state['output_size']
+
+        if self.is_remote() and self.state['segments']:
+            with open(output_file, 'wb') as output:
+                for segment in self.state['segments']:
+                    segment_file = f'{output_file}.segment'
+                    if not self.object_storage.download_file(self.bucket_name, segment['key'], segment_file):
+                        return False
+                    with open(segment_file, 'rb') as f:
+                        output.write(f.read())
+                    os.remove(segment_file)
+        elif output_size > 0 and not os.path.isfile(output_file):
+            return False
+        elif not os.path.isfile(output_file):
+            open(output_file, 'a').close()
+
+        if os.path.getsize(output_file) < output_size:
+            return False
+
+        # drop the items written after the last save, their pages are fetched again
+        with open(output_file, 'r+b') as f:
+            f.truncate(output_size)
+        return True
+
+    def get_windows(self):
+        windows = self.state.get('windows')
+        return None if windows is None else [tuple(window) for window in windows]
+
+    def set_windows(self, windows) -> None:
+        self.state['windows'] = [list(window) for window in windows]
+
+    def get_resume_offsets(self) -> dict:
+        current = self.state.get('current')
+        if not current:
+            return {}
+        return {tuple(current['window']): current['offset']}
+
+    def is_completed(self, window) -> bool:
+        return tuple(window) in self.completed
+
+    def page_processed(self, window, next_offset, pending_items: list, counters: dict) -> None:
+        """Records a page whose items are all written to the output, or pending hydration"""
+
+        if next_offset is None:
+            self.completed.add(tuple(window))
+            self.state['completed'].append(list(window))
+            if self.state['current'] and tuple(self.state['current']['window']) == tuple(window):
+                self.state['current'] = None
+        else:
+            self.state['current'] = {'window': list(window), 'offset': next_offset}
+
+        self.state['pending_items'] = pending_items
+        self.state['counters'] = counters
+
+    def items_pending(self, pending_items: list, counters: dict) -> None:
+        """Records the twitter items still waiting for hydration once every page is processed"""
+
+        self.state['pending_items'] = pending_items
+        self.state['counters'] = counters
+
+    def is_save_due(self) -> bool:
+        return time.time() - self.last_saved_at >= self.save_interval
+
+    def save(self, output_size: int) -> None:
+        """Saves the recorded pages, output_size is the size of the synced output file at the last recorded page"""
+
+        self.last_saved_at = time.time()
+        self.state['output_size'] = output_size
+
+        if self.is_remote():
+            self.upload_output_segment()
+
+        temp_file_path = f'{self.file_path}.tmp'
+        with open(temp_file_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(temp_file_path, self.file_path)
+
+        if self.is_remote():
+            self.object_storage.upload_file(self.file_path, self.bucket_name, self.object_key)
+
+    def upload_output_segment(self) -> None:
+        """Uploads the output bytes written since the previous save"""
+
+        uploaded_size = sum(segment['size'] for segment in self.state['segments'])
+        size = self.state['output_size'] - uploaded_size
+        if size <= 0:
+            return
+
+        segment_key = f"checkpoints/talkwalker/{self.key}/segment_{len(self.state['segments']):05d}.jsonl"
+        segment_file = f"{self.state['output_file']}.segment"
+        with open(self.state['output_file'], 'rb') as output, open(segment_file, 'wb') as f:
+            output.seek(uploaded_size)
+            f.write(output.read(size))
+
+        if self.object_storage.upload_file(segment_file, self.bucket_name, segment_key):
+            self.state['segments'].append({'key': segment_key, 'size': size})
+        os.remove(segment_file)
+
+    def clear(self) -> None:
+        """Removes the checkpoint once the run completed"""
+
+        if self.is_remote():
+            for segment in self.state.get('segments', []):
+                self.object_storage.delete_file(self.bucket_name, segment['key'])
+            self.object_storage.delete_file(self.bucket_name, self.object_key)
+
+        if os.path.isfile(self.file_path):
+            os.remove(self.file_path)
+        self.state = {}
+        self.completed = set()
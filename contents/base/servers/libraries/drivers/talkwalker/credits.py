@@ -4,6 +4,8 @@ import os
 from requests.exceptions import RequestException
 import time
 import requests
+from libraries.ingestors.http_sessions import get_session
+from libraries.ingestors.talkwalker.rate_limiter import get_talkwalker_rate_limiter
 
 
 def make_request(endpoint, params=None):
@@ -11,12 +13,15 @@ def make_request(endpoint, params=None):
     headers = {
         "accept": "application/json",
     }
+    rate_limiter = get_talkwalker_rate_limiter()
     try:
-        response = requests.get(
+        rate_limiter.acquire()
+        response = get_session(base_url).get(
             f"{base_url}/{endpoint}",
             params=params,
             headers=headers,
         )
+        rate_limiter.update(response.status_code, response.headers)
 
         if response.status_code != 400:
             response.raise_for_status()  # Raise an exception for 4xx or 5xx errors
@@ -35,7 +40,8 @@ def retry_request(endpoint, params=None, max_retries=3):
             return response
         retries += 1
         print(f"Retrying... (Attempt {retries}/{max_retries})")
-        time.sleep(1)  # Wait for a second before retrying
+        # a failed connection or a 5xx without rate headers does not slow the rate limiter down
+        time.sleep(5 * retries)
     return None
 
 
@@ -0,0 +1,163 @@
+import os
+import gzip
+import json
+import time
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TeeWriter:
+    """Writes the bytes of the output file to an upload as well"""
+
+    def __init__(self, file, upload):
+        self.file = file
+        self.upload = upload
+
+    def write(self, data) -> int:
+        self.file.write(data)
+        self.upload.write(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+class JSONLSink:
+    """Long lived, buffered JSONL output file.
+
+    Items are serialized into an in-memory buffer that is written to the file once it holds flush_size bytes
+    or flush_interval seconds elapsed since the previous write, so the file is opened once per job.
+
+    compression = None, 'gzip' or 'zstd' (requires the zstandard package). Compressed output is written as a
+    sequence of gzip members or zstd frames: sync() ends the current member, so the file size it returns is a
+    valid point to truncate the file to and append again, which is what checkpoints rely on.
+
+    With an upload (see S3MultipartUpload) every byte written to the file is streamed to it as well,
+    starting with the content the file already has when it is opened, e.g. restored from a checkpoint.
+    Likewise a tee (see JSONLTextTee) receives every item, and the items the file already has.
+    """
+
+    EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+    def __init__(self, file_path: str, compression: str = None, flush_size: int = 1048576,
+                 flush_interval: float = 5.0, upload=None, tee=None):
+        self.logger = logging.getLogger()
+
+        if compression not in self.EXTENSIONS:
+            raise Exception(f'Unsupported output compression {compression}')
+        if compression == 'zstd' and zstandard is None:
+            raise Exception('Output compression zstd requires the zstandard package')
+
+        self.file_path = file_path
+        self.compression = compression
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self.file = open(file_path, 'ab')
+        self.stream = None
+
+        self.upload = upload
+        self.writer = self.file
+        if upload is not None:
+            self._upload_existing_content()
+            self.writer = TeeWriter(self.file, upload)
+
+        self.tee = tee
+        if tee is not None and os.path.getsize(file_path) > 0:
+            tee.write_file(file_path)
+
+        self.buffer = []
+        self.buffer_size = 0
+        self.flushed_at = time.monotonic()
+
+        # statistics
+        self.started_at = time.monotonic()
+        self.items_written = 0
+        self.bytes_written = 0
+
+    @staticmethod
+    def get_extension(compression: str) -> str:
+        return JSONLSink.EXTENSIONS.get(compression, '')
+
+    def _upload_existing_content(self):
+        with open(self.file_path, 'rb') as f:
+            while True:
+                chunk = f.read(1048576)
+                if not chunk:
+                    break
+                self.upload.write(chunk)
+
+    def _open_stream(self):
+        if self.compression == 'gzip':
+            return gzip.GzipFile(fileobj=self.writer, mode='wb')
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor().stream_writer(self.writer, closefd=False)
+        return self.writer
+
+    def _close_stream(self):
+        if self.stream is not None and self.stream is not self.writer:
+            self.stream.close()
+        self.stream = None
+
+    def write(self, item: dict) -> None:
+        line = (json.dumps(item) + '\n').encode('utf-8')
+        self.buffer.append(line)
+        self.buffer_size += len(line)
+        self.items_written += 1
+        if self.tee is not None:
+            self.tee.write_item(item)
+
+        if self.buffer_size >= self.flush_size or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def write_items(self, items: list) -> None:
+        for item in items:
+            self.write(item)
+
+    def flush(self) -> None:
+        """Writes the buffered lines to the file"""
+
+        self.flushed_at = time.monotonic()
+        if not self.buffer:
+            return
+
+        if self.stream is None:
+            self.stream = self._open_stream()
+        self.stream.write(b''.join(self.buffer))
+        self.bytes_written += self.buffer_size
+        self.buffer = []
+        self.buffer_size = 0
+
+    def sync(self) -> int:
+        """Flushes, ends the current compressed member, fsyncs and returns the size of the file"""
+
+        if self.file is None:
+            return os.path.getsize(self.file_path)
+
+        self.flush()
+        self._close_stream()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        self.sync()
+        self.file.close()
+        self.file = None
+
+        stats = self.get_stats()
+        self.logger.info(f'JSONL output {self.file_path} closed: {stats}')
+
+    def get_stats(self) -> dict:
+        elapsed = max(time.monotonic() - self.started_at, 0.001)
+        return {
+            'items': self.items_written,
+            'bytes': self.bytes_written,
+            'bytes_per_second': int(self.bytes_written / elapsed),
+        }
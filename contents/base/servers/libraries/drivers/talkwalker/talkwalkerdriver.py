@@ -2,19 +2,28 @@ import logging
 import json
 import os, sys
 import time
+import asyncio
 import traceback
+from collections import deque
 from datetime import datetime
 from libraries.converters import jsonl2text
 from libraries.drivers.driver import Driver
 from libraries.ingestors.s3 import s3storage
+from libraries.drivers.talkwalker.checkpoint import Checkpoint
+from libraries.drivers.talkwalker.jsonl_sink import JSONLSink
+from libraries.drivers.talkwalker.twitter_hydration import TwitterHydrator
 from libraries.drivers.talkwalker.credits import (
     get_credits_estimation,
     is_valid_project_id,
 )
 from libraries.logs.constants import LogMetricsConstants
 from libraries.logs.cloudlogs import CloudMultiLogMetrics
+from libraries.logs.progress import ProgressReporter
 from libraries.ingestors.twitter.twitter_ingestor import Twitter
+from libraries.ingestors.twitter.tweet_cache import TweetCache
 from libraries.ingestors.talkwalker.talkwalker_ingestor import TalkWalker
+from libraries.ingestors.twitter.twitter_async_ingestor import AsyncTwitter
+from libraries.ingestors.talkwalker.talkwalker_async_ingestor import AsyncTalkWalker
 
 
 class Constants:
@@ -32,6 +41,11 @@ class TalkWalkerDriver(Driver):
         self.object_storage = None
         self.talk_walker = None
         self.buckets = None
+        self.output = None
+        self.output_upload = None
+        self.text_tee = None
+        self.text_upload = None
+        self.tweet_cache = None
         self.application_name = f'({Constants.APPLICATION_NAME} v.{Constants.VERSION} k8s/airflow) - '
         print(f'{self.application_name} initialized.')
 
@@ -97,13 +111,29 @@ class TalkWalkerDriver(Driver):
 
         self.logger.info(f"extracting text:{key_name}")
 
-        split_tup = os.path.splitext(file_path)
-        file_extension = split_tup[1].lower()
-        text_file_path = split_tup[0] + ".txt"
+        file_extension, text_file_path = self.get_text_file_path(file_path)
+
+        if self.text_tee is not None:
+            # the text was extracted while the output was written
+            success = self.finish_inline_text(jsonl_filename_txt)
 
-        if file_extension == ".jsonl":
+        if file_extension == ".jsonl" and not success and self.is_streaming_upload():
+            # the text is streamed to the text bucket, no local text file is written
+            text_upload = self.object_storage.open_upload(self.buckets['text'], jsonl_filename_txt)
             jsonl_converter = jsonl2text.JSONL2Text()
-            jsonl_converter.configure(file_path, text_file_path)
+            jsonl_converter.configure(
+                file_path, text_file_path, output_stream=text_upload, fields=self.get_text_fields(), **self.get_text_sharding()
+            )
+            if jsonl_converter.convert() and text_upload.complete():
+                success = True
+                self.logger.info(f"File {jsonl_filename_txt} was streamed to bucket {self.buckets['text']}.")
+            else:
+                text_upload.abort()
+                self.logger.error(f"Streaming {jsonl_filename_txt} failed, converting to a local file")
+
+        if file_extension == ".jsonl" and not success:
+            jsonl_converter = jsonl2text.JSONL2Text()
+            jsonl_converter.configure(file_path, text_file_path, fields=self.get_text_fields(), **self.get_text_sharding())
             success = jsonl_converter.convert()
 
         if not success:
@@ -127,6 +157,73 @@ class TalkWalkerDriver(Driver):
 
         return True
 
+    @staticmethod
+    def get_text_file_path(file_path):
+        """Returns the extension of the output file and the path of its text file,
+        compressed outputs (.jsonl.gz, .jsonl.zst) are decompressed by the converter"""
+
+        split_tup = os.path.splitext(file_path)
+        if split_tup[1].lower() in [".gz", ".zst"]:
+            split_tup = os.path.splitext(split_tup[0])
+        return split_tup[1].lower(), split_tup[0] + ".txt"
+
+    @staticmethod
+    def get_text_fields():
+        """TEXT_FIELDS is the comma separated list of the dotted paths of the text fields of an item"""
+        return [field.strip() for field in os.getenv("TEXT_FIELDS", "title,body,news_article.text").split(",") if field.strip()]
+
+    @staticmethod
+    def get_text_sharding():
+        """TEXT_WORKERS > 1 converts uncompressed outputs of at least TEXT_SHARD_SIZE bytes in shards, in parallel"""
+        return {
+            "workers": int(os.getenv("TEXT_WORKERS", "1")),
+            "shard_size": int(os.getenv("TEXT_SHARD_SIZE", str(jsonl2text.JSONL2Text.MIN_SHARD_SIZE))),
+        }
+
+    @staticmethod
+    def is_inline_text():
+        """INLINE_TEXT=true extracts the text of the items while the output is written, instead of converting it afterwards"""
+        return os.getenv("INLINE_TEXT", "false").casefold() == "true"
+
+    def setup_text_tee(self, jsonl_file_path, jsonl_filename_txt):
+        """Opens the text output written along the JSONL output, streamed to the text bucket or to a local file"""
+
+        self.text_upload = None
+        if self.is_streaming_upload():
+            self.text_upload = self.object_storage.open_upload(self.buckets['text'], jsonl_filename_txt)
+            self.text_tee = jsonl2text.JSONLTextTee(self.text_upload, self.get_text_fields())
+        else:
+            _, text_file_path = self.get_text_file_path(jsonl_file_path)
+            self.text_tee = jsonl2text.JSONLTextTee(open(text_file_path, "wb"), self.get_text_fields())
+
+    def finish_inline_text(self, jsonl_filename_txt) -> bool:
+        """Completes the text streamed along the output, or closes its local file which is uploaded afterwards"""
+
+        text_tee = self.text_tee
+        self.text_tee = None
+        if self.text_upload is None:
+            text_tee.output.close()
+            return True
+
+        text_upload = self.text_upload
+        self.text_upload = None
+        if text_upload.complete():
+            self.logger.info(f"File {jsonl_filename_txt} was streamed to bucket {self.buckets['text']}.")
+            return True
+        text_upload.abort()
+        self.logger.error(f"Streaming {jsonl_filename_txt} failed, converting the output again")
+        return False
+
+    def abort_inline_text(self):
+        if self.text_tee is None:
+            return
+        if self.text_upload is not None:
+            self.text_upload.abort()
+        else:
+            self.text_tee.output.close()
+        self.text_tee = None
+        self.text_upload = None
+
     def transform_tweet_data(self, tweet_data, item):
         """Method to transform the talkwalker item, tweet data and return it as dict"""
         created_at = tweet_data["created_at"].replace(" ", "").replace("\n", "")
@@ -147,100 +244,243 @@ class TalkWalkerDriver(Driver):
         # print(f'tweet text inside merge =  {data["body"]}')
         return data
 
-    def save_data_to_file(self, data, jsonl_filename):
-        with open(jsonl_filename, "a") as f:
-            for item in data:
-                # print(item)
-                f.write(json.dumps(item) + "\n")
+    def setup_output(self, jsonl_file_path, s3_jsonl_key_name, jsonl_filename_txt):
+        """Opens the buffered output of the job, configured by OUTPUT_FLUSH_SIZE and OUTPUT_FLUSH_INTERVAL"""
+
+        self.output_upload = None
+        if self.is_streaming_upload():
+            self.output_upload = self.object_storage.open_upload(self.buckets['output'], s3_jsonl_key_name)
+        if self.is_inline_text():
+            self.setup_text_tee(jsonl_file_path, jsonl_filename_txt)
+
+        self.output = JSONLSink(
+            jsonl_file_path,
+            compression=self.get_output_compression(),
+            flush_size=int(os.getenv("OUTPUT_FLUSH_SIZE", "1048576")),
+            flush_interval=float(os.getenv("OUTPUT_FLUSH_INTERVAL", "5")),
+            upload=self.output_upload,
+            tee=self.text_tee,
+        )
+
+    def upload_output(self, jsonl_file_path, s3_jsonl_key_name) -> bool:
+        """Completes the streaming upload of the output, or uploads the output file when it is not streamed"""
+
+        if self.output_upload is not None:
+            if self.output_upload.complete():
+                self.logger.info(f"File {jsonl_file_path} was streamed to bucket {self.buckets['output']}.")
+                return True
+            self.logger.error(f"Streaming {jsonl_file_path} failed, uploading the file instead")
+
+        return self.upload_file(jsonl_file_path, self.buckets['output'], s3_jsonl_key_name)
 
     @staticmethod
-    def get_item_by_id(items, external_id):
-        for item in items:
-            if item["external_id"] == external_id:
-                return item
-        return ""
+    def is_streaming_upload():
+        """STREAMING_UPLOAD=true uploads the outputs with S3 multipart uploads while they are written.
+        The local output file is still written: checkpoints save and restore it, the text conversion reads it,
+        and it is uploaded as a file when the streaming upload fails."""
+        return os.getenv("STREAMING_UPLOAD", "false").casefold() == "true"
 
-    def merge_tweet_data(self, items, error_file_path):
-        twitter = Twitter()
-        tweets_data = twitter.get_tweets_by_ids(
-            [item["external_id"] for item in items], error_file_path
+    @staticmethod
+    def get_output_compression():
+        """OUTPUT_COMPRESSION is gzip or zstd, the output is not compressed when not set"""
+        return os.getenv("OUTPUT_COMPRESSION", "").casefold() or None
+
+    def setup_twitter_hydrator(self, error_file_path):
+        """Returns the hydration stage of the sync engine, sized by HYDRATION_WORKERS and HYDRATION_QUEUE_SIZE"""
+
+        twitter = Twitter(self.tweet_cache)
+        return TwitterHydrator(
+            lookup=lambda ids: twitter.get_tweets_by_ids(ids, error_file_path),
+            retry_lookup=lambda ids: twitter.get_tweets_by_ids(ids, error_file_path, is_retry=True),
+            merge=self.merge_hydrated_tweets,
+            workers=int(os.getenv("HYDRATION_WORKERS", "2")),
+            queue_size=int(os.getenv("HYDRATION_QUEUE_SIZE", "8")),
+            retry_delay=float(os.getenv("HYDRATION_RETRY_DELAY", "15")),
+            batch_size=Constants.TWITTER_IDS_COUNT,
         )
-        # self.logger.info(
-        #     f"Twitter Lookup:  valid= {len(tweets_data['data']) }, invalid={len(tweets_data['errors']) } from original TW count of {len(items)}"
-        # )
 
-        data = []
-        if len(tweets_data["errors"]):
-            self.logger.info(
-                f"NOT FOUND BEFORE - second try: {[error['value'] for error in tweets_data['errors']]}"
-            )
-            time.sleep(15)
-            tweets_second = twitter.get_tweets_by_ids(
-                [error["value"] for error in tweets_data["errors"]], error_file_path
-            )
+    def setup_tweet_cache(self):
+        """Opens the tweet cache shared by the jobs, TWEET_CACHE is local or s3 (disabled when not set)"""
 
-            tweets_data["data"] = tweets_data["data"] + tweets_second["data"]
-            tweets_data["errors"] = tweets_second["errors"]
+        store = os.getenv("TWEET_CACHE", "").casefold()
+        if store not in ["local", "s3"]:
+            return
 
-            self.logger.info(
-                f"NOT FOUND AFTER - second try: {[error['value'] for error in tweets_data['errors']]}"
-            )
-            # self.talk_walker.log_error(f"Twitter errors {tweets_data['errors']}")
+        path = os.getenv("TWEET_CACHE_PATH", "./cache/tweets.sqlite")
+        if store == "s3":
+            bucket_name = os.getenv("TWEET_CACHE_BUCKET", self.buckets['logs'])
+            if not self.object_storage.download_file(bucket_name, self.get_tweet_cache_key(), path):
+                self.logger.info(f"{self.application_name} no tweet cache in bucket {bucket_name}, starting a new one")
 
-            if len(tweets_data["errors"]):
-                self.logger.info(
-                    f"NOT FOUND BEFORE - third try: {[error['value'] for error in tweets_data['errors']]}"
-                )
-                time.sleep(15)
-                tweets_third = twitter.get_tweets_by_ids(
-                    [error["value"] for error in tweets_data["errors"]], error_file_path
-                )
+        self.tweet_cache = TweetCache(
+            path,
+            ttl=float(os.getenv("TWEET_CACHE_TTL", str(7 * 24 * 3600))),
+            max_entries=int(os.getenv("TWEET_CACHE_MAX_ENTRIES", "1000000")),
+        )
 
-                tweets_data["data"] = tweets_data["data"] + tweets_third["data"]
-                tweets_data["errors"] = tweets_third["errors"]
+    @staticmethod
+    def get_tweet_cache_key():
+        return f"cache/{Constants.APPLICATION_NAME}/tweets.sqlite"
 
-                self.talk_walker.twitter_errors = self.talk_walker.twitter_errors + len(
-                    tweets_data["errors"]
-                )
-                self.logger.info(
-                    f"NOT FOUND AFTER - third try: {[error['value'] for error in tweets_data['errors']]}"
-                )
-                # self.talk_walker.log_error(f"Twitter errors {tweets_data['errors']}")
-            self.talk_walker.twitter_errors = self.talk_walker.twitter_errors + len(
-                tweets_data["errors"]
+    def close_tweet_cache(self):
+        """Reports the hit rate of the job and saves the cache for the next jobs"""
+
+        if self.tweet_cache is None:
+            return
+        self.tweet_cache.close()
+        self.logger.write_metric_value("tweet_cache_hit_rate", int(self.tweet_cache.get_hit_rate() * 100))
+        if os.getenv("TWEET_CACHE", "").casefold() == "s3":
+            bucket_name = os.getenv("TWEET_CACHE_BUCKET", self.buckets['logs'])
+            self.upload_file(self.tweet_cache.path, bucket_name, self.get_tweet_cache_key())
+        self.tweet_cache = None
+
+    def setup_article_cache(self):
+        """Loads the news articles of the previous jobs, ARTICLE_CACHE is local or s3 (kept in memory when not set)"""
+
+        store = os.getenv("ARTICLE_CACHE", "").casefold()
+        if store not in ["local", "s3"] or self.talk_walker.article_cache is None:
+            return
+
+        path = self.get_article_cache_path()
+        if store == "s3":
+            bucket_name = os.getenv("ARTICLE_CACHE_BUCKET", self.buckets['logs'])
+            if not self.object_storage.download_file(bucket_name, self.get_article_cache_key(), path):
+                self.logger.info(f"{self.application_name} no article cache in bucket {bucket_name}, starting a new one")
+        try:
+            self.talk_walker.article_cache.load(path)
+        except Exception as e:
+            self.logger.error(f"{self.application_name} could not load the article cache {path}: {e}")
+
+    @staticmethod
+    def get_article_cache_path():
+        return os.getenv("ARTICLE_CACHE_PATH", "./cache/articles.json.gz")
+
+    @staticmethod
+    def get_article_cache_key():
+        return f"cache/{Constants.APPLICATION_NAME}/articles.json.gz"
+
+    def close_article_cache(self):
+        """Reports the hit rate of the job and saves the cache for the next jobs"""
+
+        article_cache = self.talk_walker.article_cache
+        if article_cache is None:
+            return
+        stats = article_cache.get_stats()
+        self.logger.info(f"Article cache: {stats}")
+        self.logger.write_metric_value("article_cache_hit_rate", int(stats["hit_rate"] * 100))
+
+        store = os.getenv("ARTICLE_CACHE", "").casefold()
+        if store not in ["local", "s3"]:
+            return
+        path = self.get_article_cache_path()
+        article_cache.save(path)
+        if store == "s3":
+            bucket_name = os.getenv("ARTICLE_CACHE_BUCKET", self.buckets['logs'])
+            self.upload_file(path, bucket_name, self.get_article_cache_key())
+
+    def merge_hydrated_tweets(self, items, tweets_data):
+        with self.talk_walker.lock:
+            self.talk_walker.twitter_errors += len(tweets_data["errors"])
+        return self.combine_tweet_data(items, tweets_data)
+
+    async def merge_tweet_data_async(self, items, error_file_path):
+        """Twitter hydration of one batch on the event loop of the async engine, retries do not block the loop"""
+        twitter = AsyncTwitter(self.talk_walker.session, self.tweet_cache)
+        empty_result = {"data": [], "errors": []}
+        tweets_data = await twitter.get_tweets_by_ids(
+            [item["external_id"] for item in items], error_file_path
+        ) or empty_result
+
+        for attempt in ["second", "third"]:
+            if not len(tweets_data["errors"]):
+                break
+            self.logger.info(
+                f"NOT FOUND BEFORE - {attempt} try: {[error['value'] for error in tweets_data['errors']]}"
             )
+            await asyncio.sleep(15)
+            tweets_retry = await twitter.get_tweets_by_ids(
+                [error["value"] for error in tweets_data["errors"]], error_file_path, is_retry=True
+            ) or empty_result
 
-        # TODO - the loop below should iterate on TW items
-        # instead of tweet items as not all twitter hydration will succeed.
-        # this way all un-hydrated twitter items from TW will be present in the output,
-        # at lease (even if un-hydrated).
+            tweets_data["data"] = tweets_data["data"] + tweets_retry["data"]
+            tweets_data["errors"] = tweets_retry["errors"]
+            self.logger.info(
+                f"NOT FOUND AFTER - {attempt} try: {[error['value'] for error in tweets_data['errors']]}"
+            )
 
-        for tweet in tweets_data["data"]:
-            try:
-                original_tw_item = self.get_item_by_id(items, tweet["id"])
-                merged_items = self.transform_tweet_data(tweet, original_tw_item)
-                data.append(merged_items)
+        with self.talk_walker.lock:
+            self.talk_walker.twitter_errors += len(tweets_data["errors"])
 
-            except Exception as e:
-                self.logger.error(f"Exception in twitter TW merge!")
-                self.logger.exception(e)
+        return self.combine_tweet_data(items, tweets_data)
 
-        for tweet in tweets_data["errors"]:
-            try:
-                original_tw_item = self.get_item_by_id(items, tweet["value"])
-                original_tw_item["twitter_error"] = tweet
-                original_tw_item.pop("x-p6m-publish-source", None)
-                data.append(original_tw_item)
+    def combine_tweet_data(self, items, tweets_data):
+        """Merges the hydrated tweets and the lookup errors with their talkwalker items.
 
-            except Exception as e:
-                self.logger.error(f"Exception in twitter Errors and TW merge!")
-                self.logger.exception(e)
+        The tweets and errors are indexed by id once per batch and the merge iterates on the TW items,
+        so un-hydrated twitter items from TW are present in the output as well (un-hydrated).
+        """
+        data = []
+        tweets_by_id = {tweet["id"]: tweet for tweet in tweets_data["data"]}
+        errors_by_id = {error["value"]: error for error in tweets_data["errors"] if "value" in error}
+        not_hydrated = 0
+
+        for item in items:
+            external_id = item["external_id"]
+            tweet = tweets_by_id.get(external_id)
+            if tweet is not None:
+                try:
+                    data.append(self.transform_tweet_data(tweet, item))
+                    continue
+                except Exception as e:
+                    self.logger.error(f"Exception in twitter TW merge!")
+                    self.logger.exception(e)
+
+            error = errors_by_id.get(external_id)
+            if error is not None:
+                item["twitter_error"] = error
+            else:
+                not_hydrated += 1
+            item.pop("x-p6m-publish-source", None)
+            data.append(item)
 
         self.logger.info(
-            f"Tweets merged. TW = {len(items)}. valid = {len(tweets_data['data'])}.  invalid = {len(tweets_data['errors'])} Merged = {len(data)}"
+            f"Tweets merged. TW = {len(items)}. valid = {len(tweets_data['data'])}.  invalid = {len(tweets_data['errors'])} not hydrated = {not_hydrated} Merged = {len(data)}"
         )
         return data
 
+    def setup_checkpoint(self, project_id, topic_id, from_date, to_date):
+        """Returns the checkpoint of this topic run, CHECKPOINT_STORE is local or s3 (disabled when not set)"""
+
+        store = os.getenv("CHECKPOINT_STORE", "").casefold()
+        if store not in ["local", "s3"]:
+            return None
+
+        key = Checkpoint.get_key(project_id, topic_id, from_date, to_date)
+        save_interval = int(os.getenv("CHECKPOINT_INTERVAL", "60"))
+
+        if store == "s3":
+            bucket_name = os.getenv("CHECKPOINT_BUCKET", self.buckets['logs'])
+            self.logger.info(f"{self.application_name} checkpoint {key} is stored in bucket {bucket_name}")
+            return Checkpoint(key, object_storage=self.object_storage, bucket_name=bucket_name,
+                              save_interval=save_interval)
+
+        self.logger.info(f"{self.application_name} checkpoint {key} is stored locally")
+        return Checkpoint(key, save_interval=save_interval)
+
+    def get_job_counters(self):
+        return {
+            "total_retrieved": self.talk_walker.total_item_count,
+            "total_twitter": self.talk_walker.total_twitter_count,
+            "twitter_errors": self.talk_walker.twitter_errors,
+            "total_saved": self.talk_walker.total_saved,
+        }
+
+    def set_job_counters(self, counters):
+        self.talk_walker.total_item_count = counters.get("total_retrieved", 0)
+        self.talk_walker.total_twitter_count = counters.get("total_twitter", 0)
+        self.talk_walker.twitter_errors = counters.get("twitter_errors", 0)
+        self.talk_walker.total_saved = counters.get("total_saved", 0)
+
     def setup_job_logger(self, root_logger: logging.Logger, project_id: str, topic_id: str, time_stamp: str):
 
         # one needs to have a good understanding of AWS Cloudwatch metrics dimensions
@@ -330,8 +570,16 @@ class TalkWalkerDriver(Driver):
         self.logger.info(f"{self.application_name} New task id = {task_id} running at timestamp = {timestamp} topic id = {topic_id}")
 
         self.authenticate_s3()
+        checkpoint = None
+        page_in_progress = False
+        progress = None
         try:
-            self.talk_walker = TalkWalker(params, self.logger)
+            # ASYNC_ENGINE=true runs the talkwalker paging, news downloads and twitter hydration on one event loop
+            if os.getenv("ASYNC_ENGINE", "false").casefold() == "true":
+                self.talk_walker = AsyncTalkWalker(params, self.logger)
+            else:
+                self.talk_walker = TalkWalker(params, self.logger)
+            is_async_engine = isinstance(self.talk_walker, AsyncTalkWalker)
 
             # # Note: If the project_id is not specified, the PROJECT_ID from env will be used.
             # if project_id != "":
@@ -394,7 +642,15 @@ class TalkWalkerDriver(Driver):
                 f"{self.application_name} Topic: {topic_id},  total items to be retrieved: {self.talk_walker.required_credits}"
             )
 
-            jsonl_filename = f"{Constants.APPLICATION_NAME}_{topic_id}_{timestamp}.jsonl"  # Include timestamp in the filename
+            checkpoint = self.setup_checkpoint(project_id, topic_id, from_date, to_date)
+            is_resumed = checkpoint is not None and checkpoint.load()
+            if is_resumed:
+                # keep writing to the output of the interrupted run
+                timestamp = checkpoint.state['timestamp']
+                self.logger.info(f"{self.application_name} resuming checkpoint {checkpoint.key} of run {timestamp}")
+
+            output_extension = JSONLSink.get_extension(self.get_output_compression())
+            jsonl_filename = f"{Constants.APPLICATION_NAME}_{topic_id}_{timestamp}.jsonl{output_extension}"  # Include timestamp in the filename
             error_filename = f"{Constants.APPLICATION_NAME}_{topic_id}_{timestamp}.errors.txt"  # Include timestamp in the filename
 
             path = './data'
@@ -407,74 +663,133 @@ class TalkWalkerDriver(Driver):
               self.logger.info(f"{self.application_name} Folder {path} already exists")
 
             jsonl_file_path = os.path.join(path, jsonl_filename)
+            # object_storage_key_for_results
+            s3_jsonl_key_name = f"p6m/public/raw/{Constants.APPLICATION_NAME}/{self.talk_walker.project_id}/{topic_id}/{timestamp}/{task_id}.jsonl{output_extension}"
             error_file_path = os.path.join(path, error_filename)
+            jsonl_filename_txt = f"{jsonl_filename}.txt"
 
             self.logger.info(f'local json file path = {jsonl_file_path}')
             self.logger.info(f'local error file path = {error_file_path}')
 
             tweet_items = []  # list to hold tweet items for batching
 
-            job_status_update = {
-                "total_retrieved": 0,
-                "total_twitter": 0,
-                "twitter_errors": 0,
-                "self.talk_walker.total_saved": 0,
-                "latest_errors": [],
-            }
-
-            loop_count = 0
-
-            for data in self.talk_walker.retrieve_data():
-                for item in data:
-
-                    loop_count += 1
-
-                    if item["external_provider"] == "twitter":
-                        tweet_items.append(item)  # add the item to the batch list
-
-                        # If we've reached 100 items, get the tweets and write to the file
-                        if len(tweet_items) == Constants.TWITTER_IDS_COUNT:
-                            self.logger.info(
-                                f"Batched tweeter items = {len(tweet_items)} "
-                            )
-                            merged_items = self.merge_tweet_data(
-                                tweet_items, error_file_path
-                            )
-                            self.logger.info(
-                                f"Merged tweeter items = {len(merged_items)} from original TW items  = {len(tweet_items)}"
-                            )
-                            self.talk_walker.total_saved += len(merged_items)
-                            self.save_data_to_file(merged_items, jsonl_file_path)
-                            tweet_items = []
-                    else:
-                        self.talk_walker.total_saved += 1
-                        self.save_data_to_file([item], jsonl_file_path)
-
-                    job_status_update = {
-                        "total_retrieved": self.talk_walker.total_item_count,
-                        "total_twitter": self.talk_walker.total_twitter_count,
-                        "twitter_errors": self.talk_walker.twitter_errors,
-                        "total_saved": self.talk_walker.total_saved,
-                        "latest_errors": self.talk_walker.get_latest_errors(),
-                    }
-
-                    self.logger.info(f"### {self.application_name} status : {job_status_update}")
-
-                    # Note: This is a very slow call with potential to slow the overall process
+            self.setup_tweet_cache()
+            self.setup_article_cache()
 
-                    if loop_count % 24 == 0:
-                        self.logger.write_metric_value("total_retrieved", self.talk_walker.total_item_count)
-                        self.logger.write_metric_value("total_twitter", self.talk_walker.total_twitter_count)
-                        self.logger.write_metric_value("twitter_errors", self.talk_walker.twitter_errors)
-                        self.logger.write_metric_value("total_saved", self.talk_walker.total_saved)
-
-                    if len(self.talk_walker.get_latest_errors()) != 0:
-                        self.logger.info(f'{self.application_name} latest errors : {self.talk_walker.get_latest_errors()}')
-
-            if tweet_items:
-                merged_items = self.merge_tweet_data(tweet_items, error_file_path)
-                self.talk_walker.total_saved += len(merged_items)
-                self.save_data_to_file(merged_items, jsonl_file_path)
+            # the caches are closed and saved for the next jobs whether the paging failed or not
+            hydrator = None
+            try:
+                # twitter hydration batches running on the async engine or the hydration stage,
+                # each batch is saved once it completes
+                pending_merges = deque()
+                hydrator = None if is_async_engine else self.setup_twitter_hydrator(error_file_path)
+
+                def save_merged_items(merged_items):
+                    self.talk_walker.total_saved += len(merged_items)
+                    self.output.write_items(merged_items)
+
+                def save_completed_merges():
+                    for _ in range(len(pending_merges)):
+                        batch, future = pending_merges.popleft()
+                        if future.done():
+                            save_merged_items(future.result())
+                        else:
+                            pending_merges.append((batch, future))
+
+                def hydrate_tweet_items(batch):
+                    if is_async_engine:
+                        future = self.talk_walker.run_coroutine(self.merge_tweet_data_async(batch, error_file_path))
+                    else:
+                        future = hydrator.submit(batch)
+                    pending_merges.append((batch, future))
+
+                is_restored = checkpoint is not None and is_resumed and checkpoint.restore_output()
+                if not is_restored:
+                    open(jsonl_file_path, "w").close()
+                # the output is opened for appending once it is restored or truncated
+                self.setup_output(jsonl_file_path, s3_jsonl_key_name, jsonl_filename_txt)
+
+                if is_restored:
+                    self.set_job_counters(checkpoint.state['counters'])
+                    self.talk_walker.set_resume_state(
+                        checkpoint.get_windows(), checkpoint.completed, checkpoint.get_resume_offsets()
+                    )
+                    pending_items = checkpoint.state['pending_items']
+                    for i in range(0, len(pending_items), Constants.TWITTER_IDS_COUNT):
+                        batch = pending_items[i:i + Constants.TWITTER_IDS_COUNT]
+                        if len(batch) == Constants.TWITTER_IDS_COUNT:
+                            hydrate_tweet_items(batch)
+                        else:
+                            tweet_items = batch
+                elif checkpoint is not None:
+                    if is_resumed:
+                        self.logger.info(f"{self.application_name} output of run {timestamp} could not be restored, starting over")
+                    checkpoint.start(timestamp, jsonl_file_path)
+
+                # the job status is logged and reported as metrics every PROGRESS_INTERVAL seconds
+                progress = ProgressReporter(
+                    self.logger,
+                    self.application_name,
+                    self.get_job_counters,
+                    errors=self.talk_walker.get_latest_errors,
+                    interval=float(os.getenv("PROGRESS_INTERVAL", "30")),
+                    rate_of="total_retrieved",
+                )
+                progress.start()
+
+                pages = self.talk_walker.iter_pages() if is_async_engine else self.talk_walker.retrieve_data()
+
+                for data in pages:
+                    page_in_progress = True
+                    save_completed_merges()
+
+                    for item in data:
+                        if item["external_provider"] == "twitter":
+                            tweet_items.append(item)  # add the item to the batch list
+
+                            # If we've reached 100 items, get the tweets and write to the file
+                            if len(tweet_items) == Constants.TWITTER_IDS_COUNT:
+                                hydrate_tweet_items(tweet_items)
+                                tweet_items = []
+                        else:
+                            self.talk_walker.total_saved += 1
+                            self.output.write(item)
+
+                    if checkpoint is not None:
+                        # every item of this page is now either in the output file or waiting for hydration
+                        if checkpoint.get_windows() is None:
+                            checkpoint.set_windows(self.talk_walker.windows)
+                        checkpoint.page_processed(
+                            data.window,
+                            data.next_offset,
+                            [item for batch, _ in pending_merges for item in batch] + tweet_items,
+                            self.get_job_counters(),
+                        )
+                        if checkpoint.is_save_due():
+                            checkpoint.save(self.output.sync())
+                    page_in_progress = False
+
+                # the items of the last batches are written without a page, a checkpoint is not saved meanwhile
+                page_in_progress = True
+                if tweet_items:
+                    hydrate_tweet_items(tweet_items)
+                    tweet_items = []
+
+                while pending_merges:
+                    save_merged_items(pending_merges.popleft()[1].result())
+
+                if checkpoint is not None:
+                    checkpoint.items_pending([], self.get_job_counters())
+                page_in_progress = False
+            finally:
+                if hydrator is not None:
+                    hydrator.close()
+                self.talk_walker.close()
+                self.close_tweet_cache()
+                self.close_article_cache()
+
+            self.output.close()
+            self.logger.write_metric_value("output_bytes_per_second", self.output.get_stats()["bytes_per_second"])
 
             self.logger.info(
                 f"### {self.application_name} ### Final Total items retrieved: {self.talk_walker.total_item_count}"
@@ -490,19 +805,13 @@ class TalkWalkerDriver(Driver):
             )
 
             # final update of job metrics
-            self.logger.write_metric_value("total_retrieved", self.talk_walker.total_item_count)
-            self.logger.write_metric_value("total_twitter", self.talk_walker.total_twitter_count)
-            self.logger.write_metric_value("twitter_errors", self.talk_walker.twitter_errors)
-            self.logger.write_metric_value("total_saved", self.talk_walker.total_saved)
+            progress.stop()
             self.logger.info(f'{self.application_name} latest errors : {self.talk_walker.get_latest_errors()}')
 
             self.logger.info(f'{self.application_name} Status : talkwalker portion of the job is completed. Next step is to save results to S3 now.')
 
-            # object_storage_key_for_results
-            s3_jsonl_key_name = f"p6m/public/raw/{Constants.APPLICATION_NAME}/{self.talk_walker.project_id}/{topic_id}/{timestamp}/{task_id}.jsonl"
-            self.upload_file(
-                jsonl_file_path, self.buckets['output'], s3_jsonl_key_name
-            )
+            if self.upload_output(jsonl_file_path, s3_jsonl_key_name) and checkpoint is not None:
+                checkpoint.clear()
 #             original_document_metadata = self.put_original_document_metadata(
 #                 task_queue_id=task_id,
 #                 task_type=Constants.DRIVER_NAME,
@@ -516,8 +825,6 @@ class TalkWalkerDriver(Driver):
 
             self.logger.info(f'{self.application_name} Status : output bucket - has been written to.')
 
-
-            jsonl_filename_txt = f"{jsonl_filename}.txt"
             self.extract_text(jsonl_filename, jsonl_file_path, jsonl_filename_txt)
 
 #             put_text_document_metadata = self.put_text_document_metadata(
@@ -567,6 +874,17 @@ class TalkWalkerDriver(Driver):
             print(traceback.format_exc())
             self.logger.error(traceback.format_exc())
             self.logger.info(f"Task failed - exception caught : {e}")
+            if progress is not None:
+                progress.stop()
+            if checkpoint is not None and checkpoint.state and self.output is not None and not page_in_progress:
+                # keep the progress of the last processed page for the next run
+                checkpoint.save(self.output.sync())
+                self.logger.info(f"Checkpoint {checkpoint.key} saved, the next run resumes from it")
+            if self.output_upload is not None:
+                self.output_upload.abort()
+            self.abort_inline_text()
+            # write out the queued records, the traceback included, before exiting
+            self.terminate_job_logger()
             exit(1)
 
         self.terminate_job_logger()
@@ -0,0 +1,114 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from .checkpoint import Checkpoint
+from libraries.ingestors.talkwalker.talkwalker_ingestor import TalkWalker
+
+WINDOW = (1700000000, 1700003600)
+PAGE_SIZE = 2
+TOTAL_ITEMS = 8
+
+
+def get_response(offset):
+    """TalkWalker response of the page at offset, with a next link until the last page"""
+
+    data = [
+        {"data": {"url": f"https://example.com/{i}", "title": f"item {i}", "published": "1700000000000"}}
+        for i in range(offset, min(offset + PAGE_SIZE, TOTAL_ITEMS))
+    ]
+    pagination = {}
+    if offset + PAGE_SIZE < TOTAL_ITEMS:
+        pagination["next"] = f"https://api.talkwalker.com/results?offset={offset + PAGE_SIZE}&pretty=true"
+    return {"data": {"result_content": {"data": data}, "pagination": pagination}, "pagination": pagination}
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.test_dir, "output.jsonl")
+        self.env = patch.dict(os.environ, {"MAX_RETRIES": "1", "PAGE_SIZE": str(PAGE_SIZE)})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.test_dir)
+
+    @patch("nltk.download")
+    def create_talkwalker(self, failing_offsets, _):
+        talk_walker = TalkWalker(
+            {"project_id": "project", "topic_id": "topic", "from_date": None, "to_date": None, "get_news_links": False},
+            Mock(),
+        )
+        talk_walker.windows = [WINDOW]
+        requested = []
+
+        def download_as_object(url, parameters=None):
+            offset = parameters["offset"]
+            requested.append(offset)
+            return None if offset in failing_offsets else get_response(offset)
+
+        talk_walker.download_as_object = download_as_object
+        return talk_walker, requested
+
+    def run_ingestion(self, checkpoint, talk_walker):
+        """Writes the pages like the driver does, saving the checkpoint after every page and on failure"""
+
+        with open(self.output_file, "a") as output:
+            try:
+                for page in talk_walker.retrieve_data():
+                    for item in page:
+                        output.write(json.dumps(item) + "\n")
+                    output.flush()
+                    checkpoint.page_processed(page.window, page.next_offset, [], {})
+                    checkpoint.save(output.tell())
+            except Exception:
+                output.flush()
+                checkpoint.save(os.path.getsize(self.output_file))
+                return False
+        return True
+
+    def read_titles(self):
+        with open(self.output_file) as f:
+            return [json.loads(line)["title"] for line in f]
+
+    def test_failed_request_keeps_the_window_in_progress(self):
+        checkpoint = Checkpoint("project/topic/range", path=self.test_dir)
+        checkpoint.start(0, self.output_file)
+        checkpoint.set_windows([WINDOW])
+        open(self.output_file, "w").close()
+        talk_walker, requested = self.create_talkwalker({4})
+
+        self.assertFalse(self.run_ingestion(checkpoint, talk_walker))
+        self.assertEqual(requested, [0, 2, 4])
+        self.assertFalse(checkpoint.is_completed(WINDOW))
+        self.assertEqual(checkpoint.get_resume_offsets(), {WINDOW: 4})
+
+        resumed = Checkpoint("project/topic/range", path=self.test_dir)
+        self.assertTrue(resumed.load())
+        self.assertTrue(resumed.restore_output())
+        talk_walker, requested = self.create_talkwalker(set())
+        talk_walker.set_resume_state(resumed.get_windows(), resumed.completed, resumed.get_resume_offsets())
+
+        self.assertTrue(self.run_ingestion(resumed, talk_walker))
+        self.assertEqual(requested, [4, 6])
+        self.assertTrue(resumed.is_completed(WINDOW))
+        self.assertEqual(self.read_titles(), [f"item {i}" for i in range(TOTAL_ITEMS)])
+
+    def test_failed_first_request_does_not_complete_the_window(self):
+        checkpoint = Checkpoint("project/topic/range", path=self.test_dir)
+        checkpoint.start(0, self.output_file)
+        checkpoint.set_windows([WINDOW])
+        open(self.output_file, "w").close()
+        talk_walker, _ = self.create_talkwalker({0})
+
+        self.assertFalse(self.run_ingestion(checkpoint, talk_walker))
+        self.assertFalse(checkpoint.is_completed(WINDOW))
+        self.assertEqual(self.read_titles(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from .checkpoint import Checkpoint
+from .jsonl_sink import JSONLSink, zstandard
+
+
+class StubUpload:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data) -> int:
+        self.data += data
+        return len(data)
+
+
+class TestJSONLSink(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def get_file_path(self, compression):
+        return os.path.join(self.test_dir, "output.jsonl" + JSONLSink.get_extension(compression))
+
+    @staticmethod
+    def read_items(file_path, compression):
+        if compression == "gzip":
+            with gzip.open(file_path, "rt", encoding="utf-8") as f:
+                return [json.loads(line) for line in f]
+        if compression == "zstd":
+            with open(file_path, "rb") as f:
+                data = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True).read()
+            return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+        with open(file_path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def check_resume_from_checkpoint(self, compression):
+        """Writes, saves a checkpoint, writes items that are lost, restores the output and appends"""
+
+        file_path = self.get_file_path(compression)
+        checkpoint = Checkpoint("project/topic/range", path=self.test_dir)
+        checkpoint.start(0, file_path)
+
+        sink = JSONLSink(file_path, compression=compression, flush_size=64)
+        sink.write_items([{"id": i} for i in range(10)])
+        checkpoint.save(sink.sync())
+        # written after the last save, these items are dropped by the restore
+        sink.write_items([{"id": i} for i in range(100, 110)])
+        sink.sync()
+        sink.close()
+        self.assertEqual(len(self.read_items(file_path, compression)), 20)
+
+        resumed = Checkpoint("project/topic/range", path=self.test_dir)
+        self.assertTrue(resumed.load())
+        self.assertTrue(resumed.restore_output())
+        self.assertEqual(os.path.getsize(file_path), resumed.state["output_size"])
+
+        sink = JSONLSink(file_path, compression=compression)
+        sink.write_items([{"id": i} for i in range(10, 15)])
+        sink.close()
+
+        self.assertEqual(self.read_items(file_path, compression), [{"id": i} for i in range(15)])
+
+    def test_resume_uncompressed(self):
+        self.check_resume_from_checkpoint(None)
+
+    def test_resume_gzip(self):
+        self.check_resume_from_checkpoint("gzip")
+
+    @unittest.skipUnless(zstandard, "zstandard is not installed")
+    def test_resume_zstd(self):
+        self.check_resume_from_checkpoint("zstd")
+
+    def test_sync_returns_the_file_size(self):
+        file_path = self.get_file_path("gzip")
+        sink = JSONLSink(file_path, compression="gzip")
+        sink.write({"id": 1})
+
+        size = sink.sync()
+
+        self.assertEqual(size, os.path.getsize(file_path))
+        self.assertEqual(self.read_items(file_path, "gzip"), [{"id": 1}])
+        sink.close()
+
+    def test_upload_receives_the_existing_and_the_new_content(self):
+        file_path = self.get_file_path("gzip")
+        sink = JSONLSink(file_path, compression="gzip")
+        sink.write({"id": 1})
+        sink.close()
+
+        upload = StubUpload()
+        sink = JSONLSink(file_path, compression="gzip", upload=upload)
+        sink.write({"id": 2})
+        sink.close()
+
+        with open(file_path, "rb") as f:
+            self.assertEqual(bytes(upload.data), f.read())
+
+    def test_unsupported_compression(self):
+        with self.assertRaises(Exception):
+            JSONLSink(self.get_file_path(None), compression="bz2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+
+from .twitter_hydration import TwitterHydrator
+
+
+def get_items(ids):
+    return [{"external_id": external_id} for external_id in ids]
+
+
+def merge(items, tweets_data):
+    """Merges like the driver: every item with its tweet, or with its error"""
+
+    tweets_by_id = {tweet["id"]: tweet for tweet in tweets_data["data"]}
+    errors_by_id = {error["value"]: error for error in tweets_data["errors"]}
+    return [
+        dict(item, tweet=tweets_by_id.get(item["external_id"]), error=errors_by_id.get(item["external_id"]))
+        for item in items
+    ]
+
+
+class StubLookup:
+    """Bulk lookup returning the tweets of the ids, except the ids failing for their first failures calls"""
+
+    def __init__(self, failing_ids=(), failures=1):
+        self.failures = {external_id: failures for external_id in failing_ids}
+        self.calls = []
+
+    def __call__(self, ids):
+        self.calls.append(list(ids))
+        tweets = []
+        errors = []
+        for external_id in ids:
+            if self.failures.get(external_id, 0) > 0:
+                self.failures[external_id] -= 1
+                errors.append({"value": external_id, "detail": "not found"})
+            else:
+                tweets.append({"id": external_id})
+        return {"data": tweets, "errors": errors}
+
+
+class TestTwitterHydrator(unittest.TestCase):
+    def create_hydrator(self, lookup, **kwargs):
+        hydrator = TwitterHydrator(lookup, merge, workers=2, retry_delay=0.01, max_attempts=3, batch_size=4, **kwargs)
+        self.addCleanup(hydrator.close)
+        return hydrator
+
+    def test_batch_is_merged(self):
+        lookup = StubLookup()
+        hydrator = self.create_hydrator(lookup)
+
+        merged = hydrator.submit(get_items(["1", "2"])).result(timeout=5)
+
+        self.assertEqual([item["tweet"] for item in merged], [{"id": "1"}, {"id": "2"}])
+        self.assertEqual(lookup.calls, [["1", "2"]])
+
+    def test_id_failing_once_is_retried(self):
+        lookup = StubLookup(failing_ids=["2"])
+        retries = []
+        hydrator = self.create_hydrator(lookup, retry_lookup=lambda ids: retries.append(list(ids)) or lookup(ids))
+
+        merged = hydrator.submit(get_items(["1", "2"])).result(timeout=5)
+
+        self.assertEqual([item["tweet"] for item in merged], [{"id": "1"}, {"id": "2"}])
+        self.assertEqual([item["error"] for item in merged], [None, None])
+        self.assertEqual(retries, [["2"]])
+
+    def test_id_failing_permanently_is_merged_with_its_error(self):
+        lookup = StubLookup(failing_ids=["2"], failures=10)
+        hydrator = self.create_hydrator(lookup)
+
+        merged = hydrator.submit(get_items(["1", "2"])).result(timeout=5)
+
+        self.assertEqual(merged[0]["tweet"], {"id": "1"})
+        self.assertIsNone(merged[1]["tweet"])
+        self.assertEqual(merged[1]["error"], {"value": "2", "detail": "not found"})
+        self.assertEqual(lookup.calls, [["1", "2"], ["2"], ["2"]])
+
+    def test_failed_lookup_call_is_retried(self):
+        calls = []
+
+        def lookup(ids):
+            calls.append(list(ids))
+            return None if len(calls) == 1 else {"data": [{"id": external_id} for external_id in ids], "errors": []}
+
+        hydrator = self.create_hydrator(lookup)
+
+        merged = hydrator.submit(get_items(["1"])).result(timeout=5)
+
+        self.assertEqual(merged[0]["tweet"], {"id": "1"})
+        self.assertEqual(calls, [["1"], ["1"]])
+
+    def test_lookup_exception_fails_the_batch(self):
+        def lookup(ids):
+            raise Exception("lookup failed")
+
+        hydrator = self.create_hydrator(lookup)
+
+        with self.assertRaises(Exception):
+            hydrator.submit(get_items(["1"])).result(timeout=5)
+
+    def test_empty_batch_completes_at_once(self):
+        hydrator = self.create_hydrator(StubLookup())
+
+        self.assertEqual(hydrator.submit([]).result(timeout=5), [])
+
+    def test_close_stops_the_workers(self):
+        hydrator = TwitterHydrator(StubLookup(), merge, workers=2, retry_delay=0.01)
+        hydrator.submit(get_items(["1"])).result(timeout=5)
+
+        hydrator.close()
+        hydrator.close()
+
+        self.assertFalse(hydrator.scheduler.is_alive())
+        self.assertFalse(any(worker.is_alive() for worker in hydrator.workers))
+
+
+if __name__ == "__main__":
+    unittest.main()
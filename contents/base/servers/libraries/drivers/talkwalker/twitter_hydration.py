@@ -0,0 +1,165 @@
+import time
+import heapq
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+
+class HydrationBatch:
+    """Twitter items of one batch and the lookup results collected for them"""
+
+    def __init__(self, items: list):
+        self.items = items
+        self.future = Future()
+        self.tweets = []
+        self.errors = []
+        self.outstanding = len(items)
+        self.lock = threading.Lock()
+
+
+class TwitterHydrator:
+    """Pipeline stage hydrating batches of twitter items next to the TalkWalker paging.
+
+    submit() puts a batch on a bounded input queue (and waits when it is full) and returns a Future of the
+    merged items. A pool of workers sends the bulk lookups. Ids the lookup could not return are not retried
+    in place: they go to a delayed-retry queue and are looked up again after retry_delay seconds, together
+    with the due ids of other batches. A batch completes once each of its ids was hydrated or failed
+    max_attempts times, its future then holds merge(items, {"data": tweets, "errors": errors}).
+    The retried ids are looked up with retry_lookup when it is set.
+    """
+
+    def __init__(self, lookup, merge, workers: int = 2, queue_size: int = 8, retry_delay: float = 15.0,
+                 max_attempts: int = 3, batch_size: int = 100, retry_lookup=None):
+        self.logger = logging.getLogger()
+        self.lookup = lookup
+        self.retry_lookup = retry_lookup or lookup
+        self.merge = merge
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+
+        # tasks are lists of (batch, ids, attempt)
+        self.tasks = queue.Queue(maxsize=queue_size)
+        self.retries = []
+        self.retries_sequence = 0
+        self.retries_condition = threading.Condition()
+        self.closed = False
+
+        self.workers = [
+            threading.Thread(target=self.run_worker, name=f"twitter_hydration_{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for worker in self.workers:
+            worker.start()
+        self.scheduler = threading.Thread(target=self.run_scheduler, name="twitter_hydration_retries", daemon=True)
+        self.scheduler.start()
+
+    def submit(self, items: list) -> Future:
+        batch = HydrationBatch(items)
+        if not items:
+            batch.future.set_result([])
+            return batch.future
+        self.tasks.put([(batch, [item["external_id"] for item in items], 1)])
+        return batch.future
+
+    def run_worker(self) -> None:
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            try:
+                self.hydrate(task)
+            except Exception as e:
+                self.logger.error(f"Twitter hydration failed: {e}")
+                for batch, _, _ in task:
+                    if not batch.future.done():
+                        batch.future.set_exception(e)
+
+    def hydrate(self, task) -> None:
+        ids = [external_id for _, batch_ids, _ in task for external_id in batch_ids]
+        # the scheduler only groups retries, the tasks of submit() are first attempts
+        is_retry = task[0][2] > 1
+        result = self.retry_lookup(ids) if is_retry else self.lookup(ids)
+        if result is None:
+            # the call itself failed, every id is retried
+            result = {"data": [], "errors": [{"value": external_id, "detail": "lookup failed"} for external_id in ids]}
+
+        tweets_by_id = {tweet["id"]: tweet for tweet in result["data"]}
+        errors_by_id = {error["value"]: error for error in result["errors"] if "value" in error}
+
+        for batch, batch_ids, attempt in task:
+            failed_ids = []
+            with batch.lock:
+                for external_id in batch_ids:
+                    tweet = tweets_by_id.get(external_id)
+                    if tweet is not None:
+                        batch.tweets.append(tweet)
+                        batch.outstanding -= 1
+                    elif attempt < self.max_attempts:
+                        failed_ids.append(external_id)
+                    else:
+                        batch.errors.append(errors_by_id.get(external_id, {"value": external_id, "detail": "not returned"}))
+                        batch.outstanding -= 1
+                is_complete = not failed_ids and batch.outstanding == 0
+
+            if failed_ids:
+                self.logger.info(f"NOT FOUND - attempt {attempt}, retrying in {self.retry_delay}s: {failed_ids}")
+                self.schedule_retry(batch, failed_ids, attempt + 1)
+            elif is_complete:
+                self.complete(batch)
+
+    def complete(self, batch: HydrationBatch) -> None:
+        try:
+            batch.future.set_result(self.merge(batch.items, {"data": batch.tweets, "errors": batch.errors}))
+        except Exception as e:
+            batch.future.set_exception(e)
+
+    def schedule_retry(self, batch: HydrationBatch, ids: list, attempt: int) -> None:
+        with self.retries_condition:
+            self.retries_sequence += 1
+            heapq.heappush(self.retries, (time.monotonic() + self.retry_delay, self.retries_sequence, batch, ids, attempt))
+            self.retries_condition.notify()
+
+    def run_scheduler(self) -> None:
+        """Moves the due retries to the input queue, grouping the ids of several batches in one lookup"""
+
+        while True:
+            with self.retries_condition:
+                while not self.closed and (not self.retries or self.retries[0][0] > time.monotonic()):
+                    timeout = self.retries[0][0] - time.monotonic() if self.retries else None
+                    self.retries_condition.wait(timeout)
+                if self.closed:
+                    return
+                due = []
+                while self.retries and self.retries[0][0] <= time.monotonic():
+                    _, _, batch, ids, attempt = heapq.heappop(self.retries)
+                    due.append((batch, ids, attempt))
+
+            task = []
+            task_size = 0
+            for batch, ids, attempt in due:
+                for i in range(0, len(ids), self.batch_size):
+                    chunk = ids[i:i + self.batch_size]
+                    if task_size + len(chunk) > self.batch_size:
+                        self.tasks.put(task)
+                        task = []
+                        task_size = 0
+                    task.append((batch, chunk, attempt))
+                    task_size += len(chunk)
+            if task:
+                self.tasks.put(task)
+
+    def close(self) -> None:
+        """Stops the workers, the batches still pending are not completed"""
+
+        with self.retries_condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.retries_condition.notify()
+        self.scheduler.join()
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
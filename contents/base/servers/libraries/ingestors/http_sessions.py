@@ -0,0 +1,81 @@
+import os
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from fake_useragent import UserAgent
+
+
+_sessions = {}
+_shared_session = None
+_sessions_lock = threading.Lock()
+
+_user_agent = None
+_user_agent_lock = threading.Lock()
+
+
+def get_session(url: str) -> requests.Session:
+    """Returns the keep-alive requests.Session shared by every call made to the host of url.
+
+    Connections are pooled by an HTTPAdapter sized with HTTP_POOL_CONNECTIONS and HTTP_POOL_MAXSIZE,
+    so repeated calls to the same api reuse the TCP+TLS connection instead of opening a new one.
+    """
+
+    parsed_url = urlparse(url)
+    host = f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", "4")),
+                pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", "16")),
+            )
+            session.mount(f"{parsed_url.scheme}://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def get_shared_session() -> requests.Session:
+    """Returns the keep-alive requests.Session shared by the calls made to many hosts, such as news article downloads.
+
+    A session per host would keep every publisher host for the whole process. The adapter of this session keeps
+    the connection pools of the HTTP_SHARED_POOL_HOSTS most recently used hosts (least recently used ones are
+    closed by urllib3), each of at most HTTP_SHARED_POOL_MAXSIZE connections.
+    """
+
+    global _shared_session
+    with _sessions_lock:
+        if _shared_session is None:
+            _shared_session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=int(os.getenv("HTTP_SHARED_POOL_HOSTS", "64")),
+                pool_maxsize=int(os.getenv("HTTP_SHARED_POOL_MAXSIZE", "2")),
+            )
+            _shared_session.mount("http://", adapter)
+            _shared_session.mount("https://", adapter)
+        return _shared_session
+
+
+def get_user_agent() -> UserAgent:
+    """Returns the UserAgent instance built once per process, as building it loads the whole browser list"""
+
+    global _user_agent
+    with _user_agent_lock:
+        if _user_agent is None:
+            _user_agent = UserAgent()
+        return _user_agent
+
+
+def close_sessions() -> None:
+    """Closes every pooled session and its connections"""
+
+    global _shared_session
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        if _shared_session is not None:
+            _shared_session.close()
+            _shared_session = None
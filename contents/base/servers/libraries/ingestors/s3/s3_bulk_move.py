@@ -0,0 +1,113 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class S3BulkMover:
+    """Moves objects between buckets in the background, for callers moving objects one at a time.
+
+    move() returns at once with a Future of the outcome. The server side copies run on a pool of workers
+    (see S3Storage.copy_file), and the sources of the checked copies are deleted with delete_objects calls
+    of up to delete_batch_size keys, sent once a batch of a bucket is full or after flush_interval seconds.
+    close() waits for the pending moves and returns the (source bucket, object name, target bucket) of the failed ones.
+    """
+
+    def __init__(self, storage, workers: int = 8, delete_batch_size: int = 1000, flush_interval: float = 5.0):
+        self.logger = logging.getLogger()
+        self.storage = storage
+        self.delete_batch_size = min(max(1, delete_batch_size), storage.MAX_DELETE_KEYS)
+        self.flush_interval = flush_interval
+
+        self.copies = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="s3_move")
+
+        # source bucket -> (object name, target bucket, future) copied and waiting for their delete
+        self.deletes = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.flushed_at = time.monotonic()
+
+        self.moved = 0
+        self.failed = []
+
+        self.deleter = threading.Thread(target=self.run_deleter, name="s3_delete", daemon=True)
+        self.deleter.start()
+
+    def move(self, source_bucket_name, object_name, target_bucket_name) -> Future:
+        future = Future()
+        self.copies.submit(self.copy, source_bucket_name, object_name, target_bucket_name, future)
+        return future
+
+    def copy(self, source_bucket_name, object_name, target_bucket_name, future) -> None:
+        try:
+            is_copied = self.storage.copy_file(source_bucket_name, object_name, target_bucket_name)
+        except Exception as e:
+            self.logger.error(e)
+            is_copied = False
+
+        if not is_copied:
+            self.complete(source_bucket_name, object_name, target_bucket_name, future, False)
+            return
+
+        with self.condition:
+            batch = self.deletes.setdefault(source_bucket_name, [])
+            batch.append((object_name, target_bucket_name, future))
+            self.condition.notify()
+
+    def run_deleter(self) -> None:
+        while True:
+            with self.condition:
+                while not self.closed and not self.is_flush_due():
+                    if not self.deletes:
+                        self.condition.wait()
+                        # the first copied key of a batch waits flush_interval for the next ones
+                        self.flushed_at = time.monotonic()
+                    else:
+                        self.condition.wait(max(0.0, self.flushed_at + self.flush_interval - time.monotonic()))
+                deletes = self.take_batches()
+                closed = self.closed
+            self.delete(deletes)
+            if closed and not deletes:
+                return
+
+    def is_flush_due(self) -> bool:
+        if any(len(batch) >= self.delete_batch_size for batch in self.deletes.values()):
+            return True
+        return bool(self.deletes) and time.monotonic() - self.flushed_at >= self.flush_interval
+
+    def take_batches(self) -> list:
+        """Returns (bucket, batch) of at most delete_batch_size keys for every bucket with pending deletes"""
+
+        deletes = []
+        for source_bucket_name in list(self.deletes):
+            batch = self.deletes[source_bucket_name]
+            deletes.append((source_bucket_name, batch[:self.delete_batch_size]))
+            if len(batch) > self.delete_batch_size:
+                self.deletes[source_bucket_name] = batch[self.delete_batch_size:]
+            else:
+                del self.deletes[source_bucket_name]
+        self.flushed_at = time.monotonic()
+        return deletes
+
+    def delete(self, deletes) -> None:
+        for source_bucket_name, batch in deletes:
+            failed = set(self.storage.delete_files(source_bucket_name, [object_name for object_name, _, _ in batch]))
+            for object_name, target_bucket_name, future in batch:
+                self.complete(source_bucket_name, object_name, target_bucket_name, future, object_name not in failed)
+
+    def complete(self, source_bucket_name, object_name, target_bucket_name, future, is_moved: bool) -> None:
+        with self.condition:
+            if is_moved:
+                self.moved += 1
+            else:
+                self.failed.append((source_bucket_name, object_name, target_bucket_name))
+        future.set_result(is_moved)
+
+    def close(self) -> list:
+        self.copies.shutdown(wait=True)
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.deleter.join()
+        self.logger.info(f"S3 bulk mover closed: {self.moved} objects moved, {len(self.failed)} failed")
+        return list(self.failed)
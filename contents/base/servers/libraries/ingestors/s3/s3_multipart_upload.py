@@ -0,0 +1,155 @@
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class S3MultipartUpload:
+    """Streams bytes to one S3 object with a multipart upload.
+
+    write() buffers the bytes and uploads a part on a worker thread every time part_size bytes are buffered,
+    so the upload runs while the data is still being produced. At most two parts per worker are kept in flight,
+    write() waits for the oldest one beyond that, which bounds the memory used by the upload.
+
+    complete() uploads the last part and completes the upload, abort() discards the uploaded parts.
+    complete() returns False when the upload failed, the caller can then fall back to a regular upload.
+    """
+
+    MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum size of every part but the last one
+
+    def __init__(self, s3client, bucket_name: str, object_name: str, part_size: int = 8 * 1024 * 1024,
+                 workers: int = 4, max_retries: int = 3):
+        self.logger = logging.getLogger()
+        self.s3client = s3client
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.part_size = max(part_size, self.MIN_PART_SIZE)
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+
+        self.upload_id = None
+        self.executor = None
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.parts = []
+        self.part_number = 0
+        self.bytes_uploaded = 0
+        self.failed = False
+        self.closed = False
+
+    def start(self) -> bool:
+        try:
+            response = self.s3client.create_multipart_upload(Bucket=self.bucket_name, Key=self.object_name)
+            self.upload_id = response["UploadId"]
+        except Exception as e:
+            self.logger.error(f"S3 : multipart upload of {self.object_name} to bucket {self.bucket_name} failed: {e}")
+            self.failed = True
+            return False
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="s3_upload")
+        self.logger.info(f"S3 : streaming upload to bucket {self.bucket_name} key {self.object_name} started")
+        return True
+
+    def write(self, data) -> int:
+        if self.failed or self.closed:
+            return 0
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            part = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            self.submit_part(part)
+        return len(data)
+
+    def flush(self) -> None:
+        # parts are uploaded once they are full, the remainder is uploaded by complete()
+        pass
+
+    def submit_part(self, part: bytes) -> None:
+        if self.upload_id is None and not self.start():
+            return
+
+        self.part_number += 1
+        self.pending.append(self.executor.submit(self.upload_part, self.part_number, part))
+        while len(self.pending) > self.workers * 2:
+            self.collect_part(self.pending.popleft())
+
+    def upload_part(self, part_number: int, part: bytes) -> dict:
+        for i in range(self.max_retries):
+            try:
+                response = self.s3client.upload_part(
+                    Bucket=self.bucket_name, Key=self.object_name, UploadId=self.upload_id,
+                    PartNumber=part_number, Body=part,
+                )
+                return {"PartNumber": part_number, "ETag": response["ETag"], "Size": len(part)}
+            except Exception as e:
+                self.logger.error(f"S3 : upload of part {part_number} of {self.object_name} failed. Attempt: {i + 1} {e}")
+                if i < self.max_retries - 1:  # wait before retrying, but not after the last attempt
+                    time.sleep(2 ** i)
+        return None
+
+    def collect_part(self, future) -> None:
+        part = future.result()
+        if part is None:
+            self.failed = True
+            return
+        self.bytes_uploaded += part.pop("Size")
+        self.parts.append(part)
+
+    def complete(self) -> bool:
+        """Uploads the remaining bytes and completes the upload, returns False when the object was not written"""
+
+        if self.closed:
+            return not self.failed
+        # an empty object still needs one (empty) part
+        if self.buffer or self.part_number == 0:
+            self.submit_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.collect_part(self.pending.popleft())
+        self.closed = True
+
+        if self.failed:
+            self.abort()
+            return False
+
+        try:
+            self.s3client.complete_multipart_upload(
+                Bucket=self.bucket_name, Key=self.object_name, UploadId=self.upload_id,
+                MultipartUpload={"Parts": sorted(self.parts, key=lambda part: part["PartNumber"])},
+            )
+        except Exception as e:
+            self.logger.error(f"S3 : completing the upload of {self.object_name} failed: {e}")
+            self.failed = True
+            self.abort()
+            return False
+        finally:
+            self.executor.shutdown()
+
+        self.logger.info(
+            f"S3 : streamed {self.bytes_uploaded} bytes in {len(self.parts)} parts to bucket {self.bucket_name} key {self.object_name}"
+        )
+        return True
+
+    def abort(self) -> None:
+        """Discards the parts uploaded so far"""
+
+        if self.closed and not self.failed:
+            # completed already
+            return
+        self.closed = True
+        self.failed = True
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.upload_id is None:
+            return
+        try:
+            self.s3client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=self.object_name, UploadId=self.upload_id
+            )
+            self.logger.info(f"S3 : upload of {self.object_name} to bucket {self.bucket_name} aborted")
+        except Exception as e:
+            self.logger.error(f"S3 : aborting the upload of {self.object_name} failed: {e}")
+        self.upload_id = None
@@ -1,7 +1,11 @@
 import os
+import queue
 import boto3
 import logging
+import threading
+from boto3.s3.transfer import TransferConfig
 from libraries.ingestors.ingestor import Ingestor
+from libraries.ingestors.s3.s3_multipart_upload import S3MultipartUpload
 
 
 class S3Storage(Ingestor):
@@ -72,24 +76,103 @@ class S3Storage(Ingestor):
             logging.error(e)
             raise
 
-    def list_objects(self, bucket_name):
+    def list_objects(self, bucket_name, prefix=""):
         """List contents of a s3 bucket"""
 
+        return list(self.iter_objects(bucket_name, prefix=prefix))
+
+    def iter_pages(self, bucket_name, prefix="", delimiter=None, start_after=None, page_size=1000):
+        """Yields the list_objects_v2 responses of a bucket, following the continuation tokens"""
+
+        parameters = {"Bucket": bucket_name, "Prefix": prefix, "PaginationConfig": {"PageSize": page_size}}
+        if delimiter:
+            parameters["Delimiter"] = delimiter
+        if start_after:
+            parameters["StartAfter"] = start_after
+
         try:
-            response = self.s3client.list_objects(Bucket=bucket_name)
+            paginator = self.s3client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(**parameters):
+                yield page
 
         except Exception as e:
             logging.error(e)
             raise
 
-        if "Contents" not in response:
-            return []
+    def iter_objects(self, bucket_name, prefix="", delimiter=None, start_after=None, page_size=1000):
+        """Yields the keys of a bucket page by page, so the first keys can be processed while the next pages
+        are listed. With a delimiter the keys below the next delimiter are not listed, see list_prefixes()."""
+
+        for page in self.iter_pages(bucket_name, prefix, delimiter, start_after, page_size):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
+
+    def list_prefixes(self, bucket_name, prefix="", delimiter="/"):
+        """List the common prefixes of a bucket one level below prefix, e.g. its folders"""
+
+        return [
+            common_prefix["Prefix"]
+            for page in self.iter_pages(bucket_name, prefix, delimiter)
+            for common_prefix in page.get("CommonPrefixes", [])
+        ]
+
+    def iter_objects_parallel(self, bucket_name, prefixes, workers=4, queue_size=10000, start_after=None):
+        """
+        Yields the keys of several prefixes listed by concurrent threads, in no particular order.
+        At most queue_size listed keys wait for the consumer, the listing threads stop when it is closed.
+        """
+
+        keys = queue.Queue(maxsize=queue_size)
+        pending = queue.Queue()
+        for prefix in prefixes:
+            pending.put(prefix)
+        closed = threading.Event()
+        done = object()
+
+        def put(value):
+            while not closed.is_set():
+                try:
+                    keys.put(value, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
 
-        file_list = []
-        for obj in response["Contents"]:
-            file_list.append(obj["Key"])
+        def list_prefixes():
+            try:
+                while not closed.is_set():
+                    try:
+                        prefix = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    for key in self.iter_objects(bucket_name, prefix=prefix, start_after=start_after):
+                        if not put(key):
+                            return
+            except Exception as e:
+                put(e)
+            put(done)
+
+        threads = [
+            threading.Thread(target=list_prefixes, name=f"s3_list_{i}", daemon=True)
+            for i in range(max(1, min(workers, pending.qsize())))
+        ]
+        for thread in threads:
+            thread.start()
 
-        return file_list
+        try:
+            running = len(threads)
+            while running:
+                key = keys.get()
+                if key is done:
+                    running -= 1
+                elif isinstance(key, Exception):
+                    raise key
+                else:
+                    yield key
+        finally:
+            closed.set()
+            for thread in threads:
+                thread.join()
 
     def download_file(self, bucket_name, object_name, local_file_name):
         """Download object from a S3 bucket to a local file"""
@@ -113,17 +196,90 @@ class S3Storage(Ingestor):
             self.logger.error(e)
             return False
 
-    def move_file(self, source_bucket_name, object_name, target_bucket_name):
-        """Move an object between two buckets"""
+    def open_upload(self, bucket_name, object_name):
+        """Returns a streaming multipart upload to a bucket, sized by UPLOAD_PART_SIZE and UPLOAD_WORKERS"""
+        return S3MultipartUpload(
+            self.s3client,
+            bucket_name,
+            object_name,
+            part_size=int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))),
+            workers=int(os.getenv("UPLOAD_WORKERS", "4")),
+        )
+
+    # delete_objects accepts at most 1000 keys per call
+    MAX_DELETE_KEYS = 1000
+
+    @staticmethod
+    def get_copy_config():
+        """Managed copies are multipart above COPY_MULTIPART_THRESHOLD bytes, copy_object is limited to 5 GB"""
+        return TransferConfig(
+            multipart_threshold=int(os.getenv("COPY_MULTIPART_THRESHOLD", str(256 * 1024 * 1024))),
+            multipart_chunksize=int(os.getenv("COPY_PART_SIZE", str(256 * 1024 * 1024))),
+            max_concurrency=int(os.getenv("COPY_WORKERS", "8")),
+        )
+
+    def copy_file(self, source_bucket_name, object_name, target_bucket_name):
+        """Server side copy of an object between two buckets, checked against the size of the source"""
         try:
             copy_source = {"Bucket": source_bucket_name, "Key": object_name}
-            self.s3client.copy_object(
-                CopySource=copy_source, Bucket=target_bucket_name, Key=object_name
-            )
+            self.s3client.copy(copy_source, target_bucket_name, object_name, Config=self.get_copy_config())
+
+            source = self.s3client.head_object(Bucket=source_bucket_name, Key=object_name)
+            target = self.s3client.head_object(Bucket=target_bucket_name, Key=object_name)
+            if source["ContentLength"] != target["ContentLength"]:
+                self.logger.error(
+                    f"S3 : copy of {object_name} to bucket {target_bucket_name} has {target['ContentLength']} bytes"
+                    f" instead of {source['ContentLength']}"
+                )
+                return False
+
+            return True
+
+        except Exception as e:
+            self.logger.error(e)
+            return False
+
+    def move_file(self, source_bucket_name, object_name, target_bucket_name):
+        """Move an object between two buckets, the source is only deleted once its copy is checked"""
+        if not self.copy_file(source_bucket_name, object_name, target_bucket_name):
+            return False
+
+        try:
             self.s3client.delete_object(Bucket=source_bucket_name, Key=object_name)
 
             return True
 
         except Exception as e:
             self.logger.error(e)
-            return False
\ No newline at end of file
+            return False
+
+    def delete_files(self, bucket_name, object_names):
+        """Delete objects from a bucket with delete_objects calls of up to 1000 keys, returns the keys not deleted"""
+        object_names = list(object_names)
+        failed = []
+        for i in range(0, len(object_names), self.MAX_DELETE_KEYS):
+            batch = object_names[i:i + self.MAX_DELETE_KEYS]
+            try:
+                self.logger.info(f"S3 : deleting {len(batch)} keys from bucket {bucket_name}")
+                response = self.s3client.delete_objects(
+                    Bucket=bucket_name, Delete={"Objects": [{"Key": object_name} for object_name in batch], "Quiet": True}
+                )
+                for error in response.get("Errors", []):
+                    self.logger.error(f"S3 : deleting key {error.get('Key')} failed: {error.get('Message')}")
+                    failed.append(error.get("Key"))
+
+            except Exception as e:
+                self.logger.error(e)
+                failed.extend(batch)
+        return failed
+
+    def delete_file(self, bucket_name, object_name):
+        """Delete an object from a bucket"""
+        try:
+            self.logger.info(f"S3 : deleting bucket {bucket_name} key {object_name}")
+            self.s3client.delete_object(Bucket=bucket_name, Key=object_name)
+            return True
+
+        except Exception as e:
+            self.logger.error(e)
+            return False
@@ -0,0 +1,86 @@
+import unittest
+from unittest.mock import patch
+
+from .s3_multipart_upload import S3MultipartUpload
+
+PART_SIZE = S3MultipartUpload.MIN_PART_SIZE
+
+
+class StubS3Client:
+    """Records the multipart calls, upload_part fails for the part numbers in failing_parts"""
+
+    def __init__(self, failing_parts=()):
+        self.failing_parts = set(failing_parts)
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+
+    def create_multipart_upload(self, Bucket, Key):
+        return {"UploadId": "upload"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber in self.failing_parts:
+            raise Exception("upload_part failed")
+        self.parts[PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed = MultipartUpload["Parts"]
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+
+class TestS3MultipartUpload(unittest.TestCase):
+    def test_parts_are_cut_at_the_part_size(self):
+        s3client = StubS3Client()
+        upload = S3MultipartUpload(s3client, "bucket", "key", part_size=PART_SIZE, workers=2)
+
+        upload.write(b"a" * (PART_SIZE - 1))
+        self.assertEqual(s3client.parts, {})
+        upload.write(b"b")
+        upload.write(b"c" * 10)
+
+        self.assertTrue(upload.complete())
+        self.assertEqual([len(s3client.parts[1]), len(s3client.parts[2])], [PART_SIZE, 10])
+        self.assertEqual(s3client.completed, [{"PartNumber": 1, "ETag": "etag-1"}, {"PartNumber": 2, "ETag": "etag-2"}])
+        self.assertEqual(upload.bytes_uploaded, PART_SIZE + 10)
+
+    def test_part_size_is_at_least_the_s3_minimum(self):
+        upload = S3MultipartUpload(StubS3Client(), "bucket", "key", part_size=1024)
+
+        self.assertEqual(upload.part_size, S3MultipartUpload.MIN_PART_SIZE)
+
+    @patch("time.sleep")
+    def test_failed_part_aborts_the_upload(self, _):
+        s3client = StubS3Client(failing_parts={1})
+        upload = S3MultipartUpload(s3client, "bucket", "key", part_size=PART_SIZE)
+
+        upload.write(b"a" * (PART_SIZE + 1))
+
+        self.assertFalse(upload.complete())
+        self.assertTrue(s3client.aborted)
+        self.assertIsNone(s3client.completed)
+        self.assertEqual(upload.write(b"more"), 0)
+
+    def test_abort_discards_the_uploaded_parts(self):
+        s3client = StubS3Client()
+        upload = S3MultipartUpload(s3client, "bucket", "key", part_size=PART_SIZE)
+
+        upload.write(b"a" * PART_SIZE)
+        upload.abort()
+
+        self.assertTrue(s3client.aborted)
+        self.assertFalse(upload.complete())
+
+    def test_empty_upload_writes_one_empty_part(self):
+        s3client = StubS3Client()
+        upload = S3MultipartUpload(s3client, "bucket", "key")
+
+        self.assertTrue(upload.complete())
+        self.assertEqual(s3client.parts, {1: b""})
+        self.assertEqual(s3client.completed, [{"PartNumber": 1, "ETag": "etag-1"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
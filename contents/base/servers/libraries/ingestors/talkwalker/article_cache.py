@@ -0,0 +1,133 @@
+import os
+import gzip
+import json
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+class ArticleCache:
+    """Size bounded cache of the news articles extracted by newspaper, keyed by normalized url.
+
+    Articles keep title, authors, text, summary and datetime, the least recently used ones are evicted
+    beyond max_entries. An article is stored under its url and its canonical link, and looked up by its
+    aliases as well (see TalkWalker.get_article_aliases). Urls whose extraction failed are remembered for failure_ttl seconds so dead links
+    are not attempted again. save() and load() persist the cache as a gzip json file between jobs.
+    """
+
+    ARTICLE_FIELDS = ["datetime", "title", "authors", "text", "summary"]
+    # query parameters that do not change the article
+    TRACKING_PARAMETERS = {"fbclid", "gclid", "igshid", "mc_cid", "mc_eid", "ref", "cmpid", "ocid"}
+
+    def __init__(self, max_entries: int = 10000, failure_ttl: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.failure_ttl = failure_ttl
+        self.articles = OrderedDict()
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def normalize_url(cls, url: str) -> str:
+        """Lower cases scheme and host, drops www., the fragment, tracking parameters and trailing slashes"""
+
+        parts = urlsplit(url.strip())
+        host = parts.netloc.lower()
+        if host.startswith("www."):
+            host = host[4:]
+        query = sorted(
+            (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith("utm_") and key.lower() not in cls.TRACKING_PARAMETERS
+        )
+        path = parts.path.rstrip("/") or "/"
+        return urlunsplit((parts.scheme.lower() or "http", host, path, urlencode(query), ""))
+
+    def get(self, url: str):
+        """Returns the cached article fields of url, None when it is not cached"""
+
+        return self.get_any([url])
+
+    def get_any(self, urls: list):
+        """Returns the cached article fields of the first cached url, None when none is cached.
+        The urls are the aliases of one article, they count as one lookup."""
+
+        keys = [self.normalize_url(url) for url in urls]
+        with self.lock:
+            for key in keys:
+                article = self.articles.get(key)
+                if article is not None:
+                    self.articles.move_to_end(key)
+                    self.hits += 1
+                    return dict(article)
+            self.misses += 1
+            return None
+
+    def put(self, url: str, article: dict) -> None:
+        key = self.normalize_url(url)
+        with self.lock:
+            self.articles[key] = {field: article.get(field) for field in self.ARTICLE_FIELDS}
+            self.articles.move_to_end(key)
+            self.failures.pop(key, None)
+            while len(self.articles) > self.max_entries:
+                self.articles.popitem(last=False)
+
+    def is_failing(self, url: str) -> bool:
+        key = self.normalize_url(url)
+        with self.lock:
+            failed_at = self.failures.get(key)
+            if failed_at is None:
+                return False
+            if time.time() - failed_at > self.failure_ttl:
+                del self.failures[key]
+                return False
+            return True
+
+    def put_failure(self, url: str) -> None:
+        key = self.normalize_url(url)
+        with self.lock:
+            self.failures[key] = time.time()
+            if len(self.failures) > self.max_entries:
+                # drop the oldest failures
+                for failed_key, _ in sorted(self.failures.items(), key=lambda failure: failure[1])[:len(self.failures) - self.max_entries]:
+                    del self.failures[failed_key]
+
+    def load(self, path: str) -> bool:
+        if not os.path.isfile(path):
+            return False
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+        now = time.time()
+        with self.lock:
+            for key, article in state.get("articles", []):
+                self.articles[key] = article
+            while len(self.articles) > self.max_entries:
+                self.articles.popitem(last=False)
+            self.failures = {
+                key: failed_at for key, failed_at in state.get("failures", {}).items()
+                if now - failed_at <= self.failure_ttl
+            }
+        return True
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self.lock:
+            state = {"articles": list(self.articles.items()), "failures": dict(self.failures)}
+        temp_path = f"{path}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "articles": len(self.articles),
+                "failures": len(self.failures),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
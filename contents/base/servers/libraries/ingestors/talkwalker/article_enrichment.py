@@ -0,0 +1,102 @@
+import threading
+from collections import deque
+from urllib.parse import urlparse
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from libraries.ingestors.http_sessions import get_shared_session, get_user_agent
+
+
+class ArticleEnricher:
+    """Concurrent news article enrichment stage of the sync TalkWalker engine.
+
+    submit() returns a future completed once data["news_article"] is set (or the failure is logged).
+    Downloads run on a pool of download_workers threads and time out after timeout seconds. At most
+    domain_concurrency downloads per publisher domain are handed to the pool, the others wait in a queue
+    of their domain, so one slow site cannot take every worker.
+    The parse / nlp work runs on a separate pool of parse_workers, through TalkWalker.add_news_article.
+    close() cancels the futures of the articles still waiting for a slot and lets the running ones complete.
+    """
+
+    def __init__(self, talk_walker, download_workers: int = 8, domain_concurrency: int = 2, timeout: int = 20,
+                 parse_workers: int = 2):
+        self.talk_walker = talk_walker
+        self.domain_concurrency = max(1, domain_concurrency)
+        self.timeout = timeout
+
+        self.downloads = ThreadPoolExecutor(max_workers=max(1, download_workers), thread_name_prefix="article_download")
+        self.parses = ThreadPoolExecutor(max_workers=max(1, parse_workers), thread_name_prefix="article_parse")
+
+        # domain -> number of downloads handed to the pool, and the articles waiting for a slot
+        self.active = {}
+        self.waiting = {}
+        self.closed = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_domain(url):
+        return urlparse(url).netloc.lower()
+
+    def submit(self, data, url, source) -> Future:
+        future = Future()
+        article = (data, url, source, future)
+        domain = self.get_domain(url)
+        with self.lock:
+            if self.closed:
+                future.cancel()
+                return future
+            if self.active.get(domain, 0) >= self.domain_concurrency:
+                self.waiting.setdefault(domain, deque()).append(article)
+                return future
+            self.active[domain] = self.active.get(domain, 0) + 1
+            # submitted under the lock, so the pool is not shut down meanwhile
+            self.downloads.submit(self.download, domain, article)
+        return future
+
+    def download(self, domain, article):
+        data, url, source, future = article
+        html = None
+        error = None
+        try:
+            response = get_shared_session().get(
+                url, headers={"User-Agent": get_user_agent().random}, timeout=self.timeout
+            )
+            response.raise_for_status()
+            html = response.text
+        except Exception as e:
+            error = e
+        finally:
+            self.release(domain)
+
+        parse = self.parses.submit(self.talk_walker.add_news_article, data, url, source, html, error)
+        parse.add_done_callback(lambda done: self.complete(future, done))
+
+    def release(self, domain):
+        """Hands the next waiting article of the domain to the pool, or frees the domain slot"""
+
+        with self.lock:
+            waiting = self.waiting.get(domain)
+            if self.closed or not waiting:
+                self.waiting.pop(domain, None)
+                self.active[domain] -= 1
+                if self.active[domain] == 0:
+                    del self.active[domain]
+                return
+            self.downloads.submit(self.download, domain, waiting.popleft())
+
+    @staticmethod
+    def complete(future, parse):
+        error = parse.exception()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            waiting = [article for articles in self.waiting.values() for article in articles]
+            self.waiting.clear()
+        for _, _, _, future in waiting:
+            future.cancel()
+        self.downloads.shutdown(wait=True)
+        self.parses.shutdown(wait=True)
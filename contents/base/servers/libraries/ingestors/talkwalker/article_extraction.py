@@ -0,0 +1,35 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from newspaper import Article
+
+
+def extract_article(url: str, html: str = None) -> dict:
+    """
+    Parses and summarizes the news article at url, downloaded by newspaper when html is None.
+    Returns the extracted fields and the canonical link of the article, it only takes and returns
+    plain values so that it can run in a worker process.
+    """
+    article = Article(
+        url=url,
+        # language=data["lang"],
+    )
+    article.download(input_html=html)
+    article.parse()
+    article.nlp()
+
+    return {
+        "datetime": article.publish_date.isoformat() if article.publish_date is not None else None,
+        "title": article.title,
+        "authors": article.authors,
+        "text": article.text,
+        "summary": article.summary,
+        "url": article.url,
+        "canonical_link": article.canonical_link,
+    }
+
+
+def create_extraction_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool running extract_article out of the GIL of the ingestion threads.
+    Workers are spawned rather than forked, the ingestor process runs logging and network threads."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+from email.utils import parsedate_to_datetime
+
+
+class TokenBucketRateLimiter:
+    """Thread safe token bucket shared by every call made to one API.
+
+    Every request takes one token with acquire(), which blocks until the token is available.
+    The rate adapts at runtime from the response headers passed to update():
+
+        Retry-After            pauses every caller for the given delay and halves the rate
+        X-RateLimit-Remaining  with X-RateLimit-Reset spreads the remaining calls over the reset window
+        X-RateLimit-Limit      the quota of the window, caps the rate at limit / reset when X-RateLimit-Remaining
+                               is not reported (ignored without X-RateLimit-Reset, it is not a rate per second)
+
+    Successful responses without rate limit headers slowly raise the rate back up to max_rate.
+    """
+
+    def __init__(self, rate: float, capacity: float, min_rate: float = 0.1, max_rate: float = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate if max_rate else rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+        self.lock = threading.Lock()
+
+        # wait statistics
+        self.requests = 0
+        self.waited_requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self) -> float:
+        """Blocks until a request may be sent and returns the number of seconds waited"""
+
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self) -> float:
+        """Takes a token without blocking and returns the number of seconds to wait before sending the request"""
+
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # reserve the token now, a negative balance is paid back by the wait below
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate, self.paused_until - now)
+
+            self.requests += 1
+            if wait > 0:
+                self.waited_requests += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def set_rate(self, rate: float) -> None:
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, max(self.min_rate, rate))
+
+    def update(self, status_code: int, headers) -> None:
+        """Adapts the rate from the status code and headers of a response"""
+
+        if headers is None:
+            headers = {}
+
+        retry_after = self.parse_retry_after(headers.get("Retry-After"))
+        remaining = self.parse_number(headers.get("X-RateLimit-Remaining"))
+        reset = self.parse_reset(headers.get("X-RateLimit-Reset"))
+        limit = self.parse_number(headers.get("X-RateLimit-Limit"))
+
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            if status_code == 429 or retry_after is not None:
+                delay = retry_after if retry_after is not None else 1.0 / self.rate
+                self.paused_until = max(self.paused_until, now + delay)
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = min(self.tokens, 0)
+            elif remaining is not None and reset is not None:
+                if remaining <= 0:
+                    self.paused_until = max(self.paused_until, now + reset)
+                else:
+                    self.rate = min(self.max_rate, max(self.min_rate, remaining / max(reset, 1.0)))
+            elif limit is not None and limit > 0 and reset is not None:
+                self.rate = min(self.rate, max(self.min_rate, limit / max(reset, 1.0)))
+            elif status_code < 400:
+                # additive increase back towards the configured rate
+                self.rate = min(self.max_rate, self.rate + 0.1)
+
+    @staticmethod
+    def parse_number(value):
+        try:
+            return float(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def parse_reset(cls, value):
+        """X-RateLimit-Reset is either a delay in seconds or an epoch timestamp"""
+        reset = cls.parse_number(value)
+        if reset is None:
+            return None
+        if reset > 1000000000:
+            reset = reset - time.time()
+        return max(0.0, reset)
+
+    @classmethod
+    def parse_retry_after(cls, value):
+        """Retry-After is either a delay in seconds or an HTTP date"""
+        if value is None:
+            return None
+        delay = cls.parse_number(value)
+        if delay is not None:
+            return max(0.0, delay)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "waited_requests": self.waited_requests,
+                "total_wait_seconds": round(self.total_wait, 3),
+                "max_wait_seconds": round(self.max_wait, 3),
+                "current_rate": round(self.rate, 3),
+            }
+
+
+_talkwalker_rate_limiter = None
+_talkwalker_rate_limiter_lock = threading.Lock()
+
+
+def get_talkwalker_rate_limiter() -> TokenBucketRateLimiter:
+    """Returns the process wide limiter shared by all TalkWalker API calls"""
+
+    global _talkwalker_rate_limiter
+    with _talkwalker_rate_limiter_lock:
+        if _talkwalker_rate_limiter is None:
+            rate = float(os.getenv("TALKWALKER_RATE", "4"))
+            burst = float(os.getenv("TALKWALKER_RATE_BURST", str(rate)))
+            _talkwalker_rate_limiter = TokenBucketRateLimiter(rate=rate, capacity=burst)
+        return _talkwalker_rate_limiter
@@ -0,0 +1,314 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+import aiohttp
+from collections import deque
+from urllib.parse import urlparse
+
+from libraries.logs.cloudlogs import CloudMultiLogMetrics
+from libraries.ingestors.http_sessions import get_user_agent
+from libraries.ingestors.talkwalker.talkwalker_ingestor import TalkWalker, Page, json_loads
+
+
+class AsyncTalkWalker(TalkWalker):
+    """asyncio version of the TalkWalker ingestor.
+
+    Windows, pages and news article downloads run concurrently on one event loop, owned by a background thread.
+    aiohttp limits the open connections per host, and the TalkWalker calls share the token bucket of the sync client.
+    Other coroutines, such as the Twitter hydration of the driver, can be scheduled on the same loop with
+    run_coroutine(), and iter_pages() hands the pages of retrieve_data() over to a synchronous caller.
+    """
+
+    def __init__(self, params: dict, logger: CloudMultiLogMetrics):
+        TalkWalker.__init__(self, params, logger)
+
+        # number of windows fetched at the same time
+        self.window_concurrency = max(1, int(os.getenv("ASYNC_WINDOW_CONCURRENCY", str(max(self.fetch_workers, 8)))))
+        # open connections allowed per host and in total
+        self.host_concurrency = max(1, int(os.getenv("ASYNC_HOST_CONCURRENCY", "8")))
+        self.total_concurrency = max(1, int(os.getenv("ASYNC_TOTAL_CONCURRENCY", "64")))
+
+        self.loop = None
+        self.loop_thread = None
+        self.session = None
+        # downloads in flight per publisher domain
+        self.domain_semaphores = {}
+
+    # event loop management
+
+    def start(self):
+        """Starts the event loop thread and opens the aiohttp session"""
+
+        if self.loop is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name="talkwalker_async", daemon=True)
+        self.loop_thread.start()
+        self.run_coroutine(self.open_session()).result()
+
+    async def open_session(self):
+        connector = aiohttp.TCPConnector(limit=self.total_concurrency, limit_per_host=self.host_concurrency)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+    def run_coroutine(self, coroutine):
+        """Schedules a coroutine on the engine loop and returns its concurrent.futures.Future"""
+
+        if self.loop is None:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def close(self):
+        """Closes the aiohttp session and stops the event loop thread"""
+
+        if self.loop is None:
+            return
+        if self.session is not None:
+            self.run_coroutine(self.session.close()).result()
+            self.session = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        self.loop = None
+        self.loop_thread = None
+        TalkWalker.close(self)
+
+    def iter_pages(self):
+        """Yields the pages of retrieve_data() to the calling thread, keeping a few pages buffered ahead"""
+
+        pages = queue.Queue(maxsize=self.window_concurrency * 2)
+        done = object()
+
+        async def pump():
+            try:
+                async for page in self.retrieve_data():
+                    await asyncio.to_thread(pages.put, page)
+                await asyncio.to_thread(pages.put, done)
+            except Exception as e:
+                await asyncio.to_thread(pages.put, e)
+
+        future = self.run_coroutine(pump())
+        try:
+            while True:
+                page = pages.get()
+                if page is done:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            future.cancel()
+            # unblock a pending put of the cancelled pump
+            while not pages.empty():
+                pages.get_nowait()
+
+    # talkwalker api
+
+    async def download_as_object(self, url, parameters=None):
+        if parameters is None:
+            parameters = self.parameters
+        # aiohttp rejects None values which requests silently drops
+        parameters = {key: value for key, value in parameters.items() if value is not None}
+        headers = {"User-Agent": get_user_agent().random}
+        for i in range(self.max_retries):
+            try:
+                await asyncio.sleep(self.rate_limiter.reserve())
+                async with self.session.get(
+                        url, params=parameters, headers=headers, timeout=aiohttp.ClientTimeout(total=10)
+                ) as response:
+                    self.rate_limiter.update(response.status, response.headers)
+                    response_json = json_loads(await response.read())
+                    response.raise_for_status()
+
+                return {"data": response_json, "pagination": response_json.get("pagination", {})}
+            except asyncio.TimeoutError:
+                self.logger.error(f"Request timed out. Attempt: {i + 1}")
+                self.log_error(f"Request timed out. Attempt: {i + 1}")
+                if (
+                        i < self.max_retries - 1
+                ):  # wait before retrying, but not after the last attempt
+                    await asyncio.sleep(5 * (i + 1))
+                else:
+                    break
+            except Exception as e:
+                self.logger.error(f"{e}")
+                self.log_error(f"{e}")
+
+    def probe_window_total(self, url, window):
+        # adaptive windowing is computed up front on a worker thread with the sync client
+        parameters = self.get_window_parameters(*window)
+        parameters["hpp"] = 0
+        x = TalkWalker.download_as_object(self, url, parameters)
+        if x is None:
+            return None
+        total = x.get("pagination", {}).get("total")
+        return None if total is None else int(total)
+
+    async def add_news_article_async(self, data, url, source):
+        """Downloads the news article html on the event loop, at most ARTICLE_DOMAIN_CONCURRENCY per domain,
+        then parses it on a worker thread"""
+
+        if self.add_cached_news_article(data, url, source):
+            return
+
+        html = None
+        error = None
+        domain = urlparse(url).netloc.lower()
+        if domain not in self.domain_semaphores:
+            self.domain_semaphores[domain] = asyncio.Semaphore(self.article_domain_concurrency)
+        try:
+            async with self.domain_semaphores[domain], self.session.get(
+                    url,
+                    headers={"User-Agent": get_user_agent().random},
+                    timeout=aiohttp.ClientTimeout(total=self.article_timeout),
+            ) as response:
+                response.raise_for_status()
+                html = await response.text(errors="replace")
+        except asyncio.TimeoutError:
+            error = Exception(f"Article download timed out after {self.article_timeout} seconds")
+        except Exception as e:
+            error = e
+
+        await asyncio.to_thread(self.add_news_article, data, url, source, html, error)
+
+    async def search_results(self, url, parameters=None, window=None):
+        """
+        Pages through one time window and yields a Page of formatted items per api page.
+        News articles of a page are downloaded while the next page is fetched.
+        """
+        parameters = dict(self.parameters if parameters is None else parameters)
+        previous = None  # (page, article tasks) waiting for the next page
+
+        while True:
+            x = await self.download_as_object(url, parameters)
+
+            content = None if x is None else x.get("data").get("result_content")
+            if content is None:
+                # the window stays in progress at the offset of the failed request
+                if previous is not None:
+                    yield await self.join_articles_async(*previous)
+                raise Exception(
+                    f"TalkWalker request failed for window {window} at offset {parameters.get('offset', 0)}"
+                )
+
+            data = content.get("data")
+            if data is None:
+                break
+
+            items = []
+            articles = []
+            for item in data:
+                published = self.convert_epoch_to_unix(
+                    item.get("data", {}).get("published", "")
+                )
+                formatted_item = self.format_data_item(item, published, with_news_article=False)
+                items.append(formatted_item)
+
+                if self.get_news_links and self.is_news_item(item):
+                    articles.append(asyncio.ensure_future(self.add_news_article_async(
+                        formatted_item, formatted_item["url"], formatted_item["source"]
+                    )))
+
+            next_offset = self.extract_offset_from_next(
+                x.get("pagination", {}).get("next", "")
+            )
+
+            if previous is not None:
+                yield await self.join_articles_async(*previous)
+            previous = (Page(items, window, next_offset), articles)
+
+            if next_offset is None:
+                break
+
+            parameters["offset"] = next_offset
+
+        if previous is None:
+            # nothing was retrieved, the window is still reported as complete
+            yield Page([], window)
+            return
+        page, articles = previous
+        page.next_offset = None
+        yield await self.join_articles_async(page, articles)
+
+    @staticmethod
+    async def join_articles_async(page, articles):
+        if articles:
+            await asyncio.gather(*articles)
+        return page
+
+    def fetch_window(self, url, window):
+        start, end = window
+        self.logger.info(f"Fetching window - {self.get_window_label(window)}")
+        parameters = self.get_window_parameters(start, end)
+        parameters["offset"] = self.resume_offsets.get(window, 0)
+        return self.search_results(url, parameters, window)
+
+    async def stream_window(self, url, window, pages):
+        """Puts the pages of the window on its bounded queue, ending with None"""
+
+        try:
+            async for page in self.fetch_window(url, window):
+                await pages.put(page)
+        except Exception as e:
+            await pages.put(e)
+            return
+        await pages.put(None)
+
+    async def fetch_windows(self, url, windows):
+        """
+        Yields the pages of the windows in window order. At most two windows per concurrency slot are in flight,
+        each one buffering at most WINDOW_QUEUE_PAGES pages ahead of the consumer.
+        """
+
+        windows = iter(windows)
+        pending = deque()
+
+        def submit(window):
+            pages = asyncio.Queue(maxsize=self.window_queue_pages)
+            pending.append((pages, asyncio.ensure_future(self.stream_window(url, window, pages))))
+
+        try:
+            for window in windows:
+                submit(window)
+                if len(pending) >= self.window_concurrency * 2:
+                    break
+
+            while pending:
+                pages, _ = pending[0]
+                while True:
+                    page = await pages.get()
+                    if page is None:
+                        break
+                    if isinstance(page, Exception):
+                        raise page
+                    yield page
+                pending.popleft()
+                next_window = next(windows, None)
+                if next_window is not None:
+                    submit(next_window)
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def retrieve_data(self):
+        """Async generator of the formatted pages of every window, in window order"""
+
+        start_time = time.time()  # Record the start time
+        url = self.get_results_url()
+
+        windows = await asyncio.to_thread(self.get_windows_to_fetch, url)
+        self.logger.info(f"fetching {len(windows)} windows with {self.window_concurrency} concurrent window(s)")
+
+        window_total = 0
+        async for page in self.fetch_windows(url, windows):
+            yield page
+
+            self.total_item_count += len(page)
+            window_total += len(page)
+            if page.next_offset is None:
+                self.total = window_total
+                window_total = 0
+                self.log_window_retrieved(page.window)
+
+        self.log_execution_summary(start_time)
@@ -1,19 +1,31 @@
 import os, json, random, time
+import queue
+import threading
 import boto3
 import logging
 import requests
 import nltk
 from pprint import pprint
-from fake_useragent import UserAgent
 from datetime import date, timedelta
 from datetime import datetime
-from types import SimpleNamespace
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
-from newspaper import Article
 from libraries.logs.cloudlogs import CloudMultiLogMetrics
 
 from libraries.ingestors.ingestor import Ingestor
 
+try:
+    # faster json decoder when it is installed
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+from libraries.ingestors.http_sessions import get_session, get_user_agent, close_sessions
+from libraries.ingestors.talkwalker.rate_limiter import get_talkwalker_rate_limiter
+from libraries.ingestors.talkwalker.article_enrichment import ArticleEnricher
+from libraries.ingestors.talkwalker.article_cache import ArticleCache
+from libraries.ingestors.talkwalker.article_extraction import extract_article, create_extraction_pool
+
 
 # from config import Config
 
@@ -22,6 +34,16 @@ from libraries.ingestors.ingestor import Ingestor
 # MAX_RETRIES = 5
 
 
+class Page(list):
+    """Formatted items of a window page, with the window they belong to and the offset of the next page.
+    next_offset is None only on the last page, once the api returned no next page for the window."""
+
+    def __init__(self, items, window, next_offset=None):
+        list.__init__(self, items)
+        self.window = window
+        self.next_offset = next_offset
+
+
 class TalkWalker(Ingestor):
     def __init__(self, params: dict, logger: CloudMultiLogMetrics):
         Ingestor.__init__(self)
@@ -46,34 +68,112 @@ class TalkWalker(Ingestor):
         self.page_size = os.getenv("PAGE_SIZE")
         self.parameters = {}
 
+        # number of hour windows fetched concurrently, 1 keeps the serial behaviour
+        self.fetch_workers = max(1, int(os.getenv("FETCH_WORKERS", "1")))
+        # probe pagination totals to merge sparse windows and bisect dense ones
+        self.adaptive_windows = os.getenv("ADAPTIVE_WINDOWS", "false").casefold() == "true"
+        # number of pages a single window should need at most in adaptive mode
+        self.window_page_budget = max(1, int(os.getenv("WINDOW_PAGE_BUDGET", "10")))
+        self.min_window_seconds = max(1, int(os.getenv("MIN_WINDOW_SECONDS", "60")))
+        # pages buffered per window in flight when windows are fetched concurrently
+        self.window_queue_pages = max(1, int(os.getenv("WINDOW_QUEUE_PAGES", "4")))
+        # guards the shared counters and latest errors updated by the fetch workers
+        self.lock = threading.Lock()
+        # token bucket shared with the credits api calls
+        self.rate_limiter = get_talkwalker_rate_limiter()
+
+        # news articles are enriched concurrently, ARTICLE_WORKERS=0 keeps them inline
+        self.article_workers = max(0, int(os.getenv("ARTICLE_WORKERS", "8")))
+        self.article_domain_concurrency = max(1, int(os.getenv("ARTICLE_DOMAIN_CONCURRENCY", "2")))
+        self.article_parse_workers = max(1, int(os.getenv("ARTICLE_PARSE_WORKERS", "2")))
+        self.article_timeout = int(os.getenv("ARTICLE_TIMEOUT", "20"))
+        self.article_enricher = None
+        # parse / nlp run in ARTICLE_PROCESS_WORKERS processes when set, on the calling thread otherwise
+        self.article_process_workers = max(0, int(os.getenv("ARTICLE_PROCESS_WORKERS", "0")))
+        if self.article_process_workers > 0:
+            # enough parse threads to keep every process busy
+            self.article_parse_workers = max(self.article_parse_workers, self.article_process_workers)
+        self.article_extraction_pool = None
+        # extracted articles and failing urls by normalized url, ARTICLE_CACHE_SIZE=0 disables the cache
+        article_cache_size = int(os.getenv("ARTICLE_CACHE_SIZE", "10000"))
+        self.article_cache = ArticleCache(
+            max_entries=article_cache_size,
+            failure_ttl=float(os.getenv("ARTICLE_FAILURE_TTL", str(24 * 3600))),
+        ) if article_cache_size > 0 else None
+
+        # windows of the run, and the progress of a resumed run
+        self.windows = None
+        self.completed_windows = set()
+        self.resume_offsets = {}
+
         timestamp = int(time.time())  # Generate a unique timestamp
         log_filename = f"talkwalker_{self.topic_id}_attribution_logs_{timestamp}.jsonl"  # Include timestamp in the filename
         self.logger = logger
         nltk.download("punkt")
 
+    def set_resume_state(self, windows, completed_windows, resume_offsets):
+        """Resumes a previous run: its windows are reused, completed ones are skipped
+        and the window in progress restarts from its recorded offset"""
+        self.windows = windows
+        self.resume_offsets = dict(resume_offsets)
+        # a window with a resume offset did not reach its end
+        self.completed_windows = set(completed_windows) - set(self.resume_offsets)
+
+    def get_article_enricher(self):
+        with self.lock:
+            if self.article_enricher is None:
+                self.article_enricher = ArticleEnricher(
+                    self,
+                    download_workers=self.article_workers,
+                    domain_concurrency=self.article_domain_concurrency,
+                    timeout=self.article_timeout,
+                    parse_workers=self.article_parse_workers,
+                )
+            return self.article_enricher
+
+    def get_article_extraction_pool(self):
+        if self.article_process_workers == 0:
+            return None
+        with self.lock:
+            if self.article_extraction_pool is None:
+                self.article_extraction_pool = create_extraction_pool(self.article_process_workers)
+            return self.article_extraction_pool
+
+    def close(self):
+        if self.article_enricher is not None:
+            self.article_enricher.close()
+            self.article_enricher = None
+        if self.article_extraction_pool is not None:
+            self.article_extraction_pool.shutdown(wait=True)
+            self.article_extraction_pool = None
+        close_sessions()
+
     def log_error(self, error_message):
-        self.latest_errors.append(error_message)
-        if len(self.latest_errors) > 10:
-            self.latest_errors.pop(0)
+        with self.lock:
+            self.latest_errors.append(error_message)
+            if len(self.latest_errors) > 10:
+                self.latest_errors.pop(0)
 
     def get_latest_errors(self):
-        return self.latest_errors
-
-    def download_as_object(self, url):
-        ua = UserAgent()
-        headers = {"User-Agent": ua.random}
+        with self.lock:
+            return list(self.latest_errors)
+
+    def download_as_object(self, url, parameters=None):
+        if parameters is None:
+            parameters = self.parameters
+        headers = {"User-Agent": get_user_agent().random}
+        session = get_session(url)
         for i in range(self.max_retries):
             try:
-                response = requests.get(
-                    url, params=self.parameters, headers=headers, timeout=10
+                self.rate_limiter.acquire()
+                response = session.get(
+                    url, params=parameters, headers=headers, timeout=10
                 )
-                response_json = response.json()
+                self.rate_limiter.update(response.status_code, response.headers)
+                response_json = json_loads(response.content)
                 response.raise_for_status()
 
-                x = json.loads(
-                    response.content, object_hook=lambda d: SimpleNamespace(**d)
-                )
-                return {"data": x, "pagination": response_json.get("pagination", {})}
+                return {"data": response_json, "pagination": response_json.get("pagination", {})}
             except requests.exceptions.Timeout:
                 self.logger.error(f"Request timed out. Attempt: {i + 1}")
                 self.log_error(f"Request timed out. Attempt: {i + 1}")
@@ -100,53 +200,61 @@ class TalkWalker(Ingestor):
         with open(self.log_file_path, "a") as f:
             f.write(json.dumps(data) + "\n")
 
-    def format_data_item(self, item, published):
-        if getattr(item.data, "external_provider", "") == "twitter":
+    # output field and talkwalker field of every copied attribute, around the computed published and source fields
+    ITEM_FIELDS_BEFORE_PUBLISHED = (
+        ("title", "title"),
+        ("body", "content"),
+        ("external_id", "external_id"),
+        ("external_provider", "external_provider"),
+        ("url", "url"),
+        ("lang", "lang"),
+        ("post_type", "post_type"),
+        ("sentiment", "sentiment"),
+        ("word_count", "word_count"),
+        ("engagement", "engagement"),
+        ("reach", "reach"),
+    )
+    ITEM_FIELDS_AFTER_SOURCE = (
+        ("source_type", "source_type"),
+        ("extra_author_attributes", "extra_author_attributes"),
+        ("extra_source_attributes", "extra_source_attributes"),
+        ("tokens_hashtag", "tokens_hashtag"),
+        ("article_extended_attributes", "article_extended_attributes"),
+        ("source_extended_attributes", "source_extended_attributes"),
+        ("tags_internal", "tags_internal"),
+        ("porn_level", "porn_level"),
+        ("fluency_level", "fluency_level"),
+        ("images", "images"),
+        ("videos", "videos"),
+        ("root_url", "root_url"),
+        ("parent_url", "parent_url"),
+    )
+
+    def format_data_item(self, item, published, with_news_article=True):
+        item_data = item.get("data", {})
+        if item_data.get("external_provider", "") == "twitter":
             source = "twitter"
-            self.total_twitter_count += 1
+            with self.lock:
+                self.total_twitter_count += 1
         else:
-            source = self.get_domain_name(getattr(item.data, "url", ""))
-
-        data = {
-            "title": getattr(item.data, "title", ""),
-            "body": getattr(item.data, "content", ""),
-            "external_id": getattr(item.data, "external_id", ""),
-            "external_provider": getattr(item.data, "external_provider", ""),
-            "url": getattr(item.data, "url", ""),
-            "lang": getattr(item.data, "lang", ""),
-            "post_type": getattr(item.data, "post_type", ""),
-            "sentiment": getattr(item.data, "sentiment", ""),
-            "word_count": getattr(item.data, "word_count", ""),
-            "engagement": getattr(item.data, "engagement", ""),
-            "reach": getattr(item.data, "reach", ""),
-            "published": published,
-            "source": source,
-            "source_type": getattr(item.data, "source_type", ""),
-            "extra_author_attributes": self.nested_namespace_to_dict(
-                getattr(item.data, "extra_author_attributes", "")
-            ),
-            "extra_source_attributes": self.nested_namespace_to_dict(
-                getattr(item.data, "extra_source_attributes", "")
-            ),
-            "tokens_hashtag": getattr(item.data, "tokens_hashtag", ""),
-            "article_extended_attributes": self.nested_namespace_to_dict(
-                getattr(item.data, "article_extended_attributes", "")
-            ),
-            "source_extended_attributes": self.nested_namespace_to_dict(
-                getattr(item.data, "source_extended_attributes", "")
-            ),
-            "tags_internal": getattr(item.data, "tags_internal", ""),
-            "porn_level": getattr(item.data, "porn_level", ""),
-            "fluency_level": getattr(item.data, "fluency_level", ""),
-            "images": self.nested_namespace_to_dict(getattr(item.data, "images", "")),
-            "videos": self.nested_namespace_to_dict(getattr(item.data, "videos", "")),
-            "root_url": getattr(item.data, "root_url", ""),
-            "parent_url": getattr(item.data, "parent_url", ""),
-        }
+            source = self.get_domain_name(item_data.get("url", ""))
+
+        data = {key: item_data.get(field, "") for key, field in self.ITEM_FIELDS_BEFORE_PUBLISHED}
+        data["published"] = published
+        data["source"] = source
+        for key, field in self.ITEM_FIELDS_AFTER_SOURCE:
+            data[key] = item_data.get(field, "")
 
         if published != 0 or published != -1:
             data["x-p6m-publish-source"] = "talkwalker"
 
+        if with_news_article and self.get_news_links and self.is_news_item(item):
+            if not self.add_cached_news_article(data, data["url"], source):
+                self.add_news_article(data, data["url"], source)
+        return data
+
+    @staticmethod
+    def is_news_item(item):
         sources_to_check = [
             "BLOG_OTHER",
             "ONLINENEWS",
@@ -158,130 +266,198 @@ class TalkWalker(Ingestor):
             "ONLINENEWS_TVRADIO",
             "PODCAST_OTHER",
         ]
-        is_news = any(
-            element in getattr(item.data, "source_type", "")
+        source_type = item.get("data", {}).get("source_type", "") or ""
+        return any(
+            element in source_type
             for element in sources_to_check
         )
-        if is_news and self.get_news_links:
-
-            article_dict = {}
-            attributions = {}
-            attributions["url"] = getattr(item.data, "url", "")
-            attributions["source"] = (source,)
-            attributions["snippet"] = True
-            try:
-                url = getattr(item.data, "url", "")
-                article = Article(
-                    url=url,
-                    # language=getattr(item.data, "lang", ""),
-                )
-                self.logger.info(f"Fetching Article {url}")
-                article.download()
-                article.parse()
-                article.nlp()
-                # print(article)
-
-                if article.publish_date is not None:
-                    article_dict["datetime"] = article.publish_date.isoformat()
-                else:
-                    article_dict[
-                        "datetime"
-                    ] = None  # Or any other default value you prefer
-                article_dict["media"] = source
-                article_dict["title"] = article.title
-                article_dict["authors"] = article.authors
-                article_dict["text"] = article.text
-                article_dict["summary"] = article.summary
-                article_dict["url"] = article.url
-
-                # print("dict#: ", dict)
-                data["news_article"] = article_dict
-                attributions["successful_traversal"] = True
 
-            except Exception as e:
-                attributions["successful_traversal"] = f"{e}"
-                self.logger.info(e)
-                self.logger.info("Ignoring this article")
-                article_url = attributions["url"]
-                self.log_error(f"error: {e} article: {article_url}")
+    @staticmethod
+    def get_article_aliases(data, url):
+        """
+        Returns the parent_url and root_url of an item that can hold the same article, e.g. the article of a
+        comment or of a syndicated copy. Urls of a site root are left out, they never hold the article.
+        """
+        aliases = []
+        for field in ["parent_url", "root_url"]:
+            alias = data.get(field)
+            if alias and alias != url and alias not in aliases and urlparse(alias).path.strip("/"):
+                aliases.append(alias)
+        return aliases
+
+    def add_cached_news_article(self, data, url, source):
+        """
+        Sets data["news_article"] from the article cache, returns False when the url still has to be downloaded.
+        Urls that recently failed are skipped without a new attempt.
+        """
+        if self.article_cache is None:
+            return False
+
+        attributions = {"url": url, "source": (source,), "snippet": True, "cached": True}
+        article_dict = self.article_cache.get_any([url] + self.get_article_aliases(data, url))
+        if article_dict is not None:
+            article_dict["media"] = source
+            article_dict["url"] = url
+            data["news_article"] = article_dict
+            attributions["successful_traversal"] = True
+        elif self.article_cache.is_failing(url):
+            attributions["successful_traversal"] = "skipped known failing url"
+            self.logger.info(f"Skipping known failing article {url}")
+        else:
+            return False
 
-            try:
-                self.save_attribution_logs_to_file(attributions)
-            except Exception as e:
-                self.logger.info(e)
-                self.log_error(f"error in article: {e}")
-        return data
+        try:
+            self.save_attribution_logs_to_file(attributions)
+        except Exception as e:
+            self.logger.info(e)
+            self.log_error(f"error in article: {e}")
+        return True
 
-    def nested_namespace_to_dict(self, obj):
-        if isinstance(obj, SimpleNamespace):
-            return {
-                key: self.nested_namespace_to_dict(value)
-                for key, value in obj.__dict__.items()
-            }
-        elif isinstance(obj, list):
-            return [self.nested_namespace_to_dict(item) for item in obj]
-        else:
-            return obj
+    def add_news_article(self, data, url, source, html=None, error=None):
+        """
+        Downloads, parses and summarizes the news article at url into data["news_article"].
+        The download is skipped when the html was already fetched, and error reports a failed download.
+        """
+        article_dict = {}
+        attributions = {}
+        attributions["url"] = url
+        attributions["source"] = (source,)
+        attributions["snippet"] = True
+        try:
+            if error is not None:
+                raise error
+            self.logger.info(f"Fetching Article {url}")
+            extraction_pool = self.get_article_extraction_pool()
+            if extraction_pool is not None:
+                extracted = extraction_pool.submit(extract_article, url, html).result()
+            else:
+                extracted = extract_article(url, html)
+            canonical_link = extracted.pop("canonical_link")
+
+            article_dict["datetime"] = extracted.pop("datetime")
+            article_dict["media"] = source
+            article_dict.update(extracted)
+
+            # print("dict#: ", dict)
+            data["news_article"] = article_dict
+            attributions["successful_traversal"] = True
+
+            if self.article_cache is not None:
+                self.article_cache.put(url, article_dict)
+                # syndicated copies often point to the canonical article
+                if canonical_link and canonical_link != url:
+                    self.article_cache.put(canonical_link, article_dict)
+
+        except Exception as e:
+            attributions["successful_traversal"] = f"{e}"
+            if self.article_cache is not None:
+                self.article_cache.put_failure(url)
+            self.logger.info(e)
+            self.logger.info("Ignoring this article")
+            article_url = attributions["url"]
+            self.log_error(f"error: {e} article: {article_url}")
+
+        try:
+            self.save_attribution_logs_to_file(attributions)
+        except Exception as e:
+            self.logger.info(e)
+            self.log_error(f"error in article: {e}")
 
     def extract_offset_from_next(self, next_url):
         """
-        Method to extract the next offset number from the next url params
+        Method to extract the next offset number from the next url params.
+        Returns None when there is no next url, the window is then complete. A next url without
+        an offset raises rather than ending the window early.
         """
+        if not next_url:
+            return None
         offset_key = "offset="
         offset_start_index = next_url.find(offset_key)
         if offset_start_index != -1:
             offset_start_index += len(offset_key)
             offset_end_index = next_url.find("&", offset_start_index)
-            if offset_end_index != -1:
-                return int(next_url[offset_start_index:offset_end_index])
-        return None
+            if offset_end_index == -1:
+                offset_end_index = len(next_url)
+            return int(next_url[offset_start_index:offset_end_index])
+        raise Exception(f"TalkWalker next page url has no offset: {next_url}")
 
-    def search_results(self, url):
-        scrape_start_time = time.time()  # Record the start time of the scrape function
-        items = []  # list to hold tweet items for batching
+    def search_results(self, url, parameters=None, window=None):
+        """
+        Pages through one time window and yields a Page of formatted items per api page.
+        The window parameters are copied so that concurrent windows never share the offset.
+        The last page of the window has no next_offset. A request still failing after its retries raises
+        once the pages before it are yielded, so the window is never recorded as complete.
+        """
+        parameters = dict(self.parameters if parameters is None else parameters)
+        # news articles of a page are enriched while the next page is fetched, and joined before the page is yielded
+        enrich_articles = self.get_news_links and self.article_workers > 0
+        previous = None  # (page, article futures) waiting for the next page
 
         while True:
-            time.sleep(0.1)  # we are still getting rate limit 429s
-            x = self.download_as_object(url)
+            # pacing is done by the shared rate limiter in download_as_object
+            x = self.download_as_object(url, parameters)
 
             # print("==object downloaded==")
             # pprint(x)
-            self.total = 0
-
-            if x is None:
-                # print("==skipping as x is None==")
-                break
 
-            content = x.get("data").result_content
+            content = None if x is None else x.get("data").get("result_content")
             if content is None:
-                # print("==skipping as content is None==")
-                break
+                if previous is not None:
+                    yield self.join_articles(*previous)
+                raise Exception(
+                    f"TalkWalker request failed for window {window} at offset {parameters.get('offset', 0)}"
+                )
 
-            data = getattr(content, "data", None)
+            data = content.get("data")
             if data is None:
                 # print("==skipping as data is None==")
                 break
 
+            items = []
+            articles = []
             for item in data:
-                self.total += 1
-
                 published = self.convert_epoch_to_unix(
-                    getattr(item.data, "published", "")
+                    item.get("data", {}).get("published", "")
                 )
-                items.append(self.format_data_item(item, published))
+                formatted_item = self.format_data_item(item, published, with_news_article=not enrich_articles)
+                items.append(formatted_item)
+
+                if (
+                        enrich_articles
+                        and self.is_news_item(item)
+                        and not self.add_cached_news_article(formatted_item, formatted_item["url"], formatted_item["source"])
+                ):
+                    articles.append(self.get_article_enricher().submit(
+                        formatted_item, formatted_item["url"], formatted_item["source"]
+                    ))
 
             next_offset = self.extract_offset_from_next(
                 x.get("pagination", {}).get("next", "")
             )
+
+            if previous is not None:
+                yield self.join_articles(*previous)
+            previous = (Page(items, window, next_offset), articles)
+
             if next_offset is None:
                 break
 
-            self.parameters["offset"] = next_offset
+            parameters["offset"] = next_offset
+
+        if previous is None:
+            # nothing was retrieved, the window is still reported as complete
+            yield Page([], window)
+            return
+        page, articles = previous
+        page.next_offset = None
+        yield self.join_articles(page, articles)
 
-            # Check if the scrape function has run for more than 1 second
-            if time.time() - scrape_start_time < 1:
-                time.sleep(1)
-        return items
+    @staticmethod
+    def join_articles(page, articles):
+        """Returns the page once its news articles are enriched"""
+        for article in articles:
+            article.result()
+        return page
 
     @staticmethod
     def get_epoch_time(day, month, year):
@@ -289,11 +465,193 @@ class TalkWalker(Ingestor):
         epoch_time = int(time.mktime(date.timetuple()))
         return epoch_time
 
-    def retrieve_data(self):
-        start_time = time.time()  # Record the start time
-        url = f"https://api.talkwalker.com/api/v1/search/p/{self.project_id}/results"
+    def get_window_parameters(self, start, end):
+        """Returns the search parameters of the [start, end) window"""
+        return {
+            "access_token": self.access_token,
+            "topic": self.topic_id,
+            "hpp": self.page_size,
+            "offset": 0,
+            "project_id": self.project_id,
+            "q": f"(published:>={start} AND published:<{end})",
+        }
+
+    def get_time_windows(self, start_date, end_date):
+        """Returns the (start, end) epoch hour windows of every day from start_date to end_date"""
+        windows = []
+        for n in range(int((end_date - start_date).days) + 1):
+            current_day = start_date + timedelta(n)
+            start = self.get_epoch_time(current_day.day, current_day.month, current_day.year)
+            # Loop through 24 hours with 1-hour intervals
+            for i in range(24):
+                end = start + 3600  # 3600 seconds = 1 hour
+                windows.append((start, end))
+                start = end
+        return windows
+
+    def probe_window_total(self, url, window):
+        """
+        Returns the number of items published in the window without retrieving them (hpp=0),
+        or None when the probe failed.
+        """
+        parameters = self.get_window_parameters(*window)
+        parameters["hpp"] = 0
+        x = self.download_as_object(url, parameters)
+        if x is None:
+            return None
+        total = x.get("pagination", {}).get("total")
+        return None if total is None else int(total)
+
+    def split_window(self, url, window, total, budget):
+        """Recursively bisects a window until each part holds at most budget items"""
+        start, end = window
+        if total <= budget or end - start <= self.min_window_seconds:
+            return [(window, total)]
+
+        middle = start + (end - start) // 2
+        parts = []
+        for part in ((start, middle), (middle, end)):
+            part_total = self.probe_window_total(url, part)
+            if part_total is None:
+                # unknown volume, fall back to fixed hour windows for this part
+                parts.extend((hour, None) for hour in self.split_into_hours(part))
+            elif part_total > 0:
+                parts.extend(self.split_window(url, part, part_total, budget))
+        return parts
+
+    @staticmethod
+    def split_into_hours(window):
+        start, end = window
+        return [(hour, min(hour + 3600, end)) for hour in range(start, end, 3600)]
+
+    def get_adaptive_windows(self, url, start_date, end_date):
+        """
+        Returns the windows to fetch between start_date and end_date, sized from the pagination totals:
+        every day is probed with hpp=0, empty days are dropped, dense days are bisected
+        and adjacent sparse windows are merged while they fit in WINDOW_PAGE_BUDGET pages.
+        """
+        page_size = int(self.page_size) if self.page_size else 10
+        budget = self.window_page_budget * page_size
+
+        probed = []
+        for n in range(int((end_date - start_date).days) + 1):
+            current_day = start_date + timedelta(n)
+            start = self.get_epoch_time(current_day.day, current_day.month, current_day.year)
+            day = (start, start + 24 * 3600)
+            total = self.probe_window_total(url, day)
+            if total is None:
+                probed.extend((hour, None) for hour in self.split_into_hours(day))
+            elif total > 0:
+                probed.extend(self.split_window(url, day, total, budget))
+
+        windows = []
+        merged_total = None
+        for window, total in probed:
+            if (
+                    windows
+                    and total is not None
+                    and merged_total is not None
+                    and windows[-1][1] == window[0]
+                    and merged_total + total <= budget
+            ):
+                windows[-1] = (windows[-1][0], window[1])
+                merged_total += total
+            else:
+                windows.append(window)
+                merged_total = total
+
+        self.logger.info(
+            f"adaptive windowing: {len(windows)} window(s) with a budget of {budget} items per window"
+        )
+        return windows
+
+    @staticmethod
+    def get_window_label(window):
+        start = datetime.fromtimestamp(window[0])
+        end = datetime.fromtimestamp(window[1])
+        if window[1] - window[0] == 3600:
+            return f"{start.month}/{start.day}/{start.year} hour {start.hour}"
+        return f"{start:%m/%d/%Y %H:%M} - {end:%m/%d/%Y %H:%M}"
+
+    def fetch_window(self, url, window):
+        start, end = window
+        self.logger.info(f"Fetching window - {self.get_window_label(window)}")
+        parameters = self.get_window_parameters(start, end)
+        parameters["offset"] = self.resume_offsets.get(window, 0)
+        return self.search_results(url, parameters, window)
+
+    def stream_window(self, url, window, pages, closed):
+        """Puts the pages of the window on its bounded queue, ending with None, until the consumer is closed"""
+        def put(page):
+            while not closed.is_set():
+                try:
+                    pages.put(page, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for page in self.fetch_window(url, window):
+                if not put(page):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    def fetch_windows(self, url, windows):
+        """
+        Yields the pages of the windows in window order.
+        With FETCH_WORKERS > 1 a pool of workers streams the windows through queues of at most
+        WINDOW_QUEUE_PAGES pages, and at most two windows per worker are in flight,
+        so the memory held by results does not depend on the volume of a window.
+        """
+        if self.fetch_workers == 1:
+            for window in windows:
+                yield from self.fetch_window(url, window)
+            return
+
+        windows = iter(windows)
+        pending = deque()
+        closed = threading.Event()
+        executor = ThreadPoolExecutor(
+            max_workers=self.fetch_workers, thread_name_prefix="talkwalker_fetch"
+        )
+
+        def submit(window):
+            pages = queue.Queue(maxsize=self.window_queue_pages)
+            executor.submit(self.stream_window, url, window, pages, closed)
+            pending.append(pages)
+
+        try:
+            for window in windows:
+                submit(window)
+                if len(pending) >= self.fetch_workers * 2:
+                    break
+
+            while pending:
+                pages = pending.popleft()
+                while True:
+                    page = pages.get()
+                    if page is None:
+                        break
+                    if isinstance(page, Exception):
+                        raise page
+                    yield page
+                next_window = next(windows, None)
+                if next_window is not None:
+                    submit(next_window)
+        finally:
+            closed.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_results_url(self):
+        return f"https://api.talkwalker.com/api/v1/search/p/{self.project_id}/results"
+
+    def get_windows(self, url):
+        """Returns the time windows to fetch for the requested date range"""
 
-        total_twitter_error_count = 0
         # Calculate the start and end dates
 
         start_date = (
@@ -314,46 +672,20 @@ class TalkWalker(Ingestor):
 
         self.logger.info(f"starting search from {start_date} till {end_date}")
 
-        # Loop through each day from the start_date to the end_date
-        for n in range(int((end_date - start_date).days) + 1):
-            current_day = start_date + timedelta(n)
-            year = current_day.year
-            month = current_day.month
-            day = current_day.day
+        if self.adaptive_windows:
+            return self.get_adaptive_windows(url, start_date, end_date)
+        return self.get_time_windows(start_date, end_date)
 
-            start = self.get_epoch_time(day, month, year)
-            self.logger.info(f"Fetching Day - {month}/{day}/{year}")
-            # Loop through 24 hours with 1-hour intervals
-            for i in range(24):
-                # Calculate the end time, which is 1 hour apart from the start time
-                end = start + 3600  # 3600 seconds = 1 hour
-
-                self.parameters = {
-                    "access_token": self.access_token,
-                    "topic": self.topic_id,
-                    "hpp": self.page_size,
-                    "offset": 0,
-                    "project_id": self.project_id,
-                    "q": f"(published:>={start} AND published:<{end})",
-                }
-                self.logger.info(f"Fetching Hour - {month}/{day}/{year} - {i}")
-                # yield self.search_results(url)
-                yield self.search_results(url)
-
-                # break
-                self.total_item_count += self.total
-
-                # Update the start time for the next interval
-                start = end
-                # self.logger.info(f"Fetching  {month}/{day}/{year} Hour = {i}")
-                self.logger.info(
-                    f"Item retrieved for {month}/{day}/{year} hour {i}: {self.total}"
-                )
-                self.logger.info(
-                    f"\r### Total: {self.required_credits}, Remaining: {self.required_credits - self.total_item_count}  Retrieved: {self.total_item_count}, Saved: {self.total_saved}, Twitter: {self.total_twitter_count}, Twitter errors: {self.twitter_errors} ###"
-                )
+    def log_window_retrieved(self, window):
+        self.logger.info(
+            f"Item retrieved for {self.get_window_label(window)}: {self.total}"
+        )
+        self.logger.info(
+            f"\r### Total: {self.required_credits}, Remaining: {self.required_credits - self.total_item_count}  Retrieved: {self.total_item_count}, Saved: {self.total_saved}, Twitter: {self.total_twitter_count}, Twitter errors: {self.twitter_errors} ###"
+        )
 
-            # break
+    def log_execution_summary(self, start_time):
+        total_twitter_error_count = 0
 
         end_time = time.time()  # Record the end time
         execution_time = str(timedelta(seconds=int(end_time - start_time)))
@@ -365,4 +697,33 @@ class TalkWalker(Ingestor):
         self.logger.info(
             f"Number of Twitter Errors Encountered: {total_twitter_error_count}"
         )
-        # self.logger.info(f"Total Items Collected: {total_item_count}")
\ No newline at end of file
+        self.logger.info(f"TalkWalker rate limiter: {self.rate_limiter.get_stats()}")
+        # self.logger.info(f"Total Items Collected: {total_item_count}")
+
+    def get_windows_to_fetch(self, url):
+        if self.windows is None:
+            self.windows = self.get_windows(url)
+        windows = [window for window in self.windows if window not in self.completed_windows]
+        if len(windows) < len(self.windows):
+            self.logger.info(f"resuming: {len(self.windows) - len(windows)} windows were already completed")
+        return windows
+
+    def retrieve_data(self):
+        start_time = time.time()  # Record the start time
+        url = self.get_results_url()
+
+        windows = self.get_windows_to_fetch(url)
+        self.logger.info(f"fetching {len(windows)} windows with {self.fetch_workers} worker(s)")
+
+        window_total = 0
+        for page in self.fetch_windows(url, windows):
+            yield page
+
+            self.total_item_count += len(page)
+            window_total += len(page)
+            if page.next_offset is None:
+                self.total = window_total
+                window_total = 0
+                self.log_window_retrieved(page.window)
+
+        self.log_execution_summary(start_time)
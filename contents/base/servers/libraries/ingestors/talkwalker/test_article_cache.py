@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from .article_cache import ArticleCache
+
+ARTICLE = {"datetime": None, "title": "title", "authors": ["author"], "text": "text", "summary": "summary"}
+
+
+class TestArticleCache(unittest.TestCase):
+    def test_normalize_url(self):
+        self.assertEqual(
+            ArticleCache.normalize_url("HTTPS://www.Example.com/news/story/?utm_source=x&b=2&a=1&fbclid=y#comments"),
+            "https://example.com/news/story?a=1&b=2",
+        )
+        self.assertEqual(ArticleCache.normalize_url("http://example.com"), ArticleCache.normalize_url("http://example.com/"))
+
+    def test_urls_of_the_same_article_share_the_entry(self):
+        cache = ArticleCache()
+        cache.put("https://www.example.com/story/?utm_medium=feed", dict(ARTICLE, media="dropped"))
+
+        self.assertEqual(cache.get("https://example.com/story"), ARTICLE)
+        self.assertIsNone(cache.get("https://example.com/other"))
+        self.assertEqual(cache.get_stats()["hits"], 1)
+        self.assertEqual(cache.get_stats()["misses"], 1)
+
+    def test_aliases_count_as_one_lookup(self):
+        cache = ArticleCache()
+        cache.put("https://example.com/story", ARTICLE)
+
+        self.assertEqual(cache.get_any(["https://example.com/story#comment-1", "https://example.com/story"]), ARTICLE)
+        self.assertIsNone(cache.get_any(["https://example.com/a", "https://example.com/b"]))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_failures_expire_after_the_ttl(self):
+        cache = ArticleCache(failure_ttl=60)
+        with patch("time.time", return_value=1000):
+            cache.put_failure("https://example.com/dead")
+        with patch("time.time", return_value=1059):
+            self.assertTrue(cache.is_failing("https://www.example.com/dead/"))
+        with patch("time.time", return_value=1061):
+            self.assertFalse(cache.is_failing("https://example.com/dead"))
+        self.assertEqual(cache.get_stats()["failures"], 0)
+
+    def test_least_recently_used_articles_are_evicted(self):
+        cache = ArticleCache(max_entries=2)
+        cache.put("https://example.com/1", ARTICLE)
+        cache.put("https://example.com/2", ARTICLE)
+        cache.get("https://example.com/1")
+        cache.put("https://example.com/3", ARTICLE)
+
+        self.assertIsNotNone(cache.get("https://example.com/1"))
+        self.assertIsNone(cache.get("https://example.com/2"))
+        self.assertIsNotNone(cache.get("https://example.com/3"))
+
+    def test_oldest_failures_are_dropped_beyond_max_entries(self):
+        cache = ArticleCache(max_entries=2)
+        for i, failed_at in enumerate([30, 10, 20]):
+            with patch("time.time", return_value=failed_at):
+                cache.put_failure(f"https://example.com/{i}")
+
+        self.assertEqual(sorted(cache.failures.values()), [20, 30])
+
+    def test_save_and_load(self):
+        test_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(test_dir, "articles.json.gz")
+            cache = ArticleCache()
+            cache.put("https://example.com/story", ARTICLE)
+            cache.put_failure("https://example.com/dead")
+            cache.save(path)
+
+            loaded = ArticleCache()
+            self.assertTrue(loaded.load(path))
+            self.assertEqual(loaded.get("https://example.com/story"), ARTICLE)
+            self.assertTrue(loaded.is_failing("https://example.com/dead"))
+        finally:
+            shutil.rmtree(test_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
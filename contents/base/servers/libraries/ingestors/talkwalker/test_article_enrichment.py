@@ -0,0 +1,83 @@
+import time
+import threading
+import unittest
+from unittest.mock import Mock, patch
+
+from .article_enrichment import ArticleEnricher
+
+
+class StubSession:
+    """Returns the url as the html of every page once released"""
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.started = threading.Semaphore(0)
+
+    def get(self, url, headers=None, timeout=None):
+        self.started.release()
+        self.released.wait(5)
+        return Mock(text=url)
+
+
+class StubTalkWalker:
+    def add_news_article(self, data, url, source, html, error):
+        data["news_article"] = {"html": html, "error": error}
+
+
+class TestArticleEnricher(unittest.TestCase):
+    def setUp(self):
+        self.session = StubSession()
+        patcher = patch("libraries.ingestors.talkwalker.article_enrichment.get_shared_session",
+                        return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user_agent = patch("libraries.ingestors.talkwalker.article_enrichment.get_user_agent")
+        user_agent.start()
+        self.addCleanup(user_agent.stop)
+        self.enricher = ArticleEnricher(StubTalkWalker(), download_workers=4, domain_concurrency=1)
+        self.addCleanup(self.enricher.close)
+
+    def submit(self, url):
+        data = {}
+        return data, self.enricher.submit(data, url, "source")
+
+    def test_articles_of_a_domain_are_downloaded_one_at_a_time(self):
+        self.session.released.set()
+        articles = [self.submit(f"https://example.com/{i}") for i in range(3)]
+
+        for data, future in articles:
+            future.result(timeout=5)
+        self.assertEqual([data["news_article"]["html"] for data, _ in articles],
+                         [f"https://example.com/{i}" for i in range(3)])
+        self.enricher.close()
+        self.assertEqual(self.enricher.active, {})
+
+    def test_close_cancels_the_waiting_articles(self):
+        running_data, running = self.submit("https://example.com/1")
+        _, waiting = self.submit("https://example.com/2")
+        self.assertTrue(self.session.started.acquire(timeout=5))
+
+        closing = threading.Thread(target=self.enricher.close)
+        closing.start()
+        # the running download completes once close() dropped the waiting article
+        while not self.enricher.closed:
+            time.sleep(0.01)
+        self.session.released.set()
+        closing.join(5)
+
+        self.assertFalse(closing.is_alive())
+        self.assertIsNone(running.result(timeout=5))
+        self.assertEqual(running_data["news_article"]["html"], "https://example.com/1")
+        self.assertTrue(waiting.cancelled())
+        self.assertEqual(self.enricher.active, {})
+
+    def test_submit_after_close_is_cancelled(self):
+        self.enricher.close()
+
+        _, future = self.submit("https://example.com/1")
+
+        self.assertTrue(future.cancelled())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+
+from .rate_limiter import TokenBucketRateLimiter
+
+
+class TestTokenBucketRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.limiter = TokenBucketRateLimiter(rate=10, capacity=2)
+
+    def test_reserve_waits_once_the_burst_is_spent(self):
+        self.assertEqual(self.limiter.reserve(), 0)
+        self.assertEqual(self.limiter.reserve(), 0)
+        self.assertAlmostEqual(self.limiter.reserve(), 0.1, delta=0.02)
+        self.assertAlmostEqual(self.limiter.reserve(), 0.2, delta=0.02)
+
+        stats = self.limiter.get_stats()
+        self.assertEqual(stats["requests"], 4)
+        self.assertEqual(stats["waited_requests"], 2)
+
+    @patch("time.sleep")
+    def test_acquire_sleeps_for_the_reserved_wait(self, sleep):
+        self.limiter.acquire()
+        self.limiter.acquire()
+        sleep.assert_not_called()
+
+        wait = self.limiter.acquire()
+        sleep.assert_called_once_with(wait)
+        self.assertAlmostEqual(wait, 0.1, delta=0.02)
+
+    def test_retry_after_pauses_and_halves_the_rate(self):
+        self.limiter.update(429, {"Retry-After": "2"})
+
+        self.assertAlmostEqual(self.limiter.reserve(), 2, delta=0.05)
+        self.assertEqual(self.limiter.rate, 5)
+
+    def test_no_remaining_calls_pauses_until_the_reset(self):
+        self.limiter.update(200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "5"})
+
+        self.assertAlmostEqual(self.limiter.reserve(), 5, delta=0.05)
+
+    def test_remaining_calls_are_spread_over_the_reset_window(self):
+        self.limiter.update(200, {"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": "5"})
+
+        self.assertEqual(self.limiter.rate, 2)
+
+    def test_limit_is_a_quota_of_the_reset_window(self):
+        self.limiter.update(200, {"X-RateLimit-Limit": "60", "X-RateLimit-Reset": "60"})
+
+        self.assertEqual(self.limiter.rate, 1)
+
+    def test_limit_without_reset_window_is_ignored(self):
+        self.limiter.update(200, {"X-RateLimit-Limit": "2"})
+
+        self.assertEqual(self.limiter.rate, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
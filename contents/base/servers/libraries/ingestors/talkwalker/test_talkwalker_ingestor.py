@@ -0,0 +1,159 @@
+import os
+import unittest
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+from .talkwalker_ingestor import TalkWalker
+
+WINDOW = (1700000000, 1700003600)
+
+
+def create_talkwalker():
+    with patch("nltk.download"):
+        return TalkWalker(
+            {"project_id": "project", "topic_id": "topic", "from_date": None, "to_date": None, "get_news_links": False},
+            Mock(),
+        )
+
+
+class TestTalkWalker(unittest.TestCase):
+    def setUp(self):
+        self.env = patch.dict(os.environ, {"MAX_RETRIES": "1", "PAGE_SIZE": "10"})
+        self.env.start()
+        self.talk_walker = create_talkwalker()
+
+    def tearDown(self):
+        self.env.stop()
+
+    def test_extract_offset_from_next(self):
+        self.assertEqual(self.talk_walker.extract_offset_from_next("https://api/results?offset=20&pretty=true"), 20)
+        self.assertEqual(self.talk_walker.extract_offset_from_next("https://api/results?pretty=true&offset=30"), 30)
+        self.assertIsNone(self.talk_walker.extract_offset_from_next(""))
+        self.assertIsNone(self.talk_walker.extract_offset_from_next(None))
+        with self.assertRaises(Exception):
+            self.talk_walker.extract_offset_from_next("https://api/results?pretty=true")
+
+    def test_search_results_ends_the_window_on_the_last_page_only(self):
+        responses = {
+            0: {"data": {"result_content": {"data": [{"data": {"title": "a"}}]}},
+                "pagination": {"next": "https://api/results?offset=10"}},
+            10: {"data": {"result_content": {"data": [{"data": {"title": "b"}}]}}, "pagination": {}},
+        }
+        self.talk_walker.download_as_object = lambda url, parameters=None: responses[parameters["offset"]]
+
+        pages = list(self.talk_walker.search_results("https://api/results", {"offset": 0}, WINDOW))
+
+        self.assertEqual([page.next_offset for page in pages], [10, None])
+        self.assertEqual([item["title"] for page in pages for item in page], ["a", "b"])
+
+    def test_resumed_window_is_fetched_again(self):
+        other_window = (WINDOW[1], WINDOW[1] + 3600)
+        self.talk_walker.set_resume_state([WINDOW, other_window], {WINDOW, other_window}, {WINDOW: 20})
+
+        self.assertEqual(self.talk_walker.get_windows_to_fetch("https://api/results"), [WINDOW])
+
+    def test_cached_article_is_found_by_its_parent_url(self):
+        article = {"datetime": None, "title": "title", "authors": [], "text": "text", "summary": "summary"}
+        self.talk_walker.article_cache.put("https://example.com/news/story", article)
+        self.talk_walker.save_attribution_logs_to_file = Mock()
+        data = {
+            "url": "https://example.com/news/story/comments/1",
+            "parent_url": "https://example.com/news/story",
+            "root_url": "https://example.com/",
+        }
+
+        self.assertEqual(self.talk_walker.get_article_aliases(data, data["url"]), ["https://example.com/news/story"])
+        self.assertTrue(self.talk_walker.add_cached_news_article(data, data["url"], "example.com"))
+        self.assertEqual(data["news_article"]["title"], "title")
+        self.assertEqual(data["news_article"]["url"], data["url"])
+
+
+class TestAdaptiveWindows(unittest.TestCase):
+    """Windows sized by a stubbed probe_window_total counting the items published in each window"""
+
+    def setUp(self):
+        self.env = patch.dict(os.environ, {"MAX_RETRIES": "1", "PAGE_SIZE": "10"})
+        self.env.start()
+        self.talk_walker = create_talkwalker()
+        # budget of 2 pages of 10 items
+        self.talk_walker.window_page_budget = 2
+        self.talk_walker.min_window_seconds = 60
+        self.day = self.talk_walker.get_epoch_time(1, 3, 2024)
+        self.published = []
+        self.probes = []
+
+        def probe_window_total(url, window):
+            self.probes.append(window)
+            return sum(1 for published in self.published if window[0] <= published < window[1])
+
+        self.talk_walker.probe_window_total = probe_window_total
+
+    def tearDown(self):
+        self.env.stop()
+
+    def get_windows(self, days=1):
+        return self.talk_walker.get_adaptive_windows(
+            "https://api/results", datetime(2024, 3, 1), datetime(2024, 3, days)
+        )
+
+    def count(self, window):
+        return sum(1 for published in self.published if window[0] <= published < window[1])
+
+    def test_sparse_day_is_one_window(self):
+        self.published = [self.day + 100, self.day + 40000, self.day + 80000]
+
+        self.assertEqual(self.get_windows(), [(self.day, self.day + 24 * 3600)])
+        self.assertEqual(len(self.probes), 1)
+
+    def test_dense_day_is_bisected_within_the_budget(self):
+        # 100 items during the first hour, 5 during the rest of the day
+        self.published = [self.day + i * 36 for i in range(100)] + [self.day + 7200 + i * 3600 for i in range(5)]
+
+        windows = self.get_windows()
+
+        self.assertTrue(all(self.count(window) <= 20 for window in windows))
+        self.assertEqual(sum(self.count(window) for window in windows), len(self.published))
+        # windows are ordered and do not overlap
+        self.assertTrue(all(previous[1] <= window[0] for previous, window in zip(windows, windows[1:])))
+
+    def test_adjacent_sparse_windows_are_merged(self):
+        # the first half of the day is dense, its last quarter joins the sparse second half
+        self.published = [self.day + i * 1800 for i in range(24)] + [self.day + 12 * 3600 + i * 7200 for i in range(6)]
+
+        windows = self.get_windows()
+
+        self.assertLess(len(windows), len(self.probes))
+        self.assertTrue(all(self.count(window) <= 20 for window in windows))
+        self.assertEqual(sum(self.count(window) for window in windows), len(self.published))
+        self.assertEqual(windows[-1][1], self.day + 24 * 3600)
+
+    def test_empty_days_are_dropped_and_not_merged_across(self):
+        second_day = self.day + 24 * 3600
+        third_day = second_day + 24 * 3600
+        self.published = [self.day + 100, third_day + 100]
+
+        self.assertEqual(
+            self.get_windows(days=3),
+            [(self.day, self.day + 24 * 3600), (third_day, third_day + 24 * 3600)],
+        )
+
+    def test_bisection_stops_at_the_minimum_window(self):
+        self.published = [self.day + 5000] * 50
+
+        windows = self.get_windows()
+
+        self.assertEqual(len(windows), 1)
+        self.assertLessEqual(windows[0][1] - windows[0][0], 60)
+        self.assertEqual(self.count(windows[0]), 50)
+
+    def test_failed_probe_falls_back_to_hour_windows(self):
+        self.talk_walker.probe_window_total = lambda url, window: None
+
+        windows = self.get_windows()
+
+        self.assertEqual(len(windows), 24)
+        self.assertEqual(windows[0], (self.day, self.day + 3600))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+
+class TweetCache:
+    """Persistent cache of hydrated tweets, shared by the jobs through a SQLite file.
+
+    Tweets are stored with their author (see Twitter.parse_tweets_response), so one lookup serves both the
+    tweet and the user. Entries older than ttl seconds are ignored and removed by evict(), which also keeps
+    at most max_entries tweets by dropping the least recently used ones.
+    The hit and miss counters of the job give its hit rate.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 1000000):
+        self.logger = logging.getLogger()
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tweets (id TEXT PRIMARY KEY, data TEXT, stored_at REAL, accessed_at REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tweets_accessed_at ON tweets (accessed_at)")
+        self.connection.commit()
+
+    def get_many(self, ids: list) -> dict:
+        """Returns the cached tweets of ids that did not expire, by id"""
+
+        if not ids:
+            return {}
+        now = time.time()
+        tweets = {}
+        with self.lock:
+            # sqlite limits the number of parameters of a statement
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                rows = self.connection.execute(
+                    f"SELECT id, data FROM tweets WHERE stored_at >= ? AND id IN ({','.join('?' * len(chunk))})",
+                    [now - self.ttl, *chunk],
+                ).fetchall()
+                tweets.update((tweet_id, json.loads(data)) for tweet_id, data in rows)
+            if tweets:
+                self.connection.executemany(
+                    "UPDATE tweets SET accessed_at = ? WHERE id = ?", [(now, tweet_id) for tweet_id in tweets]
+                )
+                self.connection.commit()
+            self.hits += len(tweets)
+            self.misses += len(ids) - len(tweets)
+        return tweets
+
+    def put_many(self, tweets: list) -> None:
+        if not tweets:
+            return
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO tweets (id, data, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(tweet["id"], json.dumps(tweet), now, now) for tweet in tweets],
+            )
+            self.connection.commit()
+
+    def evict(self) -> None:
+        """Removes the expired tweets and the least recently used ones beyond max_entries"""
+
+        with self.lock:
+            self.connection.execute("DELETE FROM tweets WHERE stored_at < ?", [time.time() - self.ttl])
+            count = self.connection.execute("SELECT COUNT(*) FROM tweets").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM tweets WHERE id IN (SELECT id FROM tweets ORDER BY accessed_at LIMIT ?)",
+                    [count - self.max_entries],
+                )
+            self.connection.commit()
+
+    def get_hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.get_hit_rate(), 3),
+        }
+
+    def close(self) -> None:
+        self.evict()
+        with self.lock:
+            self.connection.close()
+        self.logger.info(f"Tweet cache {self.path} closed: {self.get_stats()}")
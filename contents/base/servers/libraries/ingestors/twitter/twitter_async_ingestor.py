@@ -0,0 +1,52 @@
+import json
+import asyncio
+import aiohttp
+
+from libraries.ingestors.twitter.twitter_ingestor import Twitter
+
+
+class AsyncTwitter(Twitter):
+    """asyncio version of the Twitter bulk tweet lookup, running on the aiohttp session of the caller's event loop"""
+
+    def __init__(self, session: aiohttp.ClientSession, cache=None):
+        Twitter.__init__(self, cache)
+        self.session = session
+
+    async def get_tweets_by_ids(self, items, error_file_path, is_retry=False):
+        """
+        Method to send a bulk tweet api call and return the tweet information.
+        returns the same dict of tweets data and errors as Twitter.get_tweets_by_ids.
+        The sqlite cache is read and written on a worker thread, off the event loop.
+        """
+
+        cached, items = ([], items) if is_retry else await asyncio.to_thread(self.get_cached_tweets, items)
+        if not items:
+            return {"data": cached, "errors": []}
+        result = await self.request_tweets_by_ids(items, error_file_path)
+        return await asyncio.to_thread(self.add_cached_tweets, result, cached)
+
+    async def request_tweets_by_ids(self, items, error_file_path):
+        api_url, params, headers = self.get_tweets_by_ids_request(items)
+
+        for i in range(self.max_retries):
+            try:
+                async with self.session.get(
+                    api_url, params=params, headers=headers, timeout=aiohttp.ClientTimeout(total=10)
+                ) as response:
+                    response_text = await response.text()
+                    return self.parse_tweets_response(
+                        response.status, response_text, json.loads(response_text), error_file_path
+                    )
+            except asyncio.TimeoutError:
+                self.logger.error(f"Twitter timeout retry hit")
+                self.logger.error(
+                    f"get_tweets_by_ids - Request timed out. Attempt: {i+1}"
+                )
+                if (
+                    i < self.max_retries - 1
+                ):  # wait before retrying, but not after the last attempt
+                    await asyncio.sleep(5 * (i + 1))
+                else:
+                    break
+            except Exception as e:
+                self.logger.error(f"{e}")
@@ -5,6 +5,7 @@ import requests
 from pprint import pprint
 
 from libraries.ingestors.ingestor import Ingestor
+from libraries.ingestors.http_sessions import get_session
 
 # from config import Config
 
@@ -13,8 +14,10 @@ from libraries.ingestors.ingestor import Ingestor
 
 
 class Twitter(Ingestor):
-    def __init__(self):
+    def __init__(self, cache=None):
         Ingestor.__init__(self)
+        # optional TweetCache checked before every bulk lookup
+        self.cache = cache
         self.page_size = os.getenv("PAGE_SIZE")
         self.twitter_token = os.getenv("TWITTER_TOKEN")
         self.max_retries = int(os.getenv("MAX_RETRIES"))
@@ -25,20 +28,21 @@ class Twitter(Ingestor):
         self.logger.setLevel(logging.INFO)
 
     @staticmethod
-    def get_user_by_id(user_list, target_id):
-        for item in user_list:
-            if item["id"] == target_id:
-                return item
-        return ""
+    def index_users(user_list):
+        """Returns the users of a response includes by id, built once per response"""
+        return {user["id"]: user for user in user_list or []}
+
+    @staticmethod
+    def get_user_by_id(users_by_id, target_id):
+        return users_by_id.get(target_id, "")
 
     def append_error_to_file(self, error, filename):
         with open(filename, "a") as f:
             f.write(error + "\n")
 
-    def get_tweets_by_ids(self, items, error_file_path):
+    def get_tweets_by_ids_request(self, items):
         """
-        Method to send a bulk tweet api call and return the tweet information.
-        returns a tuple of tweets data and twitter_error. The twitter_error is 1 if the api response is not successful.
+        Method to build the url, params and headers of a bulk tweet lookup api call.
         """
 
         api_url = "https://api.twitter.com/2/tweets"
@@ -50,46 +54,93 @@ class Twitter(Ingestor):
             "ids": f"{tweet_ids}",
         }
         headers = {"Authorization": f"Bearer {self.twitter_token}"}
+        return api_url, params, headers
+
+    def parse_tweets_response(self, status_code, response_text, response_data, error_file_path):
+        """
+        Method to turn a bulk tweet lookup api response into a dict of tweets data and errors.
+        """
+
+        data = []
+
+        error_collection = response_data.get("errors")
+        if error_collection:
+            self.logger.error(
+                f"Twitter returned partial {len(error_collection)} errors."
+            )
+            for key in error_collection:
+                # self.logger.error(f"{key}")
+                self.append_error_to_file(f"{key}", error_file_path)
+
+        # self.logger.info(f"response_data['errors'] = {response_data['errors']}")
+
+        result = {"data": [], "errors": []}
+        if status_code == 200:
+            if "data" in response_data:
+                users_by_id = self.index_users(response_data.get("includes", {}).get("users"))
+                for tweet_data in zip(response_data["data"]):
+                    tweet_dict = dict(tweet_data[0])
+                    if "includes" in response_data:
+                        author = self.get_user_by_id(
+                            users_by_id, tweet_dict["author_id"]
+                        )
+                        tweet_dict["author"] = author
+                    data.append(tweet_dict)
+            if "errors" in response_data:
+                result["errors"] = response_data["errors"]
+        else:
+            logging.error(f"get_tweets_by_ids: {response_text}")
+
+        result["data"] = data
+        return result
+
+    def get_cached_tweets(self, items):
+        """
+        Method to split the tweet ids into the tweets found in the cache and the ids to look up.
+        """
+        if self.cache is None:
+            return [], items
+        cached = self.cache.get_many([str(item) for item in items])
+        return list(cached.values()), [item for item in items if str(item) not in cached]
+
+    def add_cached_tweets(self, result, cached):
+        """
+        Method to store the looked up tweets in the cache and add the cached tweets to the lookup result.
+        """
+        if self.cache is None:
+            return result
+        if result is None:
+            # the ids looked up are missing from the result, callers treat them as not returned
+            return {"data": cached, "errors": []} if cached else None
+        self.cache.put_many(result["data"])
+        result["data"] = cached + result["data"]
+        return result
+
+    def get_tweets_by_ids(self, items, error_file_path, is_retry=False):
+        """
+        Method to send a bulk tweet api call and return the tweet information.
+        returns a tuple of tweets data and twitter_error. The twitter_error is 1 if the api response is not successful.
+        Tweets found in the cache are not looked up again. Retried ids already missed the cache,
+        they are only looked up in the api so that the cache counts each id once.
+        """
+
+        cached, items = ([], items) if is_retry else self.get_cached_tweets(items)
+        if not items:
+            return {"data": cached, "errors": []}
+        return self.add_cached_tweets(self.request_tweets_by_ids(items, error_file_path), cached)
+
+    def request_tweets_by_ids(self, items, error_file_path):
+        api_url, params, headers = self.get_tweets_by_ids_request(items)
 
         for i in range(self.max_retries):
             try:
-                response = requests.get(
+                response = get_session(api_url).get(
                     api_url, params=params, headers=headers, timeout=10
                 )
 
-                data = []
-                response_data = response.json()
-
-                error_collection = response_data.get("errors")
-                if error_collection:
-                    self.logger.error(
-                        f"Twitter returned partial {len(error_collection)} errors."
-                    )
-                    for key in error_collection:
-                        # self.logger.error(f"{key}")
-                        self.append_error_to_file(f"{key}", error_file_path)
-
-                # self.logger.info(f"response_data['errors'] = {response_data['errors']}")
-
-                result = {"data": [], "errors": []}
-                if response.status_code == 200:
-                    if "data" in response_data:
-                        for tweet_data in zip(response_data["data"]):
-                            tweet_dict = dict(tweet_data[0])
-                            if "includes" in response_data:
-                                includes = response_data["includes"]
-                                author = self.get_user_by_id(
-                                    includes.get("users"), tweet_dict["author_id"]
-                                )
-                                tweet_dict["author"] = author
-                            data.append(tweet_dict)
-                    if "errors" in response_data:
-                        result["errors"] = response_data["errors"]
-                else:
-                    logging.error(f"get_tweets_by_ids: {response.text}")
-
-                result["data"] = data
-                return result
+                return self.parse_tweets_response(
+                    response.status_code, response.text, response.json(), error_file_path
+                )
             except requests.exceptions.Timeout:
                 self.logger.error(f"Twitter timeout retry hit")
                 self.logger.error(
@@ -115,7 +166,7 @@ class Twitter(Ingestor):
         """
         for i in range(self.max_retries):
             try:
-                response = requests.request(
+                response = get_session(endpoint_url).request(
                     "GET", url=endpoint_url, headers=headers, params=parameters
                 )
                 response_status_code = response.status_code
@@ -172,12 +223,12 @@ class Twitter(Ingestor):
             endpoint_url, headers, query_parameters
         )
         if "data" in json_response.keys():
+            users_by_id = self.index_users(json_response.get("includes", {}).get("users"))
             for tweet_data in zip(json_response["data"]):
                 tweet_dict = dict(tweet_data[0])
                 if "includes" in json_response.keys():
-                    includes = json_response["includes"]
                     author = self.get_user_by_id(
-                        includes.get("users"), tweet_dict["author_id"]
+                        users_by_id, tweet_dict["author_id"]
                     )
                     tweet_dict["author"] = author
                 yield tweet_dict
@@ -189,12 +240,12 @@ class Twitter(Ingestor):
                 endpoint_url, headers, query_parameters
             )
             if "data" in json_response.keys():
+                users_by_id = self.index_users(json_response.get("includes", {}).get("users"))
                 for tweet_data in zip(json_response["data"]):
                     tweet_dict = dict(tweet_data[0])
                     if "includes" in json_response.keys():
-                        includes = json_response["includes"]
                         author = self.get_user_by_id(
-                            includes.get("users"), tweet_dict["author_id"]
+                            users_by_id, tweet_dict["author_id"]
                         )
                         tweet_dict["author"] = author
                     yield tweet_dict
@@ -1,5 +1,10 @@
 import os
+import gzip
+import atexit
 import time
+import queue
+import shutil
+import threading
 import boto3
 import logging
 import watchtower
@@ -10,11 +15,65 @@ from .metric import Metric
 from .metrics import Metrics
 from datetime import datetime, timezone
 from .constants import LogMetricsConstants
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+
+class S3LogUploader:
+    """Background uploader of rotated log files.
+
+    Rotated files are put on a bounded queue and gzip compressed and uploaded to S3 by a worker thread,
+    so the logging call that triggered the rotation does not wait for the upload. A full queue blocks the
+    rotation until a slot is free. Uploads are retried, drain() waits until the queue is empty.
+    """
+
+    def __init__(self, s3: S3Storage, bucket: str, queue_size: int = 16, max_retries: int = 3):
+        self.s3 = s3
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, name="s3_log_uploader", daemon=True)
+        self.thread.start()
+
+    def submit(self, file_name: str, key: str) -> None:
+        self.queue.put((file_name, key))
+
+    def run(self) -> None:
+        while True:
+            file_name, key = self.queue.get()
+            try:
+                self.upload(file_name, key)
+            except Exception as e:
+                print(f'ROLLOVER - upload of {file_name} failed: {e}')
+            finally:
+                self.queue.task_done()
+
+    def upload(self, file_name: str, key: str) -> None:
+        compressed_file_name = f'{file_name}.gz'
+        with open(file_name, 'rb') as f, gzip.open(compressed_file_name, 'wb') as compressed:
+            shutil.copyfileobj(f, compressed)
+
+        try:
+            for i in range(self.max_retries):
+                print(f'ROLLOVER - uploading {compressed_file_name} to bucket {self.bucket} object {key}')
+                if self.s3.upload_file(compressed_file_name, self.bucket, key):
+                    return
+                if i < self.max_retries - 1:  # wait before retrying, but not after the last attempt
+                    time.sleep(2 ** i)
+            print(f'ROLLOVER - {compressed_file_name} could not be uploaded to bucket {self.bucket} object {key}')
+        finally:
+            os.remove(compressed_file_name)
+
+    def drain(self) -> None:
+        """Waits until every submitted file is uploaded"""
+        self.queue.join()
 
 
 class S3RotatingLogFileHandler(RotatingFileHandler):
-    """Log handler that supports rotation and upload rotated log to S3 object store"""
+    """Log handler that supports rotation and upload rotated log to S3 object store
+
+    Rotated logs are moved to LOG_BACKUP_DIR and uploaded as {key}_{timestamp}.log.txt.gz in the background,
+    wait_for_uploads() blocks until they are all uploaded.
+    """
 
     def __init__(self, bucket, key, filename, mode='a', maxBytes=0, backupCount=0, encoding=None, delay=0, errors=None):
         super().__init__(filename, mode, maxBytes, backupCount, encoding, delay, errors)
@@ -22,29 +81,72 @@ class S3RotatingLogFileHandler(RotatingFileHandler):
         self.key = key
         self.s3 = S3Storage()
         self.s3.authenticate()
+        self.uploader = S3LogUploader(self.s3, bucket, queue_size=int(os.getenv('LOG_UPLOAD_QUEUE_SIZE', '16')))
+        self.last_timestamp = 0
 
     def doRollover(self):
-        timestamp = int(time.time())
-        print(f'ROLLOVER - uploading {self.baseFilename} to bucket {self.bucket} object {self.key}_{timestamp}')
-        self.s3.upload_file(self.baseFilename, self.bucket, f'{self.key}_{timestamp}.log.txt')
+        # rotated files are uploaded later, two rotations in the same second must not share a name
+        timestamp = max(int(time.time()), self.last_timestamp + 1)
+        self.last_timestamp = timestamp
+
+        if self.stream:
+            self.stream.close()
+            self.stream = None
 
         current_log_file = self.baseFilename
-        filename_without_extension = os.path.splitext(os.path.basename(current_log_file))[0]
         new_log_file = os.path.join(LogMetricsConstants.LOG_BACKUP_DIR, os.path.basename(current_log_file))
-        os.rename(current_log_file, f'{new_log_file}_{timestamp}.log.txt')
+        rotated_log_file = f'{new_log_file}_{timestamp}.log.txt'
+        if os.path.exists(current_log_file):
+            os.rename(current_log_file, rotated_log_file)
+            print(f'ROLLOVER - queuing {rotated_log_file} for bucket {self.bucket} object {self.key}_{timestamp}')
+            self.uploader.submit(rotated_log_file, f'{self.key}_{timestamp}.log.txt.gz')
+
+        if not self.delay:
+            self.stream = self._open()
+
+    def wait_for_uploads(self):
+        self.uploader.drain()
+
+
+class LogQueueHandler(QueueHandler):
+    """Queue handler with a drop policy: DEBUG records are dropped when the queue is full,
+    records of higher levels wait for a free slot so they are never lost"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
 
-        super().doRollover()
+    def enqueue(self, record):
+        if record.levelno > logging.DEBUG:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogQueueListener(QueueListener):
+    """Queue listener whose stop() waits for a free slot of a full bounded queue"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
 
 
 class CloudMultiLogMetrics:
     """CloudMultiLogMetrics is a Logger and Metrics reporter that supports the following features:
 
         1) separate local logs with info, error levels
-        2) s3 info logs with partitions (available and uploaded after rotation)
-        3) s3 errors logs with partitions (available and uploaded after rotation)
+        2) s3 info logs with partitions (available and uploaded gzip compressed in background after rotation)
+        3) s3 errors logs with partitions (available and uploaded gzip compressed in background after rotation)
         4) cloudwatch log stream info logs (real time)
         5) cloudwatch log stream error logs (real time)
-        6) cloudwatch metrics (integer counter, real time)
+        6) cloudwatch metrics (integer counter, aggregated and sent in batches every METRICS_FLUSH_INTERVAL seconds)
+
+        The logger methods only put the record on a queue of LOG_QUEUE_SIZE records (DEBUG records are dropped
+        when it is full). One listener thread hands every record to the file, s3 and cloudwatch handlers,
+        once per record: the info handlers take INFO+ records and the error handlers take ERROR+ records.
+        LOG_RECORD_LEVEL sets the lowest level recorded (INFO by default).
 
 
         log_level =
@@ -109,11 +211,20 @@ class CloudMultiLogMetrics:
         formatter = logging.Formatter(fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         formatter.converter = time.gmtime
 
+        # records are queued by the caller and handled by the listener thread started at the end of the setup
+        self.log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+        self.queue_handler = LogQueueHandler(self.log_queue)
+        self.logger = logging.getLogger('multi_logger')
+        self.logger.setLevel(os.getenv('LOG_RECORD_LEVEL', 'INFO').upper())
+        self.logger.propagate = False
+        self.logger.handlers.clear()
+        self.logger.addHandler(self.queue_handler)
+        # the console output of the root logger is written by the listener as well
+        handlers = list(self.root_logger.handlers)
+
         if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
 
             self.info_log_file_name = f'log_info_{dimension_1_value}_{dimension_3_value}.log.txt'
-            self.info_logger = logging.getLogger('info_logger')
-            self.info_logger.setLevel(logging.INFO)
 
             self.root_logger.info(f"S3 Info Log key = {self.info_log_file_name}")
             self.root_logger.info(f"Setting up S3RotatingLogFileHandler for S3 Info Log")
@@ -122,14 +233,13 @@ class CloudMultiLogMetrics:
                 self.info_handler = S3RotatingLogFileHandler(info_log_bucket_name, self.info_object_storage_key,
                                                              self.info_log_file_name, maxBytes=rotation_byte_size,
                                                              backupCount=1024)
-                self.info_logger.addHandler(self.info_handler)
+                self.info_handler.setLevel(logging.INFO)
                 self.info_handler.setFormatter(formatter)
+                handlers.append(self.info_handler)
 
         if self.log_level & LogMetricsConstants.LOG_LEVEL_ERROR:
 
             self.error_log_file_name = f'log_error_{dimension_1_value}_{dimension_3_value}.log.txt'
-            self.error_logger = logging.getLogger('error_logger')
-            self.error_logger.setLevel(logging.ERROR)
 
             self.root_logger.info(f"S3 Error Log key = {self.error_log_file_name}")
             self.root_logger.info(f"Setting up S3RotatingLogFileHandler for S3 Error Log")
@@ -138,8 +248,9 @@ class CloudMultiLogMetrics:
                 self.error_handler = S3RotatingLogFileHandler(error_log_bucket_name, self.error_object_storage_key,
                                                               self.error_log_file_name, maxBytes=rotation_byte_size,
                                                               backupCount=1024)
-                self.error_logger.addHandler(self.error_handler)
+                self.error_handler.setLevel(logging.ERROR)
                 self.error_handler.setFormatter(formatter)
+                handlers.append(self.error_handler)
 
         if self.log_destination & LogMetricsConstants.LOG_DESTINATION_OBJECT_STORE or self.log_destination & LogMetricsConstants.LOG_DESTINATION_CLOUD_LOGS or self.metrics_destination & LogMetricsConstants.METRICS_DESTINATION_CLOUD:
 
@@ -180,10 +291,11 @@ class CloudMultiLogMetrics:
                         log_stream_name=f'{dimension_1_value}_{dimension_3_value}_{dimension_2_value}',
                         boto3_client=boto3_logs_client)
 
-                    self.info_logger.info(
+                    self.logger.info(
                         f'Added cloudwatch log handler with log group={namespace}_info_log & log stream={dimension_1_value}_{dimension_3_value}_{dimension_2_value} in {region_name_env} region')
 
-                    self.info_logger.addHandler(watchtower_handler)
+                    watchtower_handler.setLevel(logging.INFO)
+                    handlers.append(watchtower_handler)
                     if flask_app:
                         flask_app.logger.addHandler(watchtower_handler)
                         logging.getLogger("werkzeug").addHandler(watchtower_handler)
@@ -198,10 +310,11 @@ class CloudMultiLogMetrics:
                         boto3_client=boto3_logs_client)
 
                     if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-                        self.info_logger.info(
+                        self.logger.info(
                             f'Added cloudwatch log handler with log group={namespace}_error_log & log stream={dimension_1_value}_{dimension_3_value}_{dimension_2_value} in {region_name_env} region')
 
-                    self.error_logger.addHandler(watchtower_handler)
+                    watchtower_handler.setLevel(logging.ERROR)
+                    handlers.append(watchtower_handler)
                     if flask_app:
                         flask_app.logger.addHandler(watchtower_handler)
                         logging.getLogger("werkzeug").addHandler(watchtower_handler)
@@ -221,10 +334,19 @@ class CloudMultiLogMetrics:
                     dimension_2_value=dimension_2_value,
                     dimension_3_name=dimension_3_name,
                     dimension_3_value=dimension_3_value,
-                    boto_client=boto3_watch_client
+                    boto_client=boto3_watch_client,
+                    flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', '10')),
+                    queue_size=int(os.getenv('METRICS_QUEUE_SIZE', '10000'))
                 )
                 self.root_logger.info(f'Cloudwatch Metrics setup is complete.')
 
+        self.listener = LogQueueListener(self.log_queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        # the listener and uploader threads are daemons, a job exiting without finalize() would lose its last records
+        self.finalized = False
+        self.finalize_lock = threading.Lock()
+        atexit.register(self.finalize)
+
         self.root_logger.info("Cloud Multilog initialization is complete.")
 
     # logger methods
@@ -232,49 +354,39 @@ class CloudMultiLogMetrics:
     def info(self, msg, *args, **kwargs):
 
         if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-            self.info_logger.info(msg, *args, **kwargs)
+            self.logger.info(msg, *args, **kwargs)
 
     def debug(self, msg, *args, **kwargs):
 
         if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-            self.info_logger.debug(msg, *args, **kwargs)
+            self.logger.debug(msg, *args, **kwargs)
 
     def warning(self, msg, *args, **kwargs):
 
         if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-            self.info_logger.warning(msg, *args, **kwargs)
+            self.logger.warning(msg, *args, **kwargs)
 
-    def error(self, msg, *args, **kwargs):
+    # error records are queued once, the listener hands them to the info and the error handlers
 
-        if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-            self.info_logger.error(msg, *args, **kwargs)
+    def error(self, msg, *args, **kwargs):
 
-        if self.log_level & LogMetricsConstants.LOG_LEVEL_ERROR:
-            self.error_logger.error(msg, *args, **kwargs)
+        if self.log_level & LogMetricsConstants.LOG_LEVEL_ALL:
+            self.logger.error(msg, *args, **kwargs)
 
     def critical(self, msg, *args, **kwargs):
 
-        if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-            self.info_logger.critical(msg, *args, **kwargs)
-
-        if self.log_level & LogMetricsConstants.LOG_LEVEL_ERROR:
-            self.error_logger.critical(msg, *args, **kwargs)
+        if self.log_level & LogMetricsConstants.LOG_LEVEL_ALL:
+            self.logger.critical(msg, *args, **kwargs)
 
     def fatal(self, msg, *args, **kwargs):
 
-        if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-            self.info_logger.fatal(msg, *args, **kwargs)
-
-        if self.log_level & LogMetricsConstants.LOG_LEVEL_ERROR:
-            self.error_logger.fatal(msg, *args, **kwargs)
-
-    def exception(self, msg, *args, exc_info, **kwargs):
+        if self.log_level & LogMetricsConstants.LOG_LEVEL_ALL:
+            self.logger.fatal(msg, *args, **kwargs)
 
-        if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-            self.info_logger.exception(msg, *args, exc_info, **kwargs)
+    def exception(self, msg, *args, exc_info=True, **kwargs):
 
-        if self.log_level & LogMetricsConstants.LOG_LEVEL_ERROR:
-            self.error_logger.exception(msg, *args, **kwargs)
+        if self.log_level & LogMetricsConstants.LOG_LEVEL_ALL:
+            self.logger.exception(msg, *args, exc_info=exc_info, **kwargs)
 
     # metrics methods
 
@@ -286,9 +398,21 @@ class CloudMultiLogMetrics:
         now_utc = datetime.now(timezone.utc)
 
         if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-            self.info_logger.info(
+            self.logger.info(
                 f'metric report at {now_utc.strftime("%Y-%m-%d %H:%M:%S")} UTC {metric_name}={metric_value}')
 
+    def write_metric_values(self, values: dict):
+        """Reports several metric values with one metrics call"""
+
+        if self.metrics_destination & LogMetricsConstants.METRICS_DESTINATION_CLOUD:
+            self.metrics_sink.write_values(values)
+
+        now_utc = datetime.now(timezone.utc)
+
+        if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
+            self.logger.info(
+                f'metric report at {now_utc.strftime("%Y-%m-%d %H:%M:%S")} UTC {values}')
+
     def write_metric(self, metric: Metric):
 
         if self.metrics_destination & LogMetricsConstants.METRICS_DESTINATION_CLOUD:
@@ -297,22 +421,46 @@ class CloudMultiLogMetrics:
         now_utc = datetime.now(timezone.utc)
 
         if self.log_level & LogMetricsConstants.LOG_LEVEL_INFO:
-            self.info_logger.info(
+            self.logger.info(
                 f'metric report at {now_utc.strftime("%Y-%m-%d %H:%M:%S")} UTC {metric.name}={metric.value}')
 
     def finalize(self):
 
+        # called by the job and again at exit
+        with self.finalize_lock:
+            if self.finalized:
+                return
+            self.finalized = True
+        atexit.unregister(self.finalize)
+
+        # send the aggregated metrics left
+        if self.metrics_destination & LogMetricsConstants.METRICS_DESTINATION_CLOUD:
+            self.metrics_sink.close()
+
+        # handle the queued records
+        self.listener.stop()
+        if self.queue_handler.dropped:
+            self.root_logger.info(f"{self.queue_handler.dropped} DEBUG log records dropped, the log queue was full")
+        self.logger.handlers.clear()
+
         # process the last log file
         if (self.log_level & LogMetricsConstants.LOG_LEVEL_INFO and
                 self.log_destination & LogMetricsConstants.LOG_DESTINATION_OBJECT_STORE):
             self.root_logger.info(">>>>> multi log info rotation called")
             self.info_handler.doRollover()
-            self.info_logger.handlers.clear()
 
         if (self.log_level & LogMetricsConstants.LOG_LEVEL_ERROR and
                 self.log_destination & LogMetricsConstants.LOG_DESTINATION_OBJECT_STORE):
             self.error_handler.doRollover()
-            self.error_logger.handlers.clear()
+
+        # wait for the rotated logs being uploaded in background
+        if (self.log_level & LogMetricsConstants.LOG_LEVEL_INFO and
+                self.log_destination & LogMetricsConstants.LOG_DESTINATION_OBJECT_STORE):
+            self.info_handler.wait_for_uploads()
+
+        if (self.log_level & LogMetricsConstants.LOG_LEVEL_ERROR and
+                self.log_destination & LogMetricsConstants.LOG_DESTINATION_OBJECT_STORE):
+            self.error_handler.wait_for_uploads()
 
 # if __name__ == "__main__":
 #     logger = CloudMultiLogMetrics(application_name='talkwalker', job_name='project_1_topic_1',
@@ -1,9 +1,22 @@
-import boto3
+import time
+import queue
+import logging
+import threading
+from datetime import datetime, timezone
 from .metric import Metric
 
 
 class Metrics:
-    """Metrics is a wrapper class for Cloud Metrics Service to report integer metrics"""
+    """Metrics is a wrapper class for Cloud Metrics Service to report integer metrics
+
+    write() never calls the service: values are put on a bounded queue and a background thread aggregates
+    them per metric name into statistic sets (sample count, sum, minimum, maximum). Every flush_interval
+    seconds the statistic sets are sent with put_metric_data, in batches of up to MAX_METRIC_DATA metrics.
+    When the queue is full (the service is too slow) values are dropped and counted instead of blocking
+    the caller. close() sends what is left.
+    """
+
+    MAX_METRIC_DATA = 1000  # put_metric_data limit of metrics per call
 
     def __init__(self,
                  namespace: str,
@@ -13,7 +26,9 @@ class Metrics:
                  dimension_2_value: str,
                  dimension_3_name: str,
                  dimension_3_value: str,
-                 boto_client):
+                 boto_client,
+                 flush_interval: float = 10.0,
+                 queue_size: int = 10000):
         self.namespace = namespace
         self.dimension_1_name = dimension_1_name
         self.dimension_1_value = dimension_1_value
@@ -23,36 +38,121 @@ class Metrics:
         self.dimension_3_value = dimension_3_value
 
         self.client = boto_client
+        self.logger = logging.getLogger()
+
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.statistics = {}
+        self.dropped = 0
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, name="metrics_sink", daemon=True)
+        self.thread.start()
 
     def write_metric(self, metric: Metric) -> None:
         self.write(metric.name, metric.value)
 
     def write(self, metric_name, metric_value) -> None:
+        try:
+            self.queue.put_nowait((metric_name, metric_value, datetime.now(timezone.utc)))
+        except queue.Full:
+            self.dropped += 1
+
+    def write_values(self, values: dict) -> None:
+        for name, value in values.items():
+            self.write(name, value)
+
+    def get_dimensions(self) -> list:
+        return [
+            {
+                'Name': self.dimension_1_name,
+                'Value': self.dimension_1_value
+            },
+            {
+                'Name': self.dimension_2_name,
+                'Value': self.dimension_2_value
+            },
+            {
+                'Name': self.dimension_3_name,
+                'Value': self.dimension_3_value
+            }
+        ]
+
+    def aggregate(self, metric_name, metric_value, timestamp) -> None:
+        statistics = self.statistics.get(metric_name)
+        if statistics is None:
+            self.statistics[metric_name] = {
+                'timestamp': timestamp,
+                'SampleCount': 1,
+                'Sum': metric_value,
+                'Minimum': metric_value,
+                'Maximum': metric_value,
+            }
+            return
+        statistics['SampleCount'] += 1
+        statistics['Sum'] += metric_value
+        statistics['Minimum'] = min(statistics['Minimum'], metric_value)
+        statistics['Maximum'] = max(statistics['Maximum'], metric_value)
+
+    def get_metric_data(self, metric_name, statistics) -> dict:
+        return {
+            'MetricName': metric_name,
+            'Dimensions': self.get_dimensions(),
+            'Timestamp': statistics['timestamp'],
+            'StatisticValues': {
+                'SampleCount': statistics['SampleCount'],
+                'Sum': statistics['Sum'],
+                'Minimum': statistics['Minimum'],
+                'Maximum': statistics['Maximum'],
+            },
+            'Unit': 'Count'  # The unit of the metric
+        }
+
+    def run(self) -> None:
+        while not self.closed:
+            self.drain(self.flush_interval)
+            self.flush()
+
+    def drain(self, timeout: float) -> None:
+        """Aggregates queued values until timeout seconds elapsed or the sink is closed"""
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                return
+            if item is None:
+                return
+            self.aggregate(*item)
+
+    def flush(self) -> None:
+        if self.dropped:
+            self.logger.error(f"Metrics : {self.dropped} metric values dropped, the metrics queue was full")
+            self.dropped = 0
+
+        if not self.statistics:
+            return
+        metric_data = [self.get_metric_data(name, statistics) for name, statistics in self.statistics.items()]
+        self.statistics = {}
+
+        for i in range(0, len(metric_data), self.MAX_METRIC_DATA):
+            try:
+                self.client.put_metric_data(
+                    Namespace=self.namespace,
+                    MetricData=metric_data[i:i + self.MAX_METRIC_DATA]
+                )
+            except Exception as e:
+                self.logger.error(f"Metrics : put_metric_data failed: {e}")
+
+    def close(self) -> None:
+        """Stops the background thread once the queued values are sent"""
 
-        self.client.put_metric_data(
-            Namespace=self.namespace,
-            MetricData=[
-                {
-                    'MetricName': metric_name,
-                    'Dimensions': [
-                        {
-                            'Name': self.dimension_1_name,
-                            'Value': self.dimension_1_value
-                        },
-                        {
-                            'Name': self.dimension_2_name,
-                            'Value': self.dimension_2_value
-                        },
-                        {
-                            'Name': self.dimension_3_name,
-                            'Value': self.dimension_3_value
-                        }
-                    ],
-                    'Value': metric_value,  # The value of the metric
-                    'Unit': 'Count'  # The unit of the metric
-                }
-            ]
-        )
-
-        # self.client.put_metric_data(Namespace=self.namespace,
-        #                             MetricData=[{"MetricName": metric_name, "Value": metric_value, "Unit": 'Count'}])
\ No newline at end of file
+        if self.closed:
+            return
+        self.closed = True
+        # wakes the thread up
+        self.queue.put(None)
+        self.thread.join()
+        self.drain(0)
+        self.flush()
@@ -0,0 +1,79 @@
+import time
+import threading
+
+
+class ProgressReporter:
+    """Reports the progress of a job on a time interval instead of once per item.
+
+    The job keeps its counters as plain integers. A background thread calls sample() every interval seconds
+    and emits one aggregated status line and one batched metrics call with the sampled counters, so the
+    hot loop of the job never logs or calls the metrics service itself.
+
+        sample   callable returning a dict of integer counters
+        errors   optional callable returning the latest errors, logged when they change
+        rate_of  name of the counter whose rate per second is added to the status line
+    """
+
+    def __init__(self, logger, name: str, sample, errors=None, interval: float = 30.0, rate_of: str = None):
+        self.logger = logger
+        self.name = name
+        self.sample = sample
+        self.errors = errors
+        self.interval = interval
+        self.rate_of = rate_of
+
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+        self.last_counters = {}
+        self.last_reported_at = time.monotonic()
+        self.last_errors = []
+
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        self.last_counters = dict(self.sample())
+        self.last_reported_at = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name="progress_reporter", daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                self.report()
+            except Exception as e:
+                self.logger.error(f"{self.name} progress report failed: {e}")
+
+    def stop(self) -> None:
+        """Stops the reporter thread and emits a last report, with its metrics even when unchanged"""
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.report(force=True)
+
+    def report(self, force: bool = False) -> None:
+        with self.lock:
+            counters = self.sample()
+            now = time.monotonic()
+
+            status = dict(counters)
+            if self.rate_of is not None and self.rate_of in counters:
+                elapsed = max(now - self.last_reported_at, 0.001)
+                delta = counters[self.rate_of] - self.last_counters.get(self.rate_of, 0)
+                status[f"{self.rate_of}_per_second"] = round(delta / elapsed, 1)
+
+            self.logger.info(f"### {self.name} status : {status}")
+            if force or counters != self.last_counters:
+                self.logger.write_metric_values(counters)
+
+            if self.errors is not None:
+                latest_errors = self.errors()
+                if latest_errors and latest_errors != self.last_errors:
+                    self.logger.info(f"{self.name} latest errors : {latest_errors}")
+                self.last_errors = latest_errors
+
+            self.last_counters = counters
+            self.last_reported_at = now